@@ -1,15 +1,18 @@
 # Standard library imports
-import concurrent.futures
-import functools
+import collections
 import logging
 import os
+import sys
 import time
 
-import numpy as np
 import pandas as pd
 
 import algo
+import combiner
+import daemon
 import helper
+import memory
+import rebalance
 import robinhood
 
 # Activate logging!
@@ -22,6 +25,18 @@ BUY_LIMIT = 1.0 + ((1.0 - EQUITY_UTILISATION) / 2.0)
 
 SECONDARY_MAX_IN_ONE = 5.0 / 6.0
 
+MIN_ORDER_VALUE = 0.0
+MIN_ORDER_FRACTION = 0.005
+TURNOVER_PENALTY = 0.0
+
+ALGO_EXECUTOR = algo.AlgoExecutor.THREADS
+ALGO_WORKERS = 8
+
+DAEMON_INTERVAL = 60.0
+DAEMON_THRESHOLD = 0.01
+DAEMON_MAX_AGE = 3600.0
+DAEMON_CALENDAR = 'market-hours.json'
+
 
 ##
 # Main entry point for this cloud function
@@ -34,6 +49,17 @@ def main(args={}):
     account_id = args.get('account', os.environ.get('ROBINHOOD_ACCOUNTID'))
     market_check = helper.truthy(args.get('market_check', True))
     execute = helper.truthy(args.get('execute', False))
+    executor_strategy = args.get('executor', ALGO_EXECUTOR)
+    cassette = args.get('cassette', os.environ.get('ALGO_CASSETTE'))
+    cassette_mode = args.get('cassette_mode', os.environ.get('ALGO_CASSETTE_MODE', 'replay'))
+    memory_budget = args.get('memory_budget', os.environ.get('ALGO_MEMORY_BUDGET'))
+    memory_budget = float(memory_budget) * 1048576 if memory_budget else None
+    memory_trace = helper.truthy(args.get('memory_trace', os.environ.get('ALGO_MEMORY_TRACE', False)))
+    policy = rebalance.RebalancePolicy(
+        min_value=args.get('min_order_value', MIN_ORDER_VALUE),
+        min_fraction=args.get('min_order_fraction', MIN_ORDER_FRACTION),
+        turnover_penalty=args.get('turnover_penalty', TURNOVER_PENALTY)
+    )
 
     # Preamble!
     logging.info('Beginning algo with options:')
@@ -42,18 +68,20 @@ def main(args={}):
     logging.info('  account:   %s', account_id)
     logging.info('  market_check: %s', market_check)
     logging.info('  execute:   %s', execute)
-
-    # Activate a Robinhood client
-    with robinhood.Client(username=username, password=password, account_id=account_id) as client:
+    logging.info('  policy:    %s', policy)
+    logging.info('  executor:  %s', executor_strategy)
+    logging.info('  cassette:  %s (%s)', cassette, cassette_mode)
+    logging.info('  memory:    budget %s, trace %s', memory_budget, memory_trace)
+
+    # Activate a Robinhood client, within the memory budget
+    with memory.MemoryTracker(budget=memory_budget, trace=memory_trace) as tracker, \
+            robinhood.Client(username=username, password=password, account_id=account_id,
+                             pool_size=ALGO_WORKERS, cassette=cassette, cassette_mode=cassette_mode) as client:
         order_manager = robinhood.OrderManager(client)
+        tracker.on_pressure(client.cache.shed)
 
         # Assemble algos
-        primary_algos = [
-            algo.WatchlistAlgo(client, 1.0)
-        ]
-        secondary_algos = [
-            # algo.UniverseSharpeAlgo(client, ['SPY', 'TLT', 'HYG'], lookback=21)
-        ]
+        algos_by_tier = assemble_algos(client)
 
         # Check if markets are open
         if market_check:
@@ -67,147 +95,232 @@ def main(args={}):
                     "success": False
                 }
 
-        # Multithreading goodness
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Execute primaries and secondaries
-            primary_weights = [executor.submit(aa.optimise) for aa in primary_algos]
-            secondary_weights = [executor.submit(aa.optimise) for aa in secondary_algos]
-
-            # Calculate secondaries
-            # a. Unwrap weights
-            # b. Add all weights together
-            # c. Re-scale to 1.0
-            # d. Limit individual entries to no more than SECONDARY MAX (currently 5/6ths)
-            if secondary_weights:
-                secondary_weights = [future.result() for future in secondary_weights]
-                secondary_weights = functools.reduce((lambda a, b: a.add(b, fill_value=0.0)), secondary_weights)
-                secondary_weights /= secondary_weights.sum()
-                secondary_weights[secondary_weights > SECONDARY_MAX_IN_ONE] = SECONDARY_MAX_IN_ONE
-            else:
-                secondary_weights = pd.Series()
-
-            # Calculate primaries
-            # a. Unwrap weights
-            # b. Add all weights together
-            # c. Limit to 1/12 of portfolio
-            # c. Re-scale to 1.0 if > 1.0
-            if primary_weights:
-                primary_weights = [future.result() for future in primary_weights]
-                primary_weights = functools.reduce((lambda a, b: a.add(b, fill_value=0.0)), primary_weights)
-                primary_weights[primary_weights > MAX_IN_ONE] = MAX_IN_ONE
-                if primary_weights.sum() > 1.0:
-                    primary_weights /= primary_weights.sum()
-            else:
-                primary_weights = pd.Series()
-
-            # Merge primary and secondary
-            # a. Calculate Primary's unused portion of portfolio
-            # b. Scale Secondary to fit unused portfolio
-            # c. Add weights together
-            if primary_weights.any():
-                secondary_weights *= (1.0 - primary_weights.sum())
-            target_portfolio_weights = primary_weights.add(secondary_weights, fill_value=0.0)
+        # Prices are loaded by the algos, so decide before then whether they must be held at reduced precision
+        tracker.check()
 
-        # Short circuit if no target portfolio is found!
-        if target_portfolio_weights.empty:
-            target_portfolio_weights = algo.UniverseSharpeAlgo(client, ['TLT', 'HYG', 'SPY']).optimise()
+        # Multithreading goodness
+        with tracker.stage('algos'), algo.AlgoExecutor(executor_strategy, max_workers=ALGO_WORKERS) as executor:
+            target_portfolio_weights = calculate_target_weights(client, executor, algos_by_tier)
 
         # Short circuit if no target portfolio is found!
         if target_portfolio_weights.empty:
             return {'status': 'error', 'reason': 'No optimal portfolio found.', 'success': False}
 
+        with tracker.stage('plan'):
+            snapshot = client.snapshot()
+            plan = plan_orders(client, target_portfolio_weights, policy, snapshot=snapshot)
+        with tracker.stage('orders'):
+            place_orders(order_manager, plan, execute)
+
+        logging.info('Transport: %s', client.api.transport_stats())
+
+        # Boring stuff! Balances are reported as planned with, from the snapshot
+        current_portfolio, target_portfolio, mid_quotes = plan.current, plan.allocation.shares, plan.quotes
+        return {
+            'current_portfolio': dict(current_portfolio),
+            'target_portfolio': dict(target_portfolio),
+            'delta': dict(plan.delta),
+            'capital': {
+                'equity': snapshot.equity,
+                'margin': snapshot.margin,
+                'total': plan.capital,
+                'unallocated': plan.allocation.cash
+            },
+            'portfolio_value': {
+                'current': (current_portfolio * mid_quotes).sum(),
+                'target': (target_portfolio * mid_quotes).sum()
+            },
+            'memory': tracker.report()
+        }
+
+
+##
+# Run as a long-running service: stay logged in, poll quotes and rebalance intraday whenever inputs move materially
+# @args As for main, plus interval (seconds between polls), threshold (the relative quote move that triggers a
+#   rebalance) and max_age (seconds after which to rebalance regardless); execute defaults to ALGO_EXECUTE
+def serve(args={}):
+    execute = helper.truthy(args.get('execute', os.environ.get('ALGO_EXECUTE', False)))
+    memory_budget = args.get('memory_budget', os.environ.get('ALGO_MEMORY_BUDGET'))
+    memory_budget = float(memory_budget) * 1048576 if memory_budget else None
+    executor_strategy = args.get('executor', ALGO_EXECUTOR)
+    policy = rebalance.RebalancePolicy(
+        min_value=args.get('min_order_value', MIN_ORDER_VALUE),
+        min_fraction=args.get('min_order_fraction', MIN_ORDER_FRACTION),
+        turnover_penalty=args.get('turnover_penalty', TURNOVER_PENALTY)
+    )
+
+    # The budget is checked on every tick, as the price window grows through the day
+    with memory.MemoryTracker(budget=memory_budget) as tracker, \
+            robinhood.Client(username=args.get('username'), password=args.get('password'),
+                             account_id=args.get('account'), pool_size=ALGO_WORKERS,
+                             calendar=os.environ.get('ROBINHOOD_CALENDAR', DAEMON_CALENDAR),
+                             prefetch_calendar=True) as client, \
+            algo.AlgoExecutor(executor_strategy, max_workers=ALGO_WORKERS) as executor:
+        tracker.on_pressure(client.cache.shed)
+        algos_by_tier = assemble_algos(client)
+
+        # Price-driven algos read the daemon's price window instead of fetching history on every rebalance
+        def optimise(prices):
+            universe = set()
+            for a in [a for algos in algos_by_tier for a in algos if hasattr(a, 'panel')]:
+                a.panel = prices
+                universe.update(a.symbols())
+            return calculate_target_weights(client, executor, algos_by_tier), universe
+
+        service = daemon.Daemon(
+            client, optimise,
+            plan=lambda weights, quotes: plan_orders(client, weights, policy, quotes),
+            place=lambda plan: place_orders(robinhood.OrderManager(client), plan, execute),
+            interval=float(args.get('interval', DAEMON_INTERVAL)),
+            threshold=float(args.get('threshold', DAEMON_THRESHOLD)),
+            max_age=float(args.get('max_age', DAEMON_MAX_AGE))
+        )
+        service.run()
+
+
+##
+# The algos to run, by tier, in priority order
+def assemble_algos(client):
+    primary_algos = [
+        algo.WatchlistAlgo(client, 1.0)
+    ]
+    secondary_algos = [
+        # algo.UniverseSharpeAlgo(client, ['SPY', 'TLT', 'HYG'], lookback=21)
+    ]
+    return primary_algos, secondary_algos
+
+
+##
+# Run every algo and combine their weights into the target portfolio weights
+# @return A pandas.Series of weights, empty if no target portfolio is found
+def calculate_target_weights(client, executor, algos_by_tier):
+
+    # Weights are combined tier by tier, in priority order
+    # a. Primaries are capped at MAX IN ONE, and re-scaled to 1.0 only if over 1.0
+    # b. Secondaries are re-scaled to 1.0, capped at SECONDARY MAX IN ONE, and fit into the unused portfolio
+    tiers = combiner.TierCombiner([
+        combiner.Tier('primary', cap=MAX_IN_ONE, normalise=combiner.SHRINK),
+        combiner.Tier('secondary', cap=SECONDARY_MAX_IN_ONE, normalise=combiner.ALWAYS)
+    ])
+
+    # Execute primaries and secondaries
+    futures = [[executor.submit(aa) for aa in algos] for algos in algos_by_tier]
+    target_portfolio_weights = tiers.combine(*[[f.result() for f in tier] for tier in futures])
+
+    # Short circuit if no target portfolio is found!
+    if target_portfolio_weights.empty:
+        target_portfolio_weights = algo.UniverseSharpeAlgo(client, ['TLT', 'HYG', 'SPY']).optimise()
+
+    if not target_portfolio_weights.empty:
         logging.info('Target weights: %s',
-                     ', '.join(['{}: {:0.1f}%'.format(s, w * 100.0) for s, w in target_portfolio_weights.iteritems()]))
+                     ', '.join(['{}: {:0.1f}%'.format(s, w * 100.0) for s, w in target_portfolio_weights.items()]))
         logging.debug(target_portfolio_weights.round(2))
+    return target_portfolio_weights
 
-        # Determine available captial to play with
-        logging.info('STEP 4: CAPITAL')
-        capital = (client.equity * EQUITY_UTILISATION) + (client.margin * MARGIN_UTILISATION)
-        logging.info('Capital: %s (equity: %s, margin: %s)', capital, client.equity, client.margin)
 
-        # Get mid quotes
-        logging.info('STEP 5: QUOTES')
+##
+# The orders needed to move from the current portfolio to the target
+# @capital The capital available
+# @quotes A pandas.Series of mid quotes per symbol
+# @allocation A helper.Allocation of the target holdings
+# @current A pandas.Series of currently held shares per symbol
+# @delta A pandas.Series of shares to trade per symbol, after the rebalance policy
+Plan = collections.namedtuple('Plan', ['capital', 'quotes', 'allocation', 'current', 'delta'])
+
+
+##
+# Convert target weights into the orders needed to reach them
+# @quotes Mid quotes to use, if already known; any missing symbols are fetched
+# @snapshot The robinhood.AccountSnapshot to plan against; one is taken if not given
+# @return A Plan
+def plan_orders(client, target_portfolio_weights, policy, quotes=None, snapshot=None):
+
+    # Determine available captial to play with
+    logging.info('STEP 4: CAPITAL')
+    snapshot = snapshot or client.snapshot()
+    capital = (snapshot.equity * EQUITY_UTILISATION) + (snapshot.margin * MARGIN_UTILISATION)
+    logging.info('Capital: %s (equity: %s, margin: %s)', capital, snapshot.equity, snapshot.margin)
+
+    # Get mid quotes
+    logging.info('STEP 5: QUOTES')
+    if quotes is None or not target_portfolio_weights.index.isin(quotes.index).all():
         mid_quotes = client.quotes(*target_portfolio_weights.index)
-        logging.info('Found quotes: %s', ', '.join(['{}@{:0.4f}'.format(s, q) for s, q in mid_quotes.iteritems()]))
-        logging.debug(mid_quotes)
-
-        # Convert the target weights into target positions
-        logging.info('STEP 6: TARGET HOLDINGS')
-        target_portfolio = calculate_target_portfolio(target_portfolio_weights, mid_quotes, capital)
-        logging.info('Target holdings: %s', portfolio_stringify(target_portfolio))
-        logging.debug(target_portfolio)
-
-        # Calculate total portfolio value...
-        capital_used = (target_portfolio * mid_quotes).sum()
-        capital_utilisation = capital_used / capital
-        logging.info('TOTAL PORTFOLIO VALUE: %s (%s)', capital_used, capital_utilisation)
-
-        # Get the current portfolio
-        logging.info('STEP 7: CURRENT HOLDINGS')
-        current_portfolio = client.open_positions()
-        logging.info('Current holdings: %s', portfolio_stringify(current_portfolio))
-        logging.debug(current_portfolio)
-
-        # Calculate the necessary movements
-        logging.info('STEP 8: DETERMINE MOVEMENTS')
-        portfolio_delta = target_portfolio.subtract(current_portfolio, fill_value=0.0).sort_values()
-        logging.info('Delta: %s', portfolio_stringify(portfolio_delta))
-        logging.debug(portfolio_delta)
-
-        # Perform sells
-        logging.info('STEP 9: SELL')
-        for symbol, delta in portfolio_delta[portfolio_delta < 0].iteritems():
-            order_manager.sell(symbol, abs(delta))
-        if execute:
-            order_manager.execute()
-
-        # Sleep a bit...
-        if execute:
-            logging.info('TAKE A BREATH...')
-            time.sleep(5)
-
-        # Perform buys
-        logging.info('STEP 10: BUY')
-        for symbol, delta in portfolio_delta[portfolio_delta > 0].iteritems():
-            limit = round(mid_quotes[symbol] * BUY_LIMIT, 2)
-            order_manager.buy(symbol, abs(delta), limit=limit)
-        if execute:
-            order_manager.execute()
-
-    # Boring stuff!
-    return {
-        'current_portfolio': dict(current_portfolio),
-        'target_portfolio': dict(target_portfolio),
-        'delta': dict(portfolio_delta),
-        'capital': {
-            'equity': client.equity,
-            'margin': client.margin,
-            'total': capital
-        },
-        'portfolio_value': {
-            'current': (current_portfolio * mid_quotes).sum(),
-            'target': (target_portfolio * mid_quotes).sum()
-        }
-    }
+    else:
+        mid_quotes = quotes[target_portfolio_weights.index]
+    logging.info('Found quotes: %s', ', '.join(['{}@{:0.4f}'.format(s, q) for s, q in mid_quotes.items()]))
+    logging.debug(mid_quotes)
+
+    # Convert the target weights into target positions
+    logging.info('STEP 6: TARGET HOLDINGS')
+    allocation = calculate_target_portfolio(target_portfolio_weights, mid_quotes, capital)
+    target_portfolio = allocation.shares
+    logging.info('Target holdings: %s', portfolio_stringify(target_portfolio))
+    logging.info('Unallocated cash: %0.2f (tracking error: %0.4f)', allocation.cash, allocation.tracking_error)
+    logging.debug(target_portfolio)
+
+    # Calculate total portfolio value...
+    capital_used = (target_portfolio * mid_quotes).sum()
+    capital_utilisation = capital_used / capital
+    logging.info('TOTAL PORTFOLIO VALUE: %s (%s)', capital_used, capital_utilisation)
+
+    # Get the current portfolio
+    logging.info('STEP 7: CURRENT HOLDINGS')
+    current_portfolio = pd.Series(dict(snapshot.positions), dtype=float)
+    logging.info('Current holdings: %s', portfolio_stringify(current_portfolio))
+    logging.debug(current_portfolio)
+
+    # Calculate the necessary movements
+    logging.info('STEP 8: DETERMINE MOVEMENTS')
+    portfolio_delta = target_portfolio.subtract(current_portfolio, fill_value=0.0).sort_values()
+    logging.info('Delta: %s', portfolio_stringify(portfolio_delta))
+    logging.debug(portfolio_delta)
+
+    # Drop movements that are not worth trading
+    logging.info('STEP 8a: REBALANCE POLICY')
+    portfolio_delta = policy.apply(portfolio_delta, current_portfolio, mid_quotes, capital)
+    logging.info('Orders: %s', portfolio_stringify(portfolio_delta))
+
+    return Plan(capital, mid_quotes, allocation, current_portfolio, portfolio_delta)
+
+
+##
+# Place a plan's orders, sells first so their proceeds are available to the buys
+# @return The number of orders placed
+def place_orders(order_manager, plan, execute):
+    portfolio_delta, mid_quotes = plan.delta, plan.quotes
+
+    # Perform sells
+    logging.info('STEP 9: SELL')
+    for symbol, delta in portfolio_delta[portfolio_delta < 0].items():
+        order_manager.sell(symbol, abs(delta))
+    if execute:
+        order_manager.execute()
+
+    # Sleep a bit...
+    if execute:
+        logging.info('TAKE A BREATH...')
+        time.sleep(5)
+
+    # Perform buys
+    logging.info('STEP 10: BUY')
+    for symbol, delta in portfolio_delta[portfolio_delta > 0].items():
+        limit = round(mid_quotes[symbol] * BUY_LIMIT, 2)
+        order_manager.buy(symbol, abs(delta), limit=limit)
+    if execute:
+        order_manager.execute()
+
+    return int((portfolio_delta != 0).sum())
 
 
 def portfolio_stringify(portfolio):
-    return ', '.join(['{}: {:0.0f}'.format(symbol, quantity) for symbol, quantity in portfolio.iteritems()])
+    return ', '.join(['{}: {:0.0f}'.format(symbol, quantity) for symbol, quantity in portfolio.items()])
 
 
 ##
 # Calculate the target portfolio units
+# @return A helper.Allocation of whole shares, unspent cash and tracking error
 def calculate_target_portfolio(weights, mid_quotes, capital):
-    # Determine portion assigned to each asset
-    capital_weights = weights * float(capital)
-
-    # Divide the capital weight of each asset by its mid-quote
-    shares = capital_weights.divide(mid_quotes, fill_value=0.0)
-
-    # Round the share (no fractional shares here)
-    shares = np.around(shares, 0)
-
-    return shares
+    return helper.allocate_shares(weights, mid_quotes, capital, max_weight=MAX_IN_ONE)
 
 
 def train():
@@ -217,7 +330,10 @@ def train():
 ##
 # Run pre-set-ups
 if __name__ == "__main__":
-    c = robinhood.Client()
-    om = robinhood.OrderManager(c)
+    if sys.argv[1:2] == ['serve']:
+        serve({'execute': True} if '--execute' in sys.argv[2:] else {})
+    else:
+        c = robinhood.Client()
+        om = robinhood.OrderManager(c)
 
 #   tsla = algo.DNNAlgo('TSLA')
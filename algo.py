@@ -1,7 +1,9 @@
 # Standard library imports
+import concurrent.futures
 import pandas as pd
 import logging
 
+import columnar
 import helper
 
 
@@ -9,6 +11,9 @@ import helper
 # Algo base, for working with signals and other items
 class Algo(object):
 
+    # Whether optimising is dominated by computation (True) or by waiting on I/O (False)
+    CPU_BOUND = False
+
     def optimise(self):
         return None
 
@@ -60,67 +65,123 @@ class WatchlistAlgo(ClientAlgo):
 # SharpeAlgo, which calculates the optimal Sharpe portfolio given a set of assets
 class SharpeAlgo(ClientAlgo):
 
+    CPU_BOUND = True
+
+    # Covariance estimators
+    SAMPLE = 'sample'
+    FACTOR = 'factor'
+
     ##
     # Initialise with a client object
     # @client A robinhood.Client object
-    def __init__(self, client, lookback=21, min_lookback=7):
+    # @panel An optional pandas.DataFrame of prices (such as from bars.store_panel) to use instead of the client
+    # @covariance SAMPLE for the full sample covariance, or FACTOR for a low-rank factor model suited to large universes
+    # @factors The number of factors in the FACTOR model
+    def __init__(self, client, lookback=21, min_lookback=7, panel=None, covariance=SAMPLE, factors=3):
         super().__init__(client)
         self.lookback = lookback
         self.min_lookback = min_lookback
+        self.panel = panel
+        self.covariance = covariance
+        self.factors = factors
+        self.solver_stats = None
+
+    def optimise(self):
+        u = self.symbols()
+        p = self.prices(u)
+        w = self.weights(p)
+        return w
+
+    ##
+    # Fetch prices here, and hand back the optimisation as a picklable task for running in another process
+    # @returns A tuple of a module-level function and its arguments; the function returns (weights, symbols)
+    def task(self):
+        p = self.prices(self.symbols()).astype(float)
+        return sharpe_weights, (p.values, list(p.index), list(p.columns), self.lookback, self.min_lookback,
+                                self.covariance, self.factors)
 
     ##
     # Get all prices for the given universe
     # @returns A pandas dataframe of prices; vertical axis are dates and horizontal axis are symbols
     def prices(self, universe):
-        prices = self.client.historical_prices(*universe).iloc[-self.lookback:]
+        if self.panel is not None:
+            prices = self._panel_prices(universe)
+        else:
+            prices = self.client.historical_prices(*universe).iloc[-self.lookback:]
         logging.info('Found prices %s - %s for %s', prices.index[0], prices.index[-1], ", ".join(list(prices.columns)))
         logging.debug(prices)
         return prices
 
+    def _panel_prices(self, universe):
+        missing = [symbol for symbol in universe if symbol not in self.panel]
+        if missing:
+            logging.warning('No prices in panel for %s', ', '.join(missing))
+        universe = [symbol for symbol in universe if symbol in self.panel]
+        return self.panel[universe].dropna().iloc[-self.lookback:]
+
     def weights(self, prices):
         target_weights = self._calculate_target_weights(prices)
         logging.info('Target weights: %s',
-                     ', '.join(['{}: {:0.1f}%'.format(s, w * 100.0) for s, w in target_weights.iteritems()]))
+                     ', '.join(['{}: {:0.1f}%'.format(s, w * 100.0) for s, w in target_weights.items()]))
         logging.debug(target_weights.round(2))
         return target_weights
 
     ##
-    # Calculate the optimal Sharpe portfolio
+    # Calculate the optimal Sharpe portfolio.
+    # Consecutive windows differ by a single day, so each window's solve starts from the previous window's solution;
+    # the method, iterations and time of each solve are kept in solver_stats.
     def _calculate_target_weights(self, prices):
         prices = prices.astype(float)
         best_weights, best_sharpe, best_days = None, 0.0, 0
 
-        collected_weights = []
+        collected_weights, stats, solution = [], [], None
 
         while len(prices.index) >= self.min_lookback:
-            weights, sharpe = self._calculate_target_weights_inner(prices)
+            weights, sharpe, solution = self._calculate_target_weights_inner(prices, solution)
             weights['(SHARPE)'] = sharpe
             weights.name = len(prices.index)
             collected_weights.append(weights)
+            if solution is not None:
+                stats.append((weights.name, solution.method, solution.iterations, solution.seconds))
 
             if sharpe >= best_sharpe:
                 best_weights, best_sharpe, best_days = weights, sharpe, weights.name
             prices = prices[1:]
 
+        self.solver_stats = pd.DataFrame(stats, columns=['days', 'method', 'iterations', 'seconds']).set_index('days')
         logging.debug(pd.concat(collected_weights, axis=1).round(2))
-        logging.info('Best days %i', best_days)
+        logging.debug(self.solver_stats)
+        logging.info('Best days %i; %i solver iterations in %0.3fs', best_days, self.solver_stats['iterations'].sum(),
+                     self.solver_stats['seconds'].sum())
 
+        # No window with a positive Sharpe means holding cash
+        if best_weights is None:
+            return pd.Series(dtype=float)
         return best_weights.drop('(SHARPE)')
 
-    def _calculate_target_weights_inner(self, prices):
+    ##
+    # Optimise one window
+    # @start A helper.TangencySolution from a similar window to start from, or None
+    # @return A tuple of the weights, their annualised sharpe and the helper.TangencySolution, if there is one
+    def _calculate_target_weights_inner(self, prices, start=None):
         # Perform general calculations
         expected_returns = (prices.iloc[-1] / prices.iloc[0]) - 1
         returns = prices.pct_change()
-        covariance = returns.cov()
 
         # Run the tangency optimiser; on failure, return an empty series and a 0 sharpe.
         try:
-            w = helper.tangency_portfolio(covariance, expected_returns)
-            return w, helper.annualized_sharpe(returns, covariance, w)
+            if self.covariance == self.FACTOR:
+                covariance = helper.factor_covariance(returns, self.factors)
+                w = helper.factor_tangency_portfolio(covariance, expected_returns)
+                return w, helper.annualized_sharpe(returns, covariance, w), None
+
+            covariance = returns.cov()
+            solution = helper.solve_tangency(covariance, expected_returns, start=start)
+            return solution.weights, helper.annualized_sharpe(returns, covariance, solution.weights), solution
 
         except ValueError as e:
             logging.error(e)
-            return pd.Series(), 0.0
+            return pd.Series(), 0.0, None
 
 
 ##
@@ -130,28 +191,21 @@ class UniverseSharpeAlgo(SharpeAlgo):
     ##
     # Create a new defined-universe Sharpe algo
     # @universe An iterable list of symbols representing the universe
-    def __init__(self, client, universe, lookback=21, min_lookback=9):
-        super().__init__(client, lookback, min_lookback)
+    def __init__(self, client, universe, lookback=21, min_lookback=9, panel=None, covariance=SharpeAlgo.SAMPLE,
+                 factors=3):
+        super().__init__(client, lookback, min_lookback, panel, covariance, factors)
         self.universe = universe
 
-    def optimise(self):
-        u = self.universe
-        p = self.prices(u)
-        w = self.weights(p)
-        return w
+    def symbols(self):
+        return self.universe
 
 
 ##
 # Sharpe Algo class - for handling the calculations!
 class WatchlistSharpeAlgo(SharpeAlgo):
 
-    ##
-    # Optimise
-    def optimise(self):
-        u = self.universe()
-        p = self.prices(u)
-        w = self.weights(p)
-        return w
+    def symbols(self):
+        return self.universe()
 
     ##
     # Get the universe of stocks from the Robinhood Watchlist
@@ -162,6 +216,57 @@ class WatchlistSharpeAlgo(SharpeAlgo):
         return universe
 
 
+##
+# Optimise a Sharpe portfolio from raw price arrays; safe to run in a worker process
+# @returns A tuple of a weights array and the matching symbols
+def sharpe_weights(values, dates, symbols, lookback, min_lookback, covariance=SharpeAlgo.SAMPLE, factors=3):
+    prices = pd.DataFrame(values, index=dates, columns=symbols)
+    weights = SharpeAlgo(None, lookback, min_lookback, covariance=covariance, factors=factors).weights(prices)
+    return weights.values, list(weights.index)
+
+
+##
+# Run algos concurrently. I/O-bound algos always run on threads; with the PROCESSES strategy, CPU-bound algos fetch
+# their inputs on a thread and then optimise in a worker process, away from the GIL.
+class AlgoExecutor(object):
+    THREADS = 'threads'
+    PROCESSES = 'processes'
+
+    def __init__(self, strategy=THREADS, max_workers=None):
+        if strategy not in {self.THREADS, self.PROCESSES}:
+            raise ValueError('Unknown executor strategy {}'.format(strategy))
+        self.strategy = strategy
+        self.max_workers = max_workers
+        self.threads, self.processes = None, None
+
+    def __enter__(self):
+        self.threads = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        if self.strategy == self.PROCESSES:
+            try:
+                self.processes = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+            except (OSError, NotImplementedError) as e:
+                logging.warning('Process pool unavailable, running all algos on threads: %s', e)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.threads.shutdown()
+        if self.processes:
+            self.processes.shutdown()
+
+    ##
+    # Start optimising an algo
+    # @returns A future resolving to a pandas.Series of weights
+    def submit(self, algo):
+        if self.processes and algo.CPU_BOUND:
+            return self.threads.submit(self._optimise_in_process, algo)
+        return self.threads.submit(algo.optimise)
+
+    def _optimise_in_process(self, algo):
+        function, args = algo.task()
+        weights, symbols = self.processes.submit(function, *args).result()
+        return pd.Series(weights, index=symbols)
+
+
 def filename_for(kind, name):
     return "./data/%s/%s.csv" % (kind, name,)
 
@@ -180,7 +285,7 @@ def test_filename_for(symbol):
 
 def data_for(kind, name):
     filename = filename_for(kind, name)
-    return pd.read_csv(filename, index_col=0)
+    return columnar.read_csv(filename, index_col=0)
 
 
 def source_data_for(name):
@@ -254,62 +359,4 @@ def test_data_for(name):
 #       shuffle=shuffle)
 #
 #
-# def parse_yahoo(name):
-#
-#   # Read data from source and convert to percent changes
-#   data = source_data_for(name)
-#
-#   data = data.pct_change()
-#
-#   # Prepare an empty list to hold the results
-#   outputs = []
-#
-#   # For every lookback window...
-#   for lookback in DNNAlgo.LOOKBACKS:
-#     # Shift the data for this lookback
-#     lookback_data = data.shift(lookback - 1)
-#
-#     tmp = pd.DataFrame()
-#
-#     # Add key values
-#     tmp['O%i' % (lookback,)] = lookback_data['Open']
-#     tmp['H%i' % (lookback,)] = lookback_data['High']
-#     tmp['L%i' % (lookback,)] = lookback_data['Low']
-#     tmp['C%i' % (lookback,)] = lookback_data['Close']
-#     tmp['A%i' % (lookback,)] = lookback_data['Adj Close']
-#     tmp['V%i' % (lookback,)] = lookback_data['Volume']
-#
-#     # Calculate measures over a rolling window
-#     columns = list(tmp.columns.values)
-#     for period in DNNAlgo.PERIODS:
-#       for column in columns:
-#         rolling = tmp[column].rolling(window=period)
-#         tmp['SMA%i_%s' % (period, column)] = rolling.mean()
-#         tmp['MAX%i_%s' % (period, column)] = rolling.max()
-#         tmp['MIN%i_%s' % (period, column)] = rolling.min()
-#         tmp['STD%i_%s' % (period, column)] = rolling.std()
-#
-#     outputs.append(tmp)
-#
-#   outputs = pd.DataFrame().join(outputs, how='outer')
-#
-#   # Determine action
-#   outputs['action'] = (data['Open'].shift(-1) > data['Open']).astype(int)
-#
-#   # Clean NAs
-#   outputs = outputs.dropna()
-#
-#   # Save!
-#   shuffled = outputs.sample(frac=1).round(6)
-#   shuffled.index.name = 'Date'
-#   count = int(len(shuffled) * 0.8)
-#
-#   # Training set
-#   training_filename = training_filename_for(name)
-#   shuffled[:count].to_csv(training_filename)
-#
-#   # Testing set
-#   test_filename = test_filename_for(name)
-#   shuffled[count:].to_csv(test_filename)
-#
-#   return outputs
+# Feature generation for this algo lives in features.parse_yahoo
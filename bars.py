@@ -0,0 +1,70 @@
+# Standard library imports
+import pandas as pd
+
+##
+# How each OHLCV column combines when bars are merged into a larger interval
+AGGREGATIONS = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+
+
+##
+# Resample a stream of high-frequency bars into larger intervals, one chunk at a time.
+# Only the last, possibly incomplete, interval of each chunk is held back and merged into the next, so the full history
+# is never in memory at once.
+# @chunks An iterable of pandas.DataFrames of bars, indexed by timestamp, oldest first
+# @interval A pandas frequency, such as '1D', '1h' or '15min'
+# @return A generator of pandas.DataFrames of OHLCV bars; intervals without any bars are skipped
+def resample_chunks(chunks, interval='1D'):
+    pending = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        aggregations = {column: how for column, how in AGGREGATIONS.items() if column in chunk}
+        bars = _group(chunk, interval).agg(aggregations).dropna(subset=['close'])
+
+        # Merge the interval held over from the previous chunk
+        if pending is not None:
+            bars = pd.concat([pending, bars]).groupby(level=0).agg(aggregations)
+
+        if len(bars) > 1:
+            yield bars.iloc[:-1]
+        pending = bars.iloc[-1:]
+
+    if pending is not None and not pending.empty:
+        yield pending
+
+
+##
+# Group bars into intervals. Fixed-length intervals are counted from the epoch, so they line up across chunks whatever
+# each chunk's first timestamp; calendar intervals (weeks, months) are anchored to the calendar.
+def _group(bars, interval):
+    try:
+        length = pd.Timedelta(interval)
+    except ValueError:
+        return bars.resample(interval)
+
+    epoch = pd.Timestamp(0, tz=bars.index.tz)
+    return bars.groupby((epoch + ((bars.index - epoch) // length) * length).rename(bars.index.name))
+
+
+##
+# Build a panel of closing prices from streams of bars
+# @chunks_by_symbol A dict of symbol to an iterable of bar chunks
+# @return A pandas.DataFrame of closes; vertical axis are interval start times and horizontal axis are symbols
+def close_panel(chunks_by_symbol, interval='1D'):
+    closes = {}
+    for symbol, chunks in chunks_by_symbol.items():
+        resampled = [bars['close'] for bars in resample_chunks(chunks, interval)]
+        closes[symbol] = pd.concat(resampled) if resampled else pd.Series(dtype=float)
+    return pd.DataFrame(closes)
+
+
+##
+# Build a panel of closing prices from a tiingo.BarStore
+def store_panel(store, symbols, interval='1D', start=None, end=None):
+    return close_panel({symbol: store.chunks(symbol, start, end) for symbol in symbols}, interval)
+
+
+##
+# Convert a panel of prices into simple returns
+def returns_panel(prices):
+    return prices.pct_change().iloc[1:]
@@ -0,0 +1,117 @@
+# Standard library imports
+import glob
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Caches live in this directory, next to the CSVs they were built from
+CACHE_DIRECTORY = '.columnar'
+
+
+##
+# Find the cache directory for a CSV file
+# @return A directory path, e.g. ./data/.columnar/CHK for ./data/CHK.csv
+def cache_path_for(filename):
+    directory, name = os.path.split(filename)
+    return os.path.join(directory, CACHE_DIRECTORY, os.path.splitext(name)[0])
+
+
+##
+# Read a CSV through a binary columnar cache.
+# The first read parses the CSV and writes each column as a .npy file; later reads memory-map those files instead of
+# parsing text. The cache is rebuilt whenever the CSV's modification time or size changes.
+# Only numeric (and datetime) columns and indexes are zero-copy views over the mapped files. String columns and
+# indexes, such as dates kept as text, are still copied into Python strings on every read, though without parsing.
+# @return A pandas.DataFrame, the same as pd.read_csv(filename, index_col=index_col)
+def read_csv(filename, index_col=0):
+    cache = cache_path_for(filename)
+    frame = _load(cache, filename, index_col)
+    if frame is None:
+        frame = pd.read_csv(filename, index_col=index_col)
+        _store(frame, cache, filename, index_col)
+    return frame
+
+
+##
+# Convert every CSV in a directory, skipping any whose cache is already fresh
+# @return A list of converted filenames
+def convert_directory(directory='./data', index_col=0):
+    converted = []
+    for filename in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        if _load(cache_path_for(filename), filename, index_col) is None:
+            _store(pd.read_csv(filename, index_col=index_col), cache_path_for(filename), filename, index_col)
+            converted.append(filename)
+    return converted
+
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _load(cache, filename, index_col):
+    try:
+        with open(os.path.join(cache, 'meta.json')) as file:
+            meta = json.load(file)
+    except (IOError, ValueError):
+        return None
+
+    if meta['source'] != _source_stamp(filename) or meta['index_col'] != index_col:
+        return None
+
+    # Copy-on-write maps: nothing is read until used, and writes never reach the file
+    index = _restore(np.load(os.path.join(cache, 'index.npy'), mmap_mode='c'), meta['index_kind'])
+    columns = {
+        name: _restore(np.load(os.path.join(cache, '{}.npy'.format(number)), mmap_mode='c'), kind)
+        for number, (name, kind) in enumerate(zip(meta['columns'], meta['kinds']))
+    }
+    frame = pd.DataFrame(columns, index=pd.Index(index, name=meta['index_name']), columns=meta['columns'], copy=False)
+    return frame
+
+
+def _store(frame, cache, filename, index_col):
+    arrays = [_encode(frame.index.values)] + [_encode(frame[name].values) for name in frame.columns]
+    if any(array is None for array, kind in arrays):
+        logging.debug('Not caching %s: it has mixed-type columns', filename)
+        return
+
+    # Write the columns first and the metadata last, so a partly written cache is never read
+    shutil.rmtree(cache, ignore_errors=True)
+    os.makedirs(cache)
+    np.save(os.path.join(cache, 'index.npy'), arrays[0][0])
+    for number, (array, kind) in enumerate(arrays[1:]):
+        np.save(os.path.join(cache, '{}.npy'.format(number)), array)
+
+    meta = {
+        'source': _source_stamp(filename),
+        'index_col': index_col,
+        'index_name': frame.index.name,
+        'index_kind': arrays[0][1],
+        'columns': list(frame.columns),
+        'kinds': [kind for array, kind in arrays[1:]]
+    }
+    with open(os.path.join(cache, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+
+
+##
+# Convert an array into something that can be memory-mapped: numeric arrays as they are, strings as fixed-width unicode
+# @return A tuple of the array and its kind, or (None, None) if it cannot be stored
+def _encode(values):
+    values = np.asarray(values)
+    if values.dtype.kind in 'biufmM':
+        return values, 'native'
+    if all(isinstance(value, str) for value in values):
+        return np.array(values, dtype=str), 'str'
+    return None, None
+
+
+##
+# Turn a mapped array back into column values; numeric columns stay as plain views over the mapped file, while string
+# columns are copied out into Python objects, as pandas holds them
+def _restore(array, kind):
+    return array.astype(object) if kind == 'str' else array.view(np.ndarray)
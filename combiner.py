@@ -0,0 +1,99 @@
+# Standard library imports
+import logging
+
+import numpy as np
+import pandas as pd
+
+##
+# Tier normalisation modes
+# ALWAYS: re-scale the tier to sum to 1.0, then apply the cap
+# SHRINK: apply the cap, then re-scale the tier only if it sums to more than 1.0
+# NONE:   apply the cap only
+ALWAYS = 'always'
+SHRINK = 'shrink'
+NONE = 'none'
+
+
+##
+# A tier of algos, combined together before being merged with other tiers
+class Tier(object):
+
+    ##
+    # Create a new tier
+    # @name A label for logging
+    # @cap The largest weight any single symbol may hold within this tier
+    # @normalise One of ALWAYS, SHRINK or NONE
+    # @budget The largest fraction of the whole portfolio this tier may occupy
+    def __init__(self, name, cap=1.0, normalise=SHRINK, budget=1.0):
+        if normalise not in {ALWAYS, SHRINK, NONE}:
+            raise ValueError('Unknown normalisation {}'.format(normalise))
+        self.name = name
+        self.cap = float(cap)
+        self.normalise = normalise
+        self.budget = float(budget)
+
+    def __repr__(self):
+        return '<Tier name={} cap={:0.3f} normalise={} budget={:0.3f}>'.format(
+            self.name, self.cap, self.normalise, self.budget)
+
+
+##
+# Combine the weights of any number of algos across any number of tiers.
+# Tiers are given in priority order; each tier is summed across its algos, capped and normalised, and then scaled to
+# fit the portion of the portfolio left unused by the tiers before it.
+class TierCombiner(object):
+
+    def __init__(self, tiers):
+        self.tiers = list(tiers)
+
+    ##
+    # Combine algo outputs
+    # @weights_by_tier One list of pandas.Series per tier, in the same order as the tiers
+    # @return A pandas.Series of combined weights
+    def combine(self, *weights_by_tier):
+        if len(weights_by_tier) != len(self.tiers):
+            raise ValueError('Expected weights for {} tiers, got {}'.format(len(self.tiers), len(weights_by_tier)))
+
+        # Flatten into one symbol x algo matrix, remembering which tier each algo belongs to
+        columns, membership = [], []
+        for tier_index, weights in enumerate(weights_by_tier):
+            for w in weights:
+                if w is not None and not w.empty:
+                    columns.append(w.astype(float))
+                    membership.append(tier_index)
+
+        if not columns:
+            return pd.Series(dtype=float)
+
+        matrix = pd.concat(columns, axis=1, keys=range(len(columns)), sort=True).fillna(0.0)
+        symbols = matrix.index
+
+        # Sum algos into tiers: (symbols x algos) . (algos x tiers)
+        indicator = np.zeros((len(columns), len(self.tiers)))
+        indicator[np.arange(len(columns)), membership] = 1.0
+        tiered = matrix.values.dot(indicator)
+
+        caps = np.array([tier.cap for tier in self.tiers])
+        always = np.array([tier.normalise == ALWAYS for tier in self.tiers])
+        shrink = np.array([tier.normalise == SHRINK for tier in self.tiers])
+        budgets = np.array([tier.budget for tier in self.tiers])
+
+        # Normalise ALWAYS tiers, cap every tier, then shrink SHRINK tiers
+        sums = tiered.sum(axis=0)
+        tiered *= np.where(always & (sums != 0.0), 1.0 / np.where(sums != 0.0, sums, 1.0), 1.0)
+        tiered = np.minimum(tiered, caps)
+        sums = tiered.sum(axis=0)
+        tiered *= np.where(shrink & (sums > 1.0), 1.0 / np.maximum(sums, 1.0), 1.0)
+        sums = tiered.sum(axis=0)
+
+        # Fit each tier into the portion left unused by higher-priority tiers
+        scales = np.zeros(len(self.tiers))
+        remaining = 1.0
+        for index in range(len(self.tiers)):
+            scales[index] = min(budgets[index], remaining)
+            remaining = max(remaining - sums[index] * scales[index], 0.0)
+
+        logging.debug('Tier scales: %s', ', '.join(
+            ['{}: {:0.3f}'.format(tier.name, scale) for tier, scale in zip(self.tiers, scales)]))
+
+        return pd.Series(tiered.dot(scales), index=symbols)
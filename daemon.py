@@ -0,0 +1,153 @@
+# Standard library imports
+import collections
+import datetime
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+import memory
+
+##
+# The outcome of one polling tick
+# @at When the tick started, as a timezone-aware datetime
+# @material True if inputs had changed enough to re-optimise
+# @orders The number of orders placed
+# @seconds The time taken by the tick
+Tick = collections.namedtuple('Tick', ['at', 'material', 'orders', 'seconds'])
+
+
+##
+# A window of daily prices kept up to date from polled quotes.
+# History is fetched once per day, and only for symbols not already in the window; each poll just overwrites today's
+# row with the latest quotes.
+class PriceWindow(object):
+
+    ##
+    # @client A robinhood.Client
+    def __init__(self, client):
+        self.client = client
+        self.prices = pd.DataFrame()
+        self.day = None
+
+    ##
+    # Record the latest quotes as today's prices
+    # @quotes A pandas.Series of prices per symbol
+    # @return A pandas.DataFrame of prices; vertical axis are dates and horizontal axis are symbols
+    def update(self, quotes, day=None):
+        day = day or datetime.date.today()
+        if day != self.day:
+            self.prices, self.day = pd.DataFrame(), day
+
+        missing = [symbol for symbol in quotes.index if symbol not in self.prices]
+        if missing:
+            history = self.client.historical_prices(*missing)
+            history = history[history.index < day]
+            self.prices = history if self.prices.empty else self.prices.join(history, how='outer')
+
+        # Once memory is short, the window is held at single precision
+        self.prices.loc[day, quotes.index] = memory.downcast(quotes).values
+        self.prices = memory.downcast(self.prices)
+        return self.prices
+
+
+##
+# A long-running rebalancer. The client stays logged in; each tick polls quotes for every symbol in play, updates the
+# price window in place, and re-runs the optimiser and order planning only when a quote has moved by more than the
+# threshold since the last optimisation, or the last optimisation is older than max_age. Outside market hours it
+# sleeps until the next open.
+class Daemon(object):
+
+    ##
+    # @client A robinhood.Client
+    # @optimise A function of a price window (a pandas.DataFrame, or None before the first poll) returning target
+    #   weights, and the symbols whose prices it needs
+    # @plan A function of target weights and quotes returning a plan with current and delta share Series
+    # @place A function placing a plan's orders, returning the number of orders placed
+    # @interval Seconds between polls
+    # @threshold The relative move in any quote that counts as material
+    # @max_age Seconds after which the portfolio is re-optimised regardless
+    def __init__(self, client, optimise, plan, place, interval=60.0, threshold=0.01, max_age=3600.0):
+        self.client = client
+        self.optimise = optimise
+        self.plan = plan
+        self.place = place
+        self.interval = interval
+        self.threshold = threshold
+        self.max_age = max_age
+
+        self.window = PriceWindow(client)
+        self.symbols = []
+        self.last_quotes = None
+        self.last_optimised = None
+        self.ticks = collections.deque(maxlen=1000)
+
+    ##
+    # Poll until stopped
+    # @ticks Stop after this many ticks; run forever if None
+    def run(self, ticks=None):
+        count = 0
+        while ticks is None or count < ticks:
+            self._wait_for_market()
+            started = time.time()
+            tick = self.tick()
+            count += 1
+            logging.info('Tick %i: %s in %0.1fms (%i orders)', count, 'rebalanced' if tick.material else 'unchanged',
+                         tick.seconds * 1000.0, tick.orders)
+            time.sleep(max(0.0, self.interval - (time.time() - started)))
+
+    ##
+    # Poll once, rebalancing if inputs have changed materially
+    # @return A Tick
+    def tick(self):
+        at = datetime.datetime.now(datetime.timezone.utc)
+        started = time.time()
+
+        # Cached responses are only good for one tick
+        self.client.reset_cache()
+
+        # Decide whether prices must be held at reduced precision before any are added to the window
+        tracker = memory.active()
+        if tracker is not None:
+            tracker.check()
+        quotes = self.client.quotes(*self.symbols) if self.symbols else None
+        prices = self.window.update(quotes) if quotes is not None else None
+
+        material, orders = self._is_material(quotes), 0
+        if material:
+            weights, universe = self.optimise(prices)
+            plan = self.plan(weights, quotes)
+            orders = self.place(plan)
+
+            self.symbols = sorted(set(weights.index) | set(plan.current.index) | set(universe))
+            self.last_quotes = quotes if quotes is not None else self.client.quotes(*self.symbols)
+            self.last_optimised = time.time()
+
+        tick = Tick(at, material, orders, time.time() - started)
+        self.ticks.append(tick)
+        return tick
+
+    def _is_material(self, quotes):
+        if quotes is None or self.last_quotes is None:
+            return True
+        if time.time() - self.last_optimised > self.max_age:
+            return True
+
+        previous = self.last_quotes.reindex(quotes.index)
+        if previous.isnull().any():
+            return True
+        return bool(np.any(np.abs(quotes / previous - 1.0) > self.threshold))
+
+    def _wait_for_market(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        session = self.client.calendar.session(now)
+
+        # Partial or older calendar entries may be open without hours; those wait for the next known open
+        if session.is_open and session.opens_at and session.closes_at and session.opens_at <= now < session.closes_at:
+            return
+
+        opens_at = self.client.calendar.next_open(now)
+        seconds = (opens_at - now).total_seconds() if opens_at else self.interval
+        logging.info('Market closed; sleeping until %s', opens_at)
+        time.sleep(max(seconds, 0.0))
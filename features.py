@@ -0,0 +1,126 @@
+# Standard library imports
+import itertools
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import algo
+
+LOOKBACK = 30
+MEASURES = ['O', 'H', 'L', 'C', 'A', 'V']
+SOURCE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+LOOKBACKS = list(range(1, LOOKBACK + 1))
+TRANSFORMS = ['SMA', 'MAX', 'MIN', 'STD']
+PERIODS = [3, 5, 7, 10, 12, 15, 30]
+
+LABEL = 'action'
+
+
+##
+# Name every feature column, in output order: for each lookback, the raw measures followed by every rolling transform
+# @return A list of column names, such as 'O1' or 'SMA3_O1'
+def feature_names():
+    names = []
+    for lookback in LOOKBACKS:
+        columns = ['%s%i' % (measure, lookback) for measure in MEASURES]
+        names.extend(columns)
+        for period, column in itertools.product(PERIODS, columns):
+            names.extend(['%s%i_%s' % (transform, period, column) for transform in TRANSFORMS])
+    return names
+
+
+##
+# Build one lookback's block of features for every row, before shifting.
+# Rolling a shifted series is the same as shifting a rolled one, so every lookback is just this block moved down.
+# @values A (rows x measures) numpy array of percent changes
+# @return A (rows x block width) numpy array
+def feature_block(values):
+    rows, measures = values.shape
+    block = np.full((rows, measures * (1 + len(PERIODS) * len(TRANSFORMS))), np.nan)
+    block[:, :measures] = values
+
+    for number, period in enumerate(PERIODS):
+        if period > rows:
+            continue
+        windows = _windows(values, period)
+        stats = np.stack([
+            windows.mean(axis=-1),
+            windows.max(axis=-1),
+            windows.min(axis=-1),
+            windows.std(axis=-1, ddof=1)
+        ], axis=-1)
+
+        # Lay out as measure-major, transform-minor, matching feature_names
+        start = measures + number * measures * len(TRANSFORMS)
+        block[period - 1:, start:start + measures * len(TRANSFORMS)] = stats.reshape(rows - period + 1, -1)
+
+    return block
+
+
+##
+# A read-only view of every window of consecutive rows, without copying
+# @return A (rows - period + 1 x measures x period) numpy array
+def _windows(values, period):
+    rows, measures = values.shape
+    return as_strided(values, shape=(rows - period + 1, measures, period),
+                      strides=(values.strides[0], values.strides[1], values.strides[0]), writeable=False)
+
+
+##
+# Gather the features of the given rows from a block, one shifted copy per lookback
+# @return A (len(rows) x features) numpy array
+def gather(block, rows):
+    offsets = np.array(LOOKBACKS) - 1
+    return block[rows[:, None] - offsets[None, :]].reshape(len(rows), -1)
+
+
+##
+# Generate shuffled training and test feature sets for a symbol, writing each in chunks of rows
+# @name The source data name, such as 'CHK'
+# @split The fraction of rows used for training
+# @chunk_size The most rows held in memory at once
+# @random_state A seed for the shuffle
+# @return A tuple of the training and test filenames
+def parse_yahoo(name, split=0.8, chunk_size=512, random_state=None):
+
+    # Read data from source and convert to percent changes; non-finite changes cannot be used
+    data = algo.source_data_for(name)[SOURCE_COLUMNS].astype(float)
+    values = data.pct_change().values
+    values[~np.isfinite(values)] = np.nan
+
+    block = feature_block(values)
+
+    # Determine action
+    opens = data['Open'].values
+    action = np.zeros(len(opens), dtype=int)
+    action[:-1] = opens[1:] > opens[:-1]
+
+    # Keep only rows with no missing features: every feature reaches back at most this many rows
+    reach = (LOOKBACK - 1) + max(PERIODS) - 1
+    missing = np.isnan(values).any(axis=1).astype(int)
+    missing_in_reach = np.convolve(missing, np.ones(reach + 1, dtype=int))[:len(missing)]
+    valid = np.flatnonzero((missing_in_reach == 0) & (np.arange(len(missing)) >= reach))
+
+    # Shuffle and split
+    shuffled = np.random.RandomState(random_state).permutation(valid)
+    count = int(len(shuffled) * split)
+    names = feature_names() + [LABEL]
+
+    outputs = ((algo.training_filename_for(name), shuffled[:count]), (algo.test_filename_for(name), shuffled[count:]))
+    for filename, rows in outputs:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as file:
+            file.write(','.join(['Date'] + names) + '\n')
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                _write_rows(file, data.index[chunk], np.round(gather(block, chunk), 6), action[chunk])
+
+    return tuple(filename for filename, rows in outputs)
+
+
+##
+# Write rows as CSV text; floats are written with repr, as pandas would, but without building a DataFrame per chunk
+def _write_rows(file, index, values, labels):
+    for date, row, label in zip(index, values.tolist(), labels.tolist()):
+        file.write('%s,%s,%i\n' % (date, ','.join(map(repr, row)), label))
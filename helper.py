@@ -1,5 +1,8 @@
 # Standard library imports
+import collections
+import logging
 import re
+import time
 
 import cvxopt as opt
 import cvxopt.solvers as optsolvers
@@ -37,15 +40,43 @@ def id_for(sz):
 ##
 # Calcalate the annualised Sharpe value for a given set of returns, covariances, and portfolio weights.
 # @returns A pandas.Series of expected or actual returns, with the index the symbol
-# @covariance A pandas.DataFrame of expected or actual covariance, with the indices being symbols
+# @covariance A pandas.DataFrame of expected or actual covariance, with the indices being symbols, or a FactorCovariance
 # @weights A pandas.Series representing the relative weight or fractional holding of the symbol in the portfolio
 # @return A float representing the calculated annualized Sharpe value
 def annualized_sharpe(returns, covariance, weights):
     portfolio_return = np.sum(returns.mean() * weights) * 252
-    portfolio_stddev = np.sqrt(np.dot(weights.T, np.dot(covariance, weights)) * np.sqrt(252))
+    portfolio_stddev = np.sqrt(portfolio_variance(covariance, weights) * np.sqrt(252))
     return portfolio_return / portfolio_stddev
 
 
+##
+# Calculate the variance of a portfolio, w' * covariance * w
+# @covariance A pandas.DataFrame of covariance or a FactorCovariance
+def portfolio_variance(covariance, weights):
+    if isinstance(covariance, FactorCovariance):
+        return covariance.variance(weights)
+    return np.dot(weights.T, np.dot(covariance, weights))
+
+
+##
+# Weights below this fraction of the largest weight are treated as not held
+SUPPORT_TOLERANCE = 1e-6
+
+
+##
+# The result of a tangency optimisation, which can be used to start the next, similar optimisation
+# @weights A pandas.Series of weights summing to 1.0
+# @support The symbols held; the first guess at the next solution's support
+# @initvals Starting values for the next interior-point solve, as cvxopt expects them
+# @method INTERIOR_POINT or ACTIVE_SET
+# @iterations Interior-point iterations, or active-set steps
+# @seconds The time taken to solve
+TangencySolution = collections.namedtuple('TangencySolution',
+                                          ['weights', 'support', 'initvals', 'method', 'iterations', 'seconds'])
+INTERIOR_POINT = 'interior-point'
+ACTIVE_SET = 'active-set'
+
+
 ##
 # Calculate a tangency portfolio
 # TODO See if we can replace with simple matrix algebra
@@ -73,6 +104,16 @@ def tangency_portfolio(cov_mat, exp_rets, allow_short=False):
     weights: pandas.Series
         Optimal asset weights.
     """
+    return solve_tangency(cov_mat, exp_rets, allow_short).weights
+
+
+##
+# Calculate a tangency portfolio, optionally starting from the solution of a similar problem.
+# Without a start, the QP is solved cold by cvxopt's interior-point method. With a start, a long-only problem is solved
+# by an active-set method from the start's weights, falling back to the interior-point method from the start's point.
+# @start A TangencySolution for similar inputs, such as the previous lookback window
+# @return A TangencySolution
+def solve_tangency(cov_mat, exp_rets, allow_short=False, start=None):
     if not isinstance(cov_mat, pd.DataFrame):
         raise ValueError("Covariance matrix is not a DataFrame")
 
@@ -82,6 +123,19 @@ def tangency_portfolio(cov_mat, exp_rets, allow_short=False):
     if not cov_mat.index.equals(exp_rets.index):
         raise ValueError("Indices do not match")
 
+    # Without any variance there is no risk to weigh returns against, so no tangency portfolio; callers hold cash
+    if not (np.diag(cov_mat.values) > 0.0).any():
+        raise ValueError("No variance in any asset")
+
+    began = time.time()
+    initvals = None
+    if start is not None and not allow_short:
+        weights, steps = _active_set_tangency(cov_mat, exp_rets, start)
+        if weights is not None:
+            return _tangency_solution(weights, None, ACTIVE_SET, steps, time.time() - began)
+        if start.initvals is not None and start.weights.index.equals(cov_mat.index):
+            initvals = start.initvals
+
     n = len(cov_mat)
 
     P = opt.matrix(cov_mat.values)
@@ -101,7 +155,7 @@ def tangency_portfolio(cov_mat, exp_rets, allow_short=False):
 
     # Solve
     optsolvers.options['show_progress'] = False
-    sol = optsolvers.qp(P, q, G, h)
+    sol = optsolvers.qp(P, q, G, h, initvals=initvals)
 
     # Put weights into a labeled series
     weights = pd.Series(sol['x'], index=cov_mat.index)
@@ -111,6 +165,288 @@ def tangency_portfolio(cov_mat, exp_rets, allow_short=False):
         logging.warn(weights)
         raise ValueError("Convergence problem")
 
+    # Rescale weights, so that sum(weights) = 1
+    weights /= weights.sum()
+    return _tangency_solution(weights, {'x': sol['x']}, INTERIOR_POINT, sol['iterations'], time.time() - began)
+
+
+def _tangency_solution(weights, initvals, method, iterations, seconds):
+    support = weights.index[weights > SUPPORT_TOLERANCE * weights.abs().max()]
+    return TangencySolution(weights, support, initvals, method, iterations, seconds)
+
+
+##
+# Solve the long-only tangency problem with a primal active-set method, starting from a previous solution.
+# The tangency weights are proportional to the solution v of: minimise 1/2 v' cov v - exp_rets' v subject to v >= 0.
+# Each step solves the unconstrained problem on the symbols currently held, then either steps back to drop a symbol
+# that went negative or adds the symbol whose gradient most wants to be held. Starting from the previous window's
+# support, usually only one or two steps are needed.
+# @return A tuple of a pandas.Series of weights summing to 1.0 and the number of steps, or (None, steps) when the
+#   method cannot be used, such as when the covariance is singular on the held symbols
+def _active_set_tangency(cov_mat, exp_rets, start):
+    covariance, mu = cov_mat.values, exp_rets.values
+    n = len(mu)
+    tolerance = SUPPORT_TOLERANCE * max(np.abs(mu).max(), 1e-12)
+
+    v = start.weights.reindex(cov_mat.index).fillna(0.0).clip(lower=0.0).values
+    held = cov_mat.index.isin(start.support) & (v > 0.0)
+
+    for step in range(1, 2 * n + 10):
+        target = np.zeros(n)
+        if held.any():
+            block = covariance[np.ix_(held, held)]
+            if np.linalg.cond(block) > 1e12:
+                return None, step
+            target[held] = np.linalg.solve(block, mu[held])
+
+        # Step back towards the target only as far as keeps every weight non-negative, and drop what reaches zero
+        # A symbol already at zero, such as one just added whose target is also zero, is dropped without a step
+        falling = held & (target <= 0.0)
+        if falling.any():
+            ratios = np.full(n, np.inf)
+            gap = v[falling] - target[falling]
+            ratios[falling] = np.divide(v[falling], gap, out=np.zeros_like(gap), where=gap > 0.0)
+            blocking = np.argmin(ratios)
+            v = v + ratios[blocking] * (target - v)
+            v[blocking] = 0.0
+            held &= v > 0.0
+            v[~held] = 0.0
+            continue
+
+        # Add the symbol that most improves the objective, or stop when no symbol would
+        v = target
+        gradient = covariance.dot(v) - mu
+        gradient[held] = 0.0
+        entering = np.argmin(gradient)
+        if gradient[entering] >= -tolerance:
+            break
+        held[entering] = True
+    else:
+        return None, step
+
+    if not np.isfinite(v).all() or v.sum() <= 0.0 or mu.dot(v) <= 0.0:
+        return None, step
+    return pd.Series(v / v.sum(), index=cov_mat.index), step
+
+
+##
+# A low-rank-plus-diagonal covariance model: loadings * loadings' + diag(idiosyncratic).
+# Needs O(n * k) memory rather than O(n^2), and stays positive definite when there are more symbols than observations.
+class FactorCovariance(object):
+
+    ##
+    # @loadings A numpy array (symbols x factors) of factor loadings, scaled so the factors have unit variance
+    # @idiosyncratic A numpy array of each symbol's residual variance
+    # @index The symbols, in order
+    def __init__(self, loadings, idiosyncratic, index):
+        self.loadings = loadings
+        self.idiosyncratic = idiosyncratic
+        self.index = index
+
+    def variance(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        exposure = self.loadings.T.dot(weights)
+        return float(exposure.dot(exposure) + np.sum(self.idiosyncratic * weights ** 2))
+
+    ##
+    # Expand into a dense covariance matrix; only sensible for small universes
+    def to_frame(self):
+        dense = self.loadings.dot(self.loadings.T) + np.diag(self.idiosyncratic)
+        return pd.DataFrame(dense, index=self.index, columns=self.index)
+
+
+##
+# Estimate a statistical factor covariance model from returns, using principal components
+# @returns A pandas.DataFrame of returns; vertical axis are dates and horizontal axis are symbols
+# @factors The number of factors to keep; limited by the number of observations
+# @return A FactorCovariance
+def factor_covariance(returns, factors=3):
+    returns = returns.dropna()
+    values = returns.values - returns.values.mean(axis=0)
+    observations = len(values)
+    factors = max(1, min(factors, observations - 2))
+
+    # A thin SVD costs O(observations^2 * symbols), so is linear in the number of symbols
+    u, singular, vt = np.linalg.svd(values, full_matrices=False)
+    loadings = vt[:factors].T * singular[:factors] / np.sqrt(observations - 1)
+
+    # Whatever variance the factors do not explain is idiosyncratic; keep it strictly positive
+    total = values.var(axis=0, ddof=1)
+    idiosyncratic = np.maximum(total - np.sum(loadings ** 2, axis=1), 1e-6 * max(float(np.mean(total)), 1e-12))
+    return FactorCovariance(loadings, idiosyncratic, returns.columns)
+
+
+##
+# Calculate a tangency portfolio under a factor covariance model.
+# The QP is lifted to variables (w, y) with y = loadings' * w, making the objective diagonal and every constraint sparse,
+# and each interior-point step is solved by _factor_kktsolver in O(n * k^2), instead of cubically in the number of symbols.
+# @covariance A FactorCovariance
+# @exp_rets A pandas.Series of expected returns, indexed the same as the covariance
+# @return A pandas.Series of weights summing to 1.0
+def factor_tangency_portfolio(covariance, exp_rets, allow_short=False):
+    if not covariance.index.equals(exp_rets.index):
+        raise ValueError("Indices do not match")
+
+    n, k = covariance.loadings.shape
+    mu = exp_rets.values.astype(float)
+
+    # Without constraints on sign, the answer is covariance^-1 * mu, via the Woodbury identity
+    if allow_short:
+        d_inv_mu = mu / covariance.idiosyncratic
+        d_inv_b = covariance.loadings / covariance.idiosyncratic[:, None]
+        inner = np.eye(k) + covariance.loadings.T.dot(d_inv_b)
+        weights = d_inv_mu - d_inv_b.dot(np.linalg.solve(inner, covariance.loadings.T.dot(d_inv_mu)))
+        if weights.sum() == 0.0:
+            raise ValueError("Convergence problem")
+        return pd.Series(weights / weights.sum(), index=covariance.index)
+
+    # Objective: 1/2 (w' D w + y' y)
+    P = opt.spdiag(opt.matrix(np.concatenate((covariance.idiosyncratic, np.ones(k)))))
+    q = opt.matrix(0.0, (n + k, 1))
+
+    # Constraints Gx <= h: exp_rets*w >= 1 and w >= 0
+    rows = [0] * n + list(range(1, n + 1))
+    columns = list(range(n)) * 2
+    values = list(-mu) + [-1.0] * n
+    G = opt.spmatrix(values, rows, columns, (n + 1, n + k))
+    h = opt.matrix(np.concatenate(([-1.0], np.zeros(n))))
+
+    # Constraints Ax = b: loadings' * w - y = 0
+    rows = [factor for factor in range(k) for symbol in range(n)] + list(range(k))
+    columns = list(range(n)) * k + list(range(n, n + k))
+    values = list(covariance.loadings.T.ravel()) + [-1.0] * k
+    A = opt.spmatrix(values, rows, columns, (k, n + k))
+    b = opt.matrix(0.0, (k, 1))
+
+    # Solve
+    optsolvers.options['show_progress'] = False
+    sol = optsolvers.qp(P, q, G, h, A, b, kktsolver=_factor_kktsolver(covariance, mu))
+
+    # Put weights into a labeled series
+    weights = pd.Series(np.array(sol['x'])[:n, 0], index=covariance.index)
+
+    # Log warning on convergence issue
+    if sol['status'] != 'optimal':
+        logging.warning(weights)
+        raise ValueError("Convergence problem")
+
     # Rescale weights, so that sum(weights) = 1
     weights /= weights.sum()
     return weights
+
+
+##
+# Build a KKT solver for factor_tangency_portfolio's lifted QP.
+# Each interior-point step must solve [H A'; A 0] with H = P + G' W^-2 G. Here H is diagonal plus one rank-one term
+# (from the expected return constraint), so it is inverted with Sherman-Morrison and the equality constraints are
+# eliminated through a (factors x factors) Schur complement: O(n * k^2) per step rather than O(n^3).
+def _factor_kktsolver(covariance, mu):
+    n, k = covariance.loadings.shape
+    A = np.hstack((covariance.loadings.T, -np.identity(k)))
+
+    def factor(W):
+        d = np.array(W['d']).ravel()
+        d2inv = 1.0 / d ** 2
+        diagonal = np.concatenate((covariance.idiosyncratic + d2inv[1:], np.ones(k)))
+        u = np.concatenate((-mu, np.zeros(k))) / d[0]
+        hu = u / diagonal
+        denominator = 1.0 + u.dot(hu)
+
+        def h_solve(v):
+            vd = v / (diagonal[:, None] if v.ndim == 2 else diagonal)
+            return vd - np.multiply.outer(hu, u.dot(vd)) / denominator
+
+        h_inv_at = h_solve(A.T)
+        schur = A.dot(h_inv_at)
+
+        def solve(x, y, z):
+            bx, by, bz = np.array(x).ravel(), np.array(y).ravel(), np.array(z).ravel()
+
+            # Eliminate the inequality multipliers: rx = bx + G' W^-2 bz
+            scaled = bz * d2inv
+            rx = bx.copy()
+            rx[:n] -= mu * scaled[0] + scaled[1:]
+
+            # Eliminate x through H, then solve the small system for the equality multipliers
+            h_inv_rx = h_solve(rx)
+            uy = np.linalg.solve(schur, A.dot(h_inv_rx) - by)
+            ux = h_inv_rx - h_inv_at.dot(uy)
+
+            # Recover the inequality multipliers, returned scaled by W
+            gux = np.concatenate(([-mu.dot(ux[:n])], -ux[:n]))
+            uz = (gux - bz) * d2inv
+
+            x[:] = opt.matrix(ux)
+            y[:] = opt.matrix(uy)
+            z[:] = opt.matrix(uz * d)
+
+        return solve
+
+    return factor
+
+
+##
+# The result of converting portfolio weights into whole-share positions
+# @shares A pandas.Series of whole shares per symbol
+# @cash The capital left unallocated after buying the shares
+# @tracking_error The root-sum-square difference between the target and the achieved weights
+Allocation = collections.namedtuple('Allocation', ['shares', 'cash', 'tracking_error'])
+
+
+##
+# Convert target weights into whole-share positions without exceeding the available capital.
+# Shares are first floored, then the leftover cash is spent one share at a time on the symbols with the largest
+# fractional remainders (largest-remainder rounding), skipping any share that would break the budget or the cap.
+# Weights summing to more than 1.0 are scaled down to fit the capital. Symbols without a usable quote are kept in the
+# result with zero shares.
+# @weights A pandas.Series of target weights, with the index the symbol
+# @quotes A pandas.Series of prices per share, with the index the symbol
+# @capital The total capital to allocate
+# @max_weight The largest fraction of capital any single symbol may hold
+# @return An Allocation
+def allocate_shares(weights, quotes, capital, max_weight=1.0):
+    capital = float(capital)
+    weights = weights.astype(float)
+    prices = quotes.reindex(weights.index).astype(float)
+
+    # Symbols without a usable quote cannot be bought
+    unpriced = ~(prices > 0.0)
+    if unpriced.any():
+        logging.warning('No usable quote for %s; allocating no shares', ', '.join(map(str, prices.index[unpriced])))
+
+    target = np.clip(weights.values, 0.0, max_weight)
+    w = np.where(unpriced, 0.0, target)
+    p = np.where(unpriced, np.inf, prices.values)
+
+    # Flooring weights over 1.0 in total would already spend more than the capital
+    total = np.sum(w)
+    if total > 1.0:
+        logging.warning('Weights sum to %0.4f; scaling down to fit the capital', total)
+        w = w / total
+
+    if capital <= 0.0 or not len(w):
+        return Allocation(pd.Series(0.0, index=weights.index), max(capital, 0.0), 0.0)
+
+    # Largest whole number of shares below both the target and the cap
+    exact = w * capital / p
+    cap = np.floor(max_weight * capital / p)
+    shares = np.minimum(np.floor(exact), cap)
+    remaining = capital - np.sum(shares * np.where(unpriced, 0.0, p))
+
+    # Round up by at most one share each, in order of largest remainder, for as long as the budget allows
+    order = np.argsort(-(exact - shares), kind='stable')
+    candidates = (exact > shares) & (shares < cap)
+    while True:
+        eligible = candidates & (p <= remaining)
+        if not eligible.any():
+            break
+        ranked = order[eligible[order]]
+        spent = np.cumsum(p[ranked])
+        taken = ranked[spent <= remaining]
+        shares[taken] += 1.0
+        candidates[taken] = False
+        remaining -= np.sum(p[taken])
+
+    held = shares * np.where(unpriced, 0.0, p) / capital
+    tracking_error = float(np.sqrt(np.sum((held - target) ** 2)))
+    return Allocation(pd.Series(shares, index=weights.index), float(remaining), tracking_error)
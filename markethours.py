@@ -0,0 +1,224 @@
+# Standard library imports
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import threading
+
+import dateutil.parser
+import dateutil.tz
+
+##
+# One day's trading hours
+# @date A datetime.date
+# @is_open True if the market trades at all that day
+# @opens_at, closes_at Timezone-aware datetimes of the regular session, or None when closed
+Session = collections.namedtuple('Session', ['date', 'is_open', 'opens_at', 'closes_at'])
+
+
+##
+# A local calendar of a market's trading hours.
+# The market's hours endpoint answers one day per request, so days are kept once fetched, optionally in a JSON file
+# between runs, and is_open, next_open and next_close are answered from memory. Days are the market's own, in its
+# timezone. By default only the days asked about are fetched, which suits one-shot runs sharing a rate limit with
+# trading. With prefetch, as for a long-running service, a day that is not yet known is fetched on its own and the rest
+# of its year is then filled in, concurrently, on a background thread.
+class TradingCalendar(object):
+
+    # The most days to look ahead, one request each, for a next open or close that is not already known
+    LOOKAHEAD_DAYS = 14
+
+    ##
+    # @market A robinhood.Market
+    # @path A JSON file to keep the calendar in between runs, or None to keep it only in memory
+    # @max_age With prefetch, re-fetch a year in the background when it was fetched longer ago than this
+    # @workers The number of concurrent requests when fetching a year
+    # @prefetch Fill in whole years in the background; otherwise only the days needed are fetched
+    # @timezone The market's timezone, in which its days begin and end
+    def __init__(self, market, path=None, max_age=datetime.timedelta(days=7), workers=8, prefetch=False,
+                 timezone='America/New_York'):
+        self.market = market
+        self.path = path
+        self.max_age = max_age
+        self.workers = workers
+        self.prefetch = prefetch
+        self.timezone = dateutil.tz.gettz(timezone)
+
+        self.sessions = {}
+        self.fetched = {}
+        self._lock = threading.Lock()
+        self._refreshing = None
+        self._unsaved = False
+
+        self._load()
+
+    ##
+    # Check whether the market trades on a given day
+    # @date A date or datetime, defaulting to today
+    def is_open(self, date=None):
+        return self.session(date).is_open
+
+    ##
+    # Get the hours for a given day, fetching it only if it is not already known
+    # @return A Session
+    def session(self, date=None):
+        session = self._session(_day(date, self.timezone))
+        self._flush()
+        return session
+
+    ##
+    # Find the next time the market opens, after a given moment
+    # @after A timezone-aware datetime, defaulting to now
+    # @return A timezone-aware datetime, or None if no session can be found within LOOKAHEAD_DAYS
+    def next_open(self, after=None):
+        return self._next('opens_at', after)
+
+    ##
+    # Find the next time the market closes, after a given moment
+    def next_close(self, after=None):
+        return self._next('closes_at', after)
+
+    ##
+    # Fetch every day of a year on a background thread, unless a refresh is already running
+    # @background If False, fetch before returning
+    # @return The thread doing the fetch, or None if nothing was started
+    def refresh(self, year=None, background=True):
+        year = year or datetime.datetime.now().year
+        if not background:
+            self.load_year(year)
+            return None
+
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return None
+            self._refreshing = threading.Thread(target=self._refresh_quietly, args=(year,), daemon=True)
+            self._refreshing.start()
+            return self._refreshing
+
+    ##
+    # Fetch every day of a year, concurrently, and store them
+    def load_year(self, year):
+        start, end = datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+        days = [start + datetime.timedelta(days=offset) for offset in range((end - start).days)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            sessions = list(executor.map(self._fetch, days))
+
+        self._update(sessions, year)
+        self._flush()
+        logging.info('Loaded %i trading days for %i', sum(session.is_open for session in sessions), year)
+
+    def _refresh_quietly(self, year):
+        try:
+            self.load_year(year)
+        except Exception as e:
+            logging.warning('Could not refresh market hours for %i: %s', year, e)
+
+    ##
+    # Walk forward a day at a time from the given moment, fetching any day not yet known, to the first time after it
+    # @field Either 'opens_at' or 'closes_at'
+    def _next(self, field, after):
+        after = after or datetime.datetime.now(datetime.timezone.utc)
+        day = _day(after, self.timezone)
+        try:
+            for offset in range(self.LOOKAHEAD_DAYS + 1):
+                moment = getattr(self._session(day + datetime.timedelta(days=offset)), field)
+                if moment and moment > after:
+                    return moment
+            return None
+        finally:
+            self._flush()
+
+    ##
+    # Get the hours for a day, fetching it if it is not already known; the calendar is saved by the caller
+    def _session(self, day):
+        session = self.sessions.get(day)
+        if session is None:
+            logging.debug('No stored hours for %s; fetching', day)
+            session = self._fetch(day)
+            self._update([session])
+        if self.prefetch and self._is_stale(day.year):
+            self.refresh(day.year)
+        return session
+
+    def _is_stale(self, year):
+        fetched = self.fetched.get(year)
+        return fetched is None or datetime.datetime.now(datetime.timezone.utc) - fetched > self.max_age
+
+    def _fetch(self, day):
+        hours = self.market.hours(day).results
+        return Session(day, bool(hours['is_open']), _moment(hours.get('opens_at')), _moment(hours.get('closes_at')))
+
+    ##
+    # Add sessions to the calendar; they are saved on the next flush
+    def _update(self, sessions, year=None):
+        with self._lock:
+            for session in sessions:
+                self.sessions[session.date] = session
+            if year is not None:
+                self.fetched[year] = datetime.datetime.now(datetime.timezone.utc)
+            self._unsaved = True
+
+    ##
+    # Save the calendar once for a batch of updates, if anything was added since it was last saved
+    def _flush(self):
+        with self._lock:
+            if self._unsaved:
+                self._save()
+                self._unsaved = False
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                stored = json.load(file)
+        except (IOError, ValueError) as e:
+            logging.warning('Ignoring unreadable market hours in %s: %s', self.path, e)
+            return
+
+        sessions = [
+            Session(_day(day), hours['is_open'], _moment(hours['opens_at']), _moment(hours['closes_at']))
+            for day, hours in stored['sessions'].items()
+        ]
+        self.fetched = {int(year): _moment(fetched) for year, fetched in stored['fetched'].items()}
+        self._update(sessions)
+        self._unsaved = False
+
+    def _save(self):
+        if not self.path:
+            return
+        stored = {
+            'fetched': {str(year): fetched.isoformat() for year, fetched in self.fetched.items()},
+            'sessions': {
+                session.date.isoformat(): {
+                    'is_open': session.is_open,
+                    'opens_at': session.opens_at and session.opens_at.isoformat(),
+                    'closes_at': session.closes_at and session.closes_at.isoformat()
+                } for session in self.sessions.values()
+            }
+        }
+
+        # Write beside the calendar and swap in, so an interrupted write never loses the stored hours
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(stored, file)
+        os.replace(self.path + '.tmp', self.path)
+
+
+##
+# The day of a date, datetime or ISO date string; timezone-aware datetimes, and now, are taken in the given timezone
+def _day(value, timezone=None):
+    if value is None:
+        return datetime.datetime.now(timezone).date()
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    if isinstance(value, datetime.datetime):
+        if timezone is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone)
+        return value.date()
+    return value
+
+
+def _moment(value):
+    return dateutil.parser.parse(value) if value else None
@@ -0,0 +1,152 @@
+# Standard library imports
+import collections
+import contextlib
+import logging
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+##
+# Memory used by one stage of a run
+# @name The stage name
+# @allocated Bytes allocated by the stage and still held at its end, as traced; None when not tracing
+# @peak The highest traced bytes during the stage, above what was held at its start; None when not tracing
+# @resident The process's resident bytes at the end of the stage, or None where it cannot be read
+# @seconds The time taken by the stage
+Stage = collections.namedtuple('Stage', ['name', 'allocated', 'peak', 'resident', 'seconds'])
+
+# The tracker for the current run, consulted by layers that can hold less data when memory is short
+_active = None
+
+
+##
+# Track memory through the stages of a run, and keep it within a budget.
+# With trace set, every stage's allocations and peak are measured with tracemalloc, which slows allocation, so is for
+# instrumentation runs. Independently, with a budget set, the process's resident memory is checked after every stage;
+# when over budget, every registered shedder is called to release what it can, and from then on data layers are asked
+# to hold prices at reduced precision (see downcast).
+class MemoryTracker(object):
+
+    ##
+    # @budget The most resident memory to use, in bytes, or None for no budget
+    # @trace Measure every stage with tracemalloc
+    def __init__(self, budget=None, trace=False):
+        self.budget = budget
+        self.trace = trace
+        self.stages = []
+        self.shedders = []
+        self.under_pressure = False
+
+    def __enter__(self):
+        global _active
+        _active = self
+        if self.trace:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        global _active
+        _active = None
+        if self.trace:
+            tracemalloc.stop()
+
+    ##
+    # Register a function to call when over budget, such as a cache's shed method
+    # @shedder A function taking no arguments and returning the number of bytes it released, or None if unknown
+    def on_pressure(self, shedder):
+        self.shedders.append(shedder)
+
+    ##
+    # Measure a stage of the run, and enforce the budget at its end
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.time()
+        if self.trace:
+            held = self._reset_peak()
+        try:
+            yield
+        finally:
+            allocated = peak = None
+            if self.trace:
+                current, highest = tracemalloc.get_traced_memory()
+                allocated, peak = current - held, highest - held
+            stage = Stage(name, allocated, peak, resident_bytes(), time.time() - started)
+            self.stages.append(stage)
+            logging.debug('Memory after %s: %s', name, _describe(stage))
+            self.check()
+
+    ##
+    # Start measuring a new peak from here
+    # @return The traced bytes the new peak is measured above
+    def _reset_peak(self):
+        if hasattr(tracemalloc, 'reset_peak'):
+            held, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            return held
+
+        # Before Python 3.9 the peak can only be reset by forgetting the allocations traced so far
+        tracemalloc.clear_traces()
+        return 0
+
+    ##
+    # Shed data if resident memory is over budget
+    # @return True if over budget
+    def check(self):
+        if self.budget is None:
+            return False
+        resident = resident_bytes()
+        if resident is None or resident <= self.budget:
+            return False
+
+        logging.warning('Memory %s over budget of %s; shedding', _megabytes(resident), _megabytes(self.budget))
+        self.under_pressure = True
+        for shedder in self.shedders:
+            released = shedder()
+            logging.info('  %s released %s', getattr(shedder, '__qualname__', shedder), _megabytes(released))
+        return True
+
+    ##
+    # Summarise every stage
+    # @return A list of dicts, suitable for returning from an action
+    def report(self):
+        report = [dict(stage._asdict()) for stage in self.stages]
+        for stage in self.stages:
+            logging.info('Memory %s: %s', stage.name, _describe(stage))
+        return report
+
+
+##
+# The tracker for the current run, if any
+def active():
+    return _active
+
+
+##
+# Reduce a frame of prices to single precision when the current run is short of memory
+# @frame A pandas.DataFrame or pandas.Series
+# @return The frame, downcast if under pressure
+def downcast(frame):
+    if _active is None or not _active.under_pressure:
+        return frame
+    return frame.astype(np.float32)
+
+
+##
+# The process's resident memory, in bytes, or None where it cannot be read
+def resident_bytes():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _megabytes(value):
+    return 'unknown' if value is None else '{:0.1f}MB'.format(value / 1048576.0)
+
+
+def _describe(stage):
+    return 'allocated {}, peak {}, resident {}'.format(
+        _megabytes(stage.allocated), _megabytes(stage.peak), _megabytes(stage.resident))
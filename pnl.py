@@ -0,0 +1,125 @@
+# Standard library imports
+import collections
+import logging
+
+import numpy as np
+import pandas as pd
+
+##
+# The result of matching fills into FIFO lots
+# @fills A pandas.DataFrame of the input fills, with matched quantity, cost and realised P&L for every sell
+# @by_symbol A pandas.DataFrame per symbol of realised P&L, open quantity, open cost basis, mark and unrealised P&L
+# @by_day A pandas.DataFrame per date and symbol of realised P&L, plus unrealised P&L when marks are given
+PnL = collections.namedtuple('PnL', ['fills', 'by_symbol', 'by_day'])
+
+
+##
+# Read an order history, as written by tools.download_orders_to_csv
+# @return A pandas.DataFrame of fills with timestamp, symbol, side, quantity and price columns, oldest first
+def read_orders(filename='orders.csv'):
+    orders = pd.read_csv(filename, usecols=['Trade Date', 'Symbol', 'Trade Action', 'Qty', 'Price'])
+    fills = pd.DataFrame({
+        'timestamp': pd.to_datetime(orders['Trade Date'], utc=True),
+        'symbol': orders['Symbol'],
+        'side': orders['Trade Action'].str.lower(),
+        'quantity': orders['Qty'].astype(float),
+        'price': orders['Price'].astype(float)
+    })
+    return fills.sort_values('timestamp', kind='mergesort').reset_index(drop=True)
+
+
+##
+# Match buys and sells into first-in-first-out lots.
+# Rather than opening and closing one share at a time, each symbol's buys are laid end to end along a cumulative
+# quantity axis; the cost of any FIFO slice of that axis is read off the piecewise-linear cumulative cost curve.
+# Sells beyond the shares bought so far are left unmatched rather than borrowing from later buys.
+# @fills A pandas.DataFrame as returned by read_orders
+# @marks Optional prices to value open lots: a pandas.Series per symbol, or a pandas.DataFrame of dates x symbols for
+#   daily unrealised P&L. Without marks, open lots are valued at each symbol's last traded price.
+# @return A PnL
+def fifo_pnl(fills, marks=None):
+    fills = fills.sort_values('timestamp', kind='mergesort').reset_index(drop=True)
+    fills['date'] = fills['timestamp'].dt.normalize().dt.tz_localize(None)
+    sell_rows, sell_matched, sell_cost, sell_realised = [], [], [], []
+
+    daily_marks = marks if isinstance(marks, pd.DataFrame) else None
+    if daily_marks is not None:
+        marks = daily_marks.ffill().iloc[-1]
+
+    symbols, daily = [], []
+    for symbol, rows in fills.groupby('symbol', sort=True).indices.items():
+        group = fills.iloc[rows]
+        is_buy = (group['side'] == 'buy').values
+        is_sell = (group['side'] == 'sell').values
+        quantity = group['quantity'].values
+        price = group['price'].values
+
+        # The buy axis: cumulative quantity and cost, starting from zero
+        bought = np.cumsum(np.where(is_buy, quantity, 0.0))
+        axis = np.concatenate(([0.0], bought[is_buy]))
+        curve = np.concatenate(([0.0], np.cumsum(quantity[is_buy] * price[is_buy])))
+
+        # Matched cumulative sells: M = Q + min(0, running min of (bought - Q)), so sells never outrun buys
+        sold = np.cumsum(quantity[is_sell])
+        matched = sold + np.minimum(0.0, np.minimum.accumulate(bought[is_sell] - sold))
+        matched = np.maximum(matched, 0.0)
+        previous = np.concatenate(([0.0], matched[:-1]))
+
+        cost = np.interp(matched, axis, curve) - np.interp(previous, axis, curve)
+        sell_rows.append(rows[is_sell])
+        sell_matched.append(matched - previous)
+        sell_cost.append(cost)
+        sell_realised.append((matched - previous) * price[is_sell] - cost)
+
+        unmatched = sold[-1] - matched[-1] if len(sold) else 0.0
+        if unmatched > 0.0:
+            logging.warning('%s: %s shares sold without a matching buy', symbol, unmatched)
+
+        # Whatever has not been sold is still open
+        total_bought, total_matched = axis[-1], (matched[-1] if len(matched) else 0.0)
+        open_quantity = total_bought - total_matched
+        open_cost = curve[-1] - np.interp(total_matched, axis, curve)
+        mark = marks.get(symbol, np.nan) if marks is not None else np.nan
+        mark = price[-1] if np.isnan(mark) else mark
+        symbols.append((symbol, open_quantity, open_cost, mark, open_quantity * mark - open_cost))
+
+        # Daily unrealised: open lots at each day's close, valued at that day's mark
+        if daily_marks is not None and symbol in daily_marks:
+            ends = (daily_marks.index + pd.Timedelta(days=1)).values
+            dates = group['date'].values
+            at = np.searchsorted(dates, ends, side='left')
+            matched_rows = np.zeros(len(group))
+            matched_rows[is_sell] = matched
+            matched_rows = np.maximum.accumulate(matched_rows)
+            bought_by = np.concatenate(([0.0], bought))[at]
+            matched_by = np.concatenate(([0.0], matched_rows))[at]
+            open_by = bought_by - matched_by
+            open_cost_by = np.interp(bought_by, axis, curve) - np.interp(matched_by, axis, curve)
+            daily.append(pd.DataFrame({
+                'date': daily_marks.index, 'symbol': symbol,
+                'unrealised': open_by * daily_marks[symbol].ffill().values - open_cost_by
+            }))
+
+    for column, values in (('matched', sell_matched), ('cost', sell_cost), ('realised', sell_realised)):
+        fills[column] = 0.0
+        if values:
+            fills.iloc[np.concatenate(sell_rows), fills.columns.get_loc(column)] = np.concatenate(values)
+
+    by_symbol = pd.DataFrame(symbols, columns=['symbol', 'open_quantity', 'open_cost', 'mark', 'unrealised'])
+    by_symbol = by_symbol.set_index('symbol')
+    by_symbol.insert(0, 'realised', fills.groupby('symbol')['realised'].sum())
+
+    by_day = fills.groupby(['date', 'symbol'])[['realised']].sum()
+    if daily:
+        unrealised = pd.concat(daily).set_index(['date', 'symbol'])
+        by_day = by_day.join(unrealised, how='outer').fillna({'realised': 0.0})
+
+    return PnL(fills.drop(columns='date'), by_symbol, by_day)
+
+
+##
+# Analyse an order history CSV and write the P&L per symbol; the Python counterpart to parse.rb
+def analyse_orders(filename='orders.csv', output='orders-analysis.csv'):
+    result = fifo_pnl(read_orders(filename))
+    result.by_symbol.to_csv(output)
+    return result
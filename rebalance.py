@@ -0,0 +1,81 @@
+# Standard library imports
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+##
+# A rebalancing policy, for deciding which movements between the current and target portfolios are worth trading.
+# Deltas are per-symbol share quantities, as produced by subtracting the current holdings from the target holdings.
+class RebalancePolicy(object):
+
+    ##
+    # Create a new policy
+    # @min_value Drop any order worth less than this absolute amount
+    # @min_fraction Drop any order worth less than this fraction of capital
+    # @turnover_penalty If set, shrink every delta towards the current holding by this fraction of capital before
+    #   thresholding; this is the exact solution of a squared tracking error plus L1 turnover penalty, per symbol
+    # @keep_exits Always trade deltas that close a position entirely, regardless of size
+    def __init__(self, min_value=0.0, min_fraction=0.0, turnover_penalty=0.0, keep_exits=True):
+        self.min_value = float(min_value)
+        self.min_fraction = float(min_fraction)
+        self.turnover_penalty = float(turnover_penalty)
+        self.keep_exits = keep_exits
+
+    ##
+    # Apply the policy to a set of deltas. Shrinking and thresholding can hold back sells whose proceeds the buys were
+    # sized on, so buys are then scaled down to what the remaining sells, and any planned net spend, pay for.
+    # @delta A pandas.Series of share movements per symbol
+    # @current A pandas.Series of currently held shares per symbol
+    # @quotes A pandas.Series of prices per share per symbol
+    # @capital The total capital the portfolio is sized against
+    # @return A pandas.Series of whole-share movements, with suppressed entries removed
+    def apply(self, delta, current, quotes, capital):
+        if delta.empty:
+            return delta
+
+        capital = float(capital)
+        held = current.reindex(delta.index).fillna(0.0).astype(float).values
+        prices = quotes.reindex(delta.index).astype(float).values
+        d = delta.astype(float).values
+
+        # Symbols without a price cannot be valued; only exits are safe to trade
+        priced = prices > 0.0
+        exits = (held + d == 0.0) & (held != 0.0)
+
+        # Shrink towards the current holding (soft-threshold in share space)
+        if self.turnover_penalty > 0.0 and capital > 0.0:
+            band = np.where(priced, self.turnover_penalty * capital / np.where(priced, prices, 1.0), np.inf)
+            shrunk = np.sign(d) * np.trunc(np.maximum(np.abs(d) - band, 0.0))
+            d = np.where(exits & self.keep_exits, d, shrunk)
+
+        # Drop orders below the absolute and relative thresholds
+        value = np.abs(d) * np.where(priced, prices, 0.0)
+        threshold = max(self.min_value, self.min_fraction * max(capital, 0.0))
+        keep = (d != 0.0) & priced & (value >= threshold)
+        if self.keep_exits:
+            keep |= exits & (d != 0.0)
+
+        # Buys were sized on the proceeds of every planned sell; when sells are held back, spend no more than the
+        # planned net cost plus the proceeds of the sells that remain
+        planned = delta.astype(float).values * np.where(priced, prices, 0.0)
+        buys, sells = keep & (d > 0.0), keep & (d < 0.0)
+        budget = max(planned.sum(), 0.0) + value[sells].sum()
+        spend = value[buys].sum()
+        if spend > budget:
+            scale = budget / spend
+            logging.info('Scaling buys to %0.1f%% to spend no more than %0.2f', scale * 100.0, budget)
+            d = np.where(buys, np.trunc(d * scale), d)
+            value = np.abs(d) * np.where(priced, prices, 0.0)
+            keep &= ~buys | ((d != 0.0) & (value >= threshold))
+
+        result = pd.Series(d, index=delta.index)[keep]
+        suppressed = delta.index[(delta != 0.0).values & ~keep]
+        if len(suppressed):
+            logging.info('Suppressed %i orders: %s', len(suppressed), ', '.join(map(str, suppressed)))
+        return result
+
+    def __repr__(self):
+        return '<{} min_value={} min_fraction={} turnover_penalty={} keep_exits={}>'.format(
+            type(self).__name__, self.min_value, self.min_fraction, self.turnover_penalty, self.keep_exits)
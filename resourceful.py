@@ -4,6 +4,7 @@ import re
 import requests
 import json
 import logging
+import time
 
 import simpleapi
 
@@ -47,6 +48,12 @@ class Resource(object):
     uri = self.relative_uri(uri)
     return self.api_or_parent.delete(uri, *args, **kwargs)
 
+  ##
+  # Delegate forgetting a cached response to api or parent
+  def forget(self, uri, *args, **kwargs):
+    uri = self.relative_uri(uri)
+    return self.api_or_parent.forget(uri, *args, **kwargs)
+
   ##
   # Return a completed URI
   def relative_uri(self, uri):
@@ -83,32 +90,78 @@ class Resource(object):
 
 
 ##
-# A collection
+# A collection.
+# Lists are cached by query, so each distinct set of parameters is fetched once; an empty result is only kept for
+# EMPTY_TTL seconds, as it is more likely to be filled in soon, and is then dropped from any response cache below too.
+# Any POST, PUT or DELETE through the collection, or through one of its instances, clears the cache.
 class Collection(Resource):
+  EMPTY_TTL = 60.0
 
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
-    self._list = None
+    self._lists = {}
 
   ##
   # Get the index, or general, URI
   def list(self, instance_class = None, **kwargs):
-    if not self._list:
-      # Get first pass of data
-      response = PaginatedResponse(self.get(None, **kwargs))
-      self._list = response.results
+    instance_class = instance_class or self.INSTANCE_CLASS
+    key = (instance_class, json.dumps(kwargs, sort_keys = True, default = str))
 
-      # While there is a next link, follow
-      while response.next:
-        response = PaginatedResponse(self.get(response.next))
-        self._list.extend(response.results)
+    cached = self._lists.get(key)
+    if cached:
+      if cached[0] or time.monotonic() - cached[1] < self.EMPTY_TTL:
+        return cached[0]
+      self.forget(None, **kwargs)
 
-      # Convert items to objects
-      instance_class = instance_class or self.INSTANCE_CLASS
-      if instance_class:
-        self._list = [ instance_class(self, item) for item in self._list ]
+    items = self.each(**kwargs)
+    items = [ instance_class(self, item) for item in items ] if instance_class else list(items)
+    self._lists[key] = (items, time.monotonic())
+    return items
+
+  ##
+  # Forget every cached list
+  def invalidate(self):
+    self._lists = {}
+
+  def post(self, uri, *args, **kwargs):
+    try:
+      return super().post(uri, *args, **kwargs)
+    finally:
+      self.invalidate()
+
+  def put(self, uri, *args, **kwargs):
+    try:
+      return super().put(uri, *args, **kwargs)
+    finally:
+      self.invalidate()
 
-    return self._list
+  def delete(self, uri, *args, **kwargs):
+    try:
+      return super().delete(uri, *args, **kwargs)
+    finally:
+      self.invalidate()
+
+  ##
+  # Iterate over every raw item, following next links one page at a time
+  def each(self, **kwargs):
+    for results, next_uri in self.pages(**kwargs):
+      yield from results
+
+  ##
+  # Iterate over pages as (results, next URI) pairs; pass a previous next URI as start to resume from that page
+  def pages(self, start = None, **kwargs):
+    response = PaginatedResponse(self.get(start) if start else self.get(None, **kwargs))
+    yield response.results, response.next
+
+    while response.next:
+      response = PaginatedResponse(self.get(response.next))
+      yield response.results, response.next
+
+  ##
+  # Get the index as compact records, keeping only the instance class's declared FIELDS. Not cached.
+  def records(self, **kwargs):
+    record_class = Record.for_class(self.INSTANCE_CLASS)
+    return [ record_class(self, item) for item in self.each(**kwargs) ]
 
   def find_all_by(self, **kwargs):
     items = self.list(params = kwargs)
@@ -147,8 +200,12 @@ class Instance(Resource):
       self.reload()
     return self.data[key]
 
+  ##
+  # Data may be shared with a parsed, cached response, so is copied rather than changed in place
   def __setitem__(self, key, value):
-    self.data[key] = value
+    data = dict(self.data or {})
+    data[key] = value
+    self.data = data
 
   def reload(self):
     self.data = Response(self.get(None)).results
@@ -158,6 +215,63 @@ class Instance(Resource):
     return self._to_repr(id = self.id)
 
 
+##
+# A compact, read-only record of an instance, holding only the declared FIELDS of its instance class in slots.
+# FIELDS is a tuple of (name, type) pairs; any other key expands the record to its full instance, fetched on demand.
+class Record(object):
+  __slots__ = ('_parent', '_expanded')
+  FIELDS = ()
+  INSTANCE_CLASS = None
+
+  _classes = {}
+
+  def __init__(self, parent, data):
+    self._parent = parent
+    self._expanded = None
+    for name, kind in self.FIELDS:
+      value = data.get(name)
+      setattr(self, name, value if value is None else kind(value))
+
+  ##
+  # Build, or reuse, the record class for an instance class
+  @classmethod
+  def for_class(cls, instance_class):
+    record_class = cls._classes.get(instance_class)
+    if not record_class:
+      fields = tuple(getattr(instance_class, 'FIELDS', ()))
+      if not fields:
+        raise ValueError('{} declares no FIELDS'.format(instance_class.__name__))
+      record_class = type(instance_class.__name__ + 'Record', (cls,), {
+        '__slots__': tuple(name for name, kind in fields),
+        'FIELDS': fields,
+        'INSTANCE_CLASS': instance_class
+      })
+      cls._classes[instance_class] = record_class
+    return record_class
+
+  @property
+  def id(self):
+    return getattr(self, self.INSTANCE_CLASS.ID_FIELD)
+
+  ##
+  # The full instance, reloaded from the API on first use
+  def expand(self):
+    if self._expanded is None:
+      self._expanded = self.INSTANCE_CLASS(self._parent, self.id)
+    return self._expanded
+
+  def __getitem__(self, key):
+    if key in self.__slots__:
+      return getattr(self, key)
+    return self.expand()[key]
+
+  def to_dict(self):
+    return { name: getattr(self, name) for name, kind in self.FIELDS }
+
+  def __repr__(self):
+    return '<{} id={}>'.format(type(self).__name__, self.id)
+
+
 class Response(object):
   def __init__(self, response):
     self.response = response
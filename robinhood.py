@@ -1,3 +1,4 @@
+import concurrent.futures
 import os
 import re
 import requests
@@ -5,13 +6,19 @@ import pandas as pd
 import datetime
 import dateutil
 import logging
-from collections import deque
+import types
+from collections import deque, namedtuple
 
+import markethours
 import simpleapi
 import resourceful
 import helper
 
 
+# The most instruments to request in one call
+INSTRUMENT_BATCH_SIZE = 50
+
+
 ##
 # Base class for exceptions in this module
 class Error(Exception):
@@ -48,10 +55,41 @@ class SellingTooManySharesError(TooManySharesError):
     pass
 
 
+##
+# Request budgets per class of endpoint, as (requests per second, burst); throttling lowers these until it stops
+RATE_LIMITS = {
+    'orders': (1.0, 5),
+    'market': (10.0, 20),
+    'default': (5.0, 10)
+}
+
+
+##
+# Classify a request for rate limiting: orders, market data, or everything else
+def endpoint_class(method, uri):
+    if re.search(r'/orders/', uri):
+        return 'orders'
+    if re.search(r'/(quotes|instruments|markets|fundamentals)/', uri):
+        return 'market'
+    return 'default'
+
+
+##
+# The state of an account at one moment, fetched in one go so every figure is consistent
+# @account_id The account number
+# @equity Total equity, cash plus held assets
+# @margin The margin limit
+# @positions A read-only mapping of shares held per symbol, open positions only
+# @taken_at When the snapshot was taken, as a timezone-aware datetime
+AccountSnapshot = namedtuple('AccountSnapshot', ['account_id', 'equity', 'margin', 'positions', 'taken_at'])
+
+
 ##
 # The Robinhood interface, built from the ground up sadly!
 class Client(object):
-    def __init__(self, username=None, password=None, account_id=None, token=None):
+    def __init__(self, username=None, password=None, account_id=None, token=None,
+                 pool_size=simpleapi.DEFAULT_POOL_SIZE, cassette=None, cassette_mode=simpleapi.CassetteAPI.REPLAY,
+                 calendar=None, prefetch_calendar=False, rate_limits=RATE_LIMITS):
 
         self.username = None
 
@@ -60,17 +98,25 @@ class Client(object):
         password = helper.coalesce(password, os.environ.get('ROBINHOOD_PASSWORD'))
         account_id = helper.coalesce(account_id, os.environ.get('ROBINHOOD_ACCOUNTID'))
         token = helper.coalesce(token, os.environ.get('ROBINHOOD_TOKEN'))
+        calendar = helper.coalesce(calendar, os.environ.get('ROBINHOOD_CALENDAR'))
 
-        # Set up the instrument cache
+        # Set up the instrument cache; concurrent look-ups of the same instrument share one request
         self.instrument_cache = {}
-
-        # Activate the client
-        self.api = simpleapi.TokenAPI(
-            simpleapi.MemoryCacheAPI(
-                simpleapi.API('https://api.robinhood.com/')
-            ),
-            token=token
-        )
+        self._instrument_flights = simpleapi.SingleFlight()
+
+        # Collections are kept for the life of the client, so their cached lists are reused; built on first use
+        self._orders, self._watchlists, self._instrument_collection = None, None, None
+
+        # Activate the client, rate limited per class of endpoint, optionally recording to or replaying from a cassette
+        api = simpleapi.API('https://api.robinhood.com/', pool_size=pool_size)
+        self.rate_limiter = simpleapi.RateLimitAPI(api, {
+            name: simpleapi.TokenBucket(rate, capacity) for name, (rate, capacity) in rate_limits.items()
+        }, classify=endpoint_class)
+        api = self.rate_limiter
+        if cassette:
+            api = simpleapi.CassetteAPI(api, cassette, mode=cassette_mode)
+        self.cache = simpleapi.MemoryCacheAPI(api)
+        self.api = simpleapi.TokenAPI(self.cache, token=token)
 
         # Update headers for Robinhood
         self.api.session.headers.update({
@@ -90,6 +136,10 @@ class Client(object):
         # Add account id
         self.account_id = account_id
 
+        # Market hours are answered from a local calendar, kept in memory or in the given file; whole years are only
+        # prefetched for long-running clients, as each day is a request sharing the market data rate limit
+        self.calendar = markethours.TradingCalendar(self.nyse_market, path=calendar, prefetch=prefetch_calendar)
+
     def __enter__(self):
         return self
 
@@ -125,6 +175,14 @@ class Client(object):
     def is_logged_in(self):
         return bool(self.api.token)
 
+    ##
+    # Forget every cached response, so quotes, positions and balances are fetched afresh; for long-running clients
+    def reset_cache(self):
+        self.cache.reset()
+        for collection in (self._orders, self._watchlists, self._instrument_collection):
+            if collection is not None:
+                collection.invalidate()
+
     ##
     # Get accounts associated with this user.
     # @returns An Accounts collection.
@@ -189,7 +247,17 @@ class Client(object):
 
     @property
     def watchlists(self):
-        return Watchlists(self.api)
+        if self._watchlists is None:
+            self._watchlists = Watchlists(self.api, instrument_collection=self.instrument_collection)
+        return self._watchlists
+
+    ##
+    # The instruments collection, for look-ups by query; see instrument() and instruments() for cached look-ups by ID
+    @property
+    def instrument_collection(self):
+        if self._instrument_collection is None:
+            self._instrument_collection = Instruments(self.api, root=True)
+        return self._instrument_collection
 
     ##
     # Get watchlist
@@ -205,7 +273,13 @@ class Client(object):
         if match:
             symbol_or_id = match
 
-        # TODO: Turn this into a real cache, but for now...
+        instrument = self.instrument_cache.get(symbol_or_id)
+        if not instrument:
+            instrument = self._instrument_flights.do(symbol_or_id, self._fetch_instrument, symbol_or_id)
+        return instrument
+
+    def _fetch_instrument(self, symbol_or_id):
+        # Check again, as another thread may have fetched this instrument while we waited
         if not self.instrument_cache.get(symbol_or_id):
             logging.info('Finding instrument %s', symbol_or_id)
             if helper.id_for(symbol_or_id):
@@ -218,6 +292,25 @@ class Client(object):
 
         return self.instrument_cache[symbol_or_id]
 
+    ##
+    # Look up many instruments at once; IDs or instrument URLs not already cached are fetched in batched requests
+    # @return A list of instrument dicts, in the order given
+    def instruments(self, *symbols_or_ids):
+        keys = [helper.id_for(s) or s for s in symbols_or_ids]
+        missing = sorted({key for key in keys if helper.id_for(key) and not self.instrument_cache.get(key)})
+
+        for start in range(0, len(missing), INSTRUMENT_BATCH_SIZE):
+            batch = missing[start:start + INSTRUMENT_BATCH_SIZE]
+            logging.info('Finding %i instruments', len(batch))
+            response = self.api.get('/instruments/', params={'ids': ','.join(batch)}).json()
+            for instrument in response.get('results', []):
+                if instrument:
+                    self.instrument_cache[instrument['symbol']] = instrument
+                    self.instrument_cache[instrument['id']] = instrument
+
+        # Anything not found in bulk (such as plain symbols) falls back to single look-ups
+        return [self.instrument(key) for key in keys]
+
     ##
     # Get current account portfolio
     # @return A response object of the portfolio
@@ -233,12 +326,27 @@ class Client(object):
     ##
     # Get all open positions; removes any closed positions from list
     # @return A list of open positions
-    def open_positions(self):
-        positions = self.positions()
-        positions = [position for position in positions if position.quantity > 0.0]
-        for position in positions:
-            position['symbol'] = self.instrument(position['instrument'])['symbol']
-        return pd.Series({p['symbol']: float(p['quantity']) for p in positions})
+    def open_positions(self, account=None):
+        account = account or self.account()
+        positions = [position for position in account.positions.records() if position.quantity > 0.0]
+        instruments = self.instruments(*[position.instrument for position in positions])
+        return pd.Series({i['symbol']: p.quantity for i, p in zip(instruments, positions)}, dtype=float)
+
+    ##
+    # Fetch the account, its portfolio and its open positions concurrently, in one round trip; without an account ID,
+    # the default account is looked up first, once per client
+    # @return An AccountSnapshot
+    def snapshot(self):
+        taken_at = datetime.datetime.now(datetime.timezone.utc)
+        account = self.account()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            margin = executor.submit(lambda: float(account['margin_balances']['margin_limit']))
+            equity = executor.submit(lambda: account.portfolio.equity)
+            positions = executor.submit(self.open_positions, account)
+
+            positions = types.MappingProxyType(positions.result().to_dict())
+            return AccountSnapshot(self.account_id, equity.result(), margin.result(), positions, taken_at)
 
     def quotes(self, *symbols_or_ids):
         symbol_list = ','.join([*symbols_or_ids])
@@ -302,7 +410,9 @@ class Client(object):
 
     @property
     def orders(self):
-        return Orders(self.api)
+        if self._orders is None:
+            self._orders = Orders(self.api)
+        return self._orders
 
     @property
     def markets(self):
@@ -313,7 +423,7 @@ class Client(object):
         return Market(self.markets, 'XNYS')
 
     def are_markets_open(self, date=None):
-        return self.nyse_market.is_open(date)
+        return self.calendar.is_open(date)
 
 
 ##
@@ -419,6 +529,10 @@ class Accounts(resourceful.Collection):
 
 class Position(resourceful.Instance):
     ID_FIELD = 'id'
+    FIELDS = (
+        ('id', str), ('url', str), ('instrument', str), ('quantity', float), ('average_buy_price', float),
+        ('created_at', str), ('updated_at', str)
+    )
 
     @property
     def quantity(self):
@@ -436,6 +550,11 @@ class Positions(resourceful.Collection):
 
 class Order(resourceful.Instance):
     ID_FIELD = 'id'
+    FIELDS = (
+        ('id', str), ('url', str), ('instrument', str), ('side', str), ('type', str), ('state', str),
+        ('quantity', float), ('cumulative_quantity', float), ('price', float), ('average_price', float),
+        ('created_at', str), ('updated_at', str), ('last_transaction_at', str)
+    )
 
 
 class Orders(resourceful.Collection):
@@ -500,12 +619,16 @@ class WatchlistInstrument(resourceful.Instance):
 
     @property
     def instrument(self):
-        return Instrument(Instruments(self.api_or_parent, root=True), self.id)
+        return Instrument(self.api_or_parent.instrument_collection, self.id)
 
 
 class Watchlist(resourceful.Collection):
     INSTANCE_CLASS = WatchlistInstrument
 
+    @property
+    def instrument_collection(self):
+        return self.api_or_parent.instrument_collection
+
     def instruments(self):
         return [ii.instrument for ii in self.list()]
 
@@ -542,7 +665,7 @@ class Watchlist(resourceful.Collection):
         # For every symbol, find its instrument ID and delete
         instrument_id = helper.symbol_table.get(symbol)
         if not instrument_id:
-            instrument_id = Instruments(self, root=True).find_by(symbol=symbol).id
+            instrument_id = self.instrument_collection.find_by(symbol=symbol).id
         return self.remove_instrument(instrument_id)
 
     def add_instrument(self, instrument_id):
@@ -556,5 +679,11 @@ class Watchlists(resourceful.Collection):
     ENDPOINT = 'watchlists/'
     INSTANCE_CLASS = Watchlist
 
+    ##
+    # @instrument_collection An Instruments collection to share, so symbol look-ups from every watchlist are cached once
+    def __init__(self, api_or_parent, instrument_collection=None, **kwargs):
+        super().__init__(api_or_parent, **kwargs)
+        self.instrument_collection = instrument_collection or Instruments(self, root=True)
+
     def create(self, name):
         return self.post(None, data={'name': name})
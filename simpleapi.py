@@ -1,17 +1,118 @@
 ##
 # Simple API
+import concurrent.futures
+import email.utils
+import hashlib
+import json
+import random
+import threading
 import requests
+import requests.adapters
 import logging
+import time
+from urllib3.util.retry import Retry
+
+# Decode JSON with orjson or ujson when installed, falling back to the standard library
+try:
+  import orjson as fastjson
+except ImportError:
+  try:
+    import ujson as fastjson
+  except ImportError:
+    fastjson = None
+
+loads = fastjson.loads if fastjson else json.loads
+
+_UNPARSED = object()
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+##
+# Retry with full jitter on the exponential backoff, so that concurrent workers do not retry in lock-step.
+# A Retry-After header, when present, still takes precedence over the backoff.
+class JitteredRetry(Retry):
+  def get_backoff_time(self):
+    backoff = super().get_backoff_time()
+    return random.uniform(0, backoff) if backoff > 0 else 0
+
+##
+# Build a transport adapter with a connection pool of the given size, retrying idempotent requests only.
+# Throttling (429) is not retried here, but left to a RateLimitAPI, so that every caller slows down together.
+def pooled_adapter(pool_size = DEFAULT_POOL_SIZE, retries = DEFAULT_RETRIES, backoff = DEFAULT_BACKOFF):
+  methods = 'allowed_methods' if hasattr(Retry, 'DEFAULT_ALLOWED_METHODS') else 'method_whitelist'
+  retry = JitteredRetry(
+    total = retries,
+    backoff_factor = backoff,
+    status_forcelist = (500, 502, 503, 504),
+    respect_retry_after_header = True,
+    raise_on_status = False,
+    **{ methods: frozenset(['GET', 'HEAD', 'OPTIONS']) }
+  )
+  return requests.adapters.HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = retry)
+
+##
+# A response whose body is decoded at most once.
+# json() parses the raw bytes on first use and keeps the result, so every layer and caller sharing a response, such as
+# through a cache, shares one parse; the result must be treated as read-only. Everything else passes through to the
+# wrapped requests.Response.
+class ParsedResponse(object):
+  def __init__(self, response):
+    self.response = response
+    self._json = _UNPARSED
+    self._text = None
+    self._lock = threading.Lock()
+
+  def json(self):
+    if self._json is _UNPARSED:
+      with self._lock:
+        if self._json is _UNPARSED:
+          self._json = loads(self.response.content)
+    return self._json
+
+  @property
+  def text(self):
+    if self._text is None:
+      self._text = self.response.text
+    return self._text
+
+  def __getattr__(self, name):
+    return getattr(self.response, name)
+
+  def __bool__(self):
+    return bool(self.response)
+
+  def __repr__(self):
+    return '<ParsedResponse [{}]>'.format(self.response.status_code)
 
 ##
 # Simple restful api
 class API(object):
-  def __init__(self, endpoint, session = None):
+  def __init__(self, endpoint, session = None, pool_size = DEFAULT_POOL_SIZE, retries = DEFAULT_RETRIES, backoff = DEFAULT_BACKOFF):
     self.session = session if session else requests.Session()
     self.endpoint = endpoint
 
+    # Size the connection pool to the number of concurrent workers, so connections are kept alive rather than discarded
+    adapter = pooled_adapter(pool_size, retries, backoff)
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+
     self.session.headers.update({ 'Accept': 'application/json' })
 
+  ##
+  # Count requests and newly opened connections across the session's pools
+  # @return A dict of requests, connections, and requests that reused an existing connection
+  def transport_stats(self):
+    requests_made, connections = 0, 0
+    for adapter in set(self.session.adapters.values()):
+      pools = adapter.poolmanager.pools
+      for key in pools.keys():
+        pool = pools[key]
+        requests_made += pool.num_requests
+        connections += pool.num_connections
+    return { 'requests': requests_made, 'connections': connections, 'reused': requests_made - connections }
+
   ##
   # Return a completed, relative URI
   def relative_uri(self, uri):
@@ -26,23 +127,29 @@ class API(object):
   def _absolute_uri(self, uri = None, *args, **kwargs):
     return requests.Request('GET', self.relative_uri(uri), *args, **kwargs).prepare().url
 
+  ##
+  # Wrap a response so its body is decoded once; the body is only logged when debugging
+  def _parsed(self, response):
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug(response.text)
+    return ParsedResponse(response)
+
   def get(self, uri, *args, **kwargs):
     uri = self.relative_uri(uri)
-    response = self.session.get(uri, *args, **kwargs)
-    logging.debug(response.text)
-    return response
+    return self._parsed(self.session.get(uri, *args, **kwargs))
 
   def post(self, uri, *args, **kwargs):
     uri = self.relative_uri(uri)
-    response = self.session.post(uri, *args, **kwargs)
-    logging.debug(response.text)
-    return response
+    return self._parsed(self.session.post(uri, *args, **kwargs))
 
   def delete(self, uri, *args, **kwargs):
     uri = self.relative_uri(uri)
-    response = self.session.delete(uri, *args, **kwargs)
-    logging.debug(response.text)
-    return response
+    return self._parsed(self.session.delete(uri, *args, **kwargs))
+
+  ##
+  # Nothing is cached here, so there is nothing to forget
+  def forget(self, uri, *args, **kwargs):
+    pass
 
 
 ##
@@ -85,7 +192,8 @@ class TokenAPI(APIProxy):
       self.api.session.headers.pop('Authorization', None)
 
   def assign_token_if_exists(self, response):
-    if response.status_code == requests.codes.ok and response.content:
+    # Only token responses are decoded here; everything else is left for the caller to decode, once
+    if response.status_code == requests.codes.ok and b'access_token' in (response.content or b''):
       token = response.json().get('access_token', None)
       if token:
         logging.debug('Assigning token %s', token)
@@ -93,17 +201,338 @@ class TokenAPI(APIProxy):
     pass
 
 ##
-# Memory Cache API
+# A token bucket, shared by every thread that takes from it.
+# Each caller reserves a token, going into debt if there are none, and waits until the debt is repaid at the current
+# rate; so callers are spaced out fairly rather than retrying in a crowd. The rate adapts: throttling halves it and
+# pauses the bucket for any Retry-After, and each success adds back a little, up to the maximum.
+class TokenBucket(object):
+  def __init__(self, rate, capacity = 1, max_rate = None, min_rate = None, increase = 0.02, decrease = 0.5):
+    self.rate = float(rate)
+    self.capacity = float(capacity)
+    self.max_rate = float(max_rate or rate)
+    self.min_rate = float(min_rate or self.rate / 100.0)
+    self.increase = increase
+    self.decrease = decrease
+    self._tokens = self.capacity
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  ##
+  # Take a token
+  # @return The number of seconds to wait before using it
+  def reserve(self):
+    with self._lock:
+      self._refill()
+      self._tokens -= 1.0
+      return max(0.0, -self._tokens / self.rate)
+
+  def acquire(self):
+    time.sleep(self.reserve())
+
+  ##
+  # Slow down after being throttled
+  # @retry_after Seconds the server asked to wait, if it said
+  def throttled(self, retry_after = None):
+    with self._lock:
+      self._refill()
+      self.rate = max(self.min_rate, self.rate * self.decrease)
+      self._tokens = min(self._tokens, 0.0) - (retry_after or 0.0) * self.rate
+
+  def succeeded(self):
+    with self._lock:
+      self.rate = min(self.max_rate, self.rate + self.increase * self.max_rate)
+
+  def _refill(self):
+    now = time.monotonic()
+    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+    self._updated = now
+
+  def __repr__(self):
+    return '<TokenBucket rate={:0.2f}/s capacity={:0.0f}>'.format(self.rate, self.capacity)
+
+##
+# Rate-limited API: every request first takes a token from the bucket for its class of endpoint.
+# Throttled idempotent requests (429) are retried once the bucket allows. Other methods, such as an order POST, are
+# returned throttled rather than risk being made twice, as with the transport's retries.
+class RateLimitAPI(APIProxy):
+  THROTTLED = 429
+  IDEMPOTENT_METHODS = frozenset(['get', 'head', 'options'])
+
+  ##
+  # @buckets A dict of endpoint class to TokenBucket; must include 'default'
+  # @classify A function of a method and absolute URI returning an endpoint class; everything is 'default' without one
+  # @retries The most times to retry a throttled request
+  def __init__(self, api, buckets, classify = None, retries = DEFAULT_RETRIES):
+    super().__init__(api)
+    self.buckets = buckets
+    self.classify = classify or (lambda method, uri: 'default')
+    self.retries = retries
+
+  def get(self, uri, *args, **kwargs):
+    return self._request('get', uri, *args, **kwargs)
+
+  def post(self, uri, *args, **kwargs):
+    return self._request('post', uri, *args, **kwargs)
+
+  def delete(self, uri, *args, **kwargs):
+    return self._request('delete', uri, *args, **kwargs)
+
+  def bucket_for(self, method, uri):
+    return self.buckets.get(self.classify(method, self.relative_uri(uri)), self.buckets['default'])
+
+  def _request(self, method, uri, *args, **kwargs):
+    bucket = self.bucket_for(method, uri)
+    attempts = self.retries + 1 if method in self.IDEMPOTENT_METHODS else 1
+    for attempt in range(attempts):
+      bucket.acquire()
+      response = getattr(self.api, method)(uri, *args, **kwargs)
+      if response.status_code != self.THROTTLED:
+        bucket.succeeded()
+        return response
+      bucket.throttled(retry_after(response))
+      logging.warning('Throttled on %s %s; slowing to %s', method.upper(), self.relative_uri(uri), bucket)
+    return response
+
+##
+# Read a response's Retry-After header, given either as seconds or as an HTTP date
+# @return Seconds to wait, or None if not given
+def retry_after(response):
+  value = response.headers.get('Retry-After')
+  if not value:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  try:
+    return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+  except (TypeError, ValueError):
+    return None
+
+##
+# Whether one URI is under the other, so a write to either may change the other
+def _related(uri, other):
+  return uri.startswith(other) or other.startswith(uri)
+
+##
+# Single-flight call deduplication: concurrent calls for the same key share one execution and its result.
+# Callers block on a thread-level future, so coroutines should call through an executor.
+class SingleFlight(object):
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._calls = {}
+
+  def do(self, key, function, *args, **kwargs):
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = concurrent.futures.Future()
+
+    # Someone else is already making this call; wait for their result
+    if not leader:
+      return call.result()
+
+    try:
+      result = function(*args, **kwargs)
+    except BaseException as e:
+      call.set_exception(e)
+      raise
+    else:
+      call.set_result(result)
+      return result
+    finally:
+      with self._lock:
+        self._calls.pop(key, None)
+
+##
+# Memory Cache API: GET responses are kept by full URI until reset, or until a POST or DELETE to a related resource.
+# A write clears the responses under the URI written to, and those of the collections containing it. Each write also
+# starts a new generation, and responses to requests begun in an older one are not kept, as they may predate the write.
 class MemoryCacheAPI(APIProxy):
   def __init__(self, api):
     super().__init__(api)
-    self.reset()
+    self._flights = SingleFlight()
+    self._lock = threading.Lock()
+    self._generation = 0
+    self._cache = {}
 
   def get(self, uri, *args, **kwargs):
     full_uri = self.build_full_uri(uri, *args, **kwargs)
-    if not self._cache.get(full_uri, None):
-      self._cache[full_uri] = self.api.get(uri, *args, **kwargs)
-    return self._cache[full_uri]
+    response = self._cache.get(full_uri, None)
+    if not response:
+      response = self._flights.do(full_uri, self._get_and_cache, full_uri, uri, *args, **kwargs)
+    return response
+
+  def _get_and_cache(self, full_uri, uri, *args, **kwargs):
+    # Check again, as another caller may have finished this request while we waited for the lock
+    response = self._cache.get(full_uri, None)
+    if not response:
+      generation = self._generation
+      response = self.api.get(uri, *args, **kwargs)
+      with self._lock:
+        if generation == self._generation:
+          self._cache[full_uri] = response
+    return response
+
+  ##
+  # Writes pass through, and clear the cached responses they may have changed
+  def post(self, uri, *args, **kwargs):
+    try:
+      return self.api.post(uri, *args, **kwargs)
+    finally:
+      self.invalidate(uri)
+
+  def delete(self, uri, *args, **kwargs):
+    try:
+      return self.api.delete(uri, *args, **kwargs)
+    finally:
+      self.invalidate(uri)
+
+  ##
+  # Forget the cached responses for a resource: any under its URI, whatever their query, and any of its collections
+  def invalidate(self, uri):
+    written = self.build_full_uri(uri).split('?', 1)[0]
+    with self._lock:
+      self._generation += 1
+      self._cache = {
+        full_uri: response for full_uri, response in self._cache.items()
+        if not _related(full_uri.split('?', 1)[0], written)
+      }
+
+  ##
+  # Forget one cached response, such as an empty result its caller no longer trusts
+  def forget(self, uri, *args, **kwargs):
+    full_uri = self.build_full_uri(uri, *args, **kwargs)
+    with self._lock:
+      self._cache.pop(full_uri, None)
 
   def reset(self):
-    self._cache = {}
+    with self._lock:
+      self._generation += 1
+      self._cache = {}
+
+  ##
+  # The approximate number of bytes held, counting response bodies only
+  def nbytes(self):
+    return sum(len(response.content or b'') for response in list(self._cache.values()))
+
+  ##
+  # Release every cached response, for when memory is short
+  # @return The approximate number of bytes released
+  def shed(self):
+    released = self.nbytes()
+    self.reset()
+    return released
+
+##
+# Record/replay API: records request/response pairs to a JSON-lines cassette, or replays them without a network.
+# Replays are deterministic: repeated identical requests return their recordings in order, then repeat the last one.
+# Request bodies are stored only as a hash, without any credentials, and tokens in responses are redacted.
+class CassetteAPI(APIProxy):
+  RECORD = 'record'
+  REPLAY = 'replay'
+
+  REDACTED_FIELDS = { 'access_token', 'refresh_token' }
+  CREDENTIAL_FIELDS = { 'password', 'mfa_code', 'client_secret', 'refresh_token' }
+
+  def __init__(self, api, path, mode = REPLAY, replay_latency = False):
+    super().__init__(api)
+    if mode not in { self.RECORD, self.REPLAY }:
+      raise ValueError('Unknown cassette mode {}'.format(mode))
+    self.path = path
+    self.mode = mode
+    self.replay_latency = replay_latency
+    self._lock = threading.Lock()
+    self._index = {}
+    if mode == self.REPLAY:
+      self._build_index()
+
+  def get(self, uri, *args, **kwargs):
+    return self._request('GET', uri, *args, **kwargs)
+
+  def post(self, uri, *args, **kwargs):
+    return self._request('POST', uri, *args, **kwargs)
+
+  def delete(self, uri, *args, **kwargs):
+    return self._request('DELETE', uri, *args, **kwargs)
+
+  ##
+  # A stable key for a request: method, full URI including query, and a hash of any body.
+  # Credentials are dropped from the body first, so the cassette holds no fingerprint of them.
+  def key_for(self, method, uri, *args, **kwargs):
+    full_uri = self.build_full_uri(uri, params = kwargs.get('params'))
+    body = kwargs.get('data') or kwargs.get('json')
+    if isinstance(body, dict):
+      body = { k: v for k, v in body.items() if k not in self.CREDENTIAL_FIELDS }
+    body = json.dumps(body, sort_keys = True, default = str)
+    return ' '.join([ method, full_uri, hashlib.sha256(body.encode('utf-8')).hexdigest()[:16] ])
+
+  def _request(self, method, uri, *args, **kwargs):
+    key = self.key_for(method, uri, *args, **kwargs)
+    if self.mode == self.REPLAY:
+      return self._replay(key)
+
+    started = time.time()
+    response = getattr(self.api, method.lower())(uri, *args, **kwargs)
+    self._record(key, response, time.time() - started)
+    return response
+
+  def _record(self, key, response, elapsed):
+    entry = {
+      'key': key,
+      'url': response.url,
+      'status': response.status_code,
+      'headers': { k: v for k, v in response.headers.items() if k.lower() in { 'content-type', 'retry-after' } },
+      'content': self._redact(response.text),
+      'elapsed': elapsed
+    }
+    line = json.dumps(entry) + '\n'
+    with self._lock:
+      with open(self.path, 'a') as file:
+        file.write(line)
+
+  def _redact(self, text):
+    try:
+      content = json.loads(text)
+    except ValueError:
+      return text
+    if isinstance(content, dict) and self.REDACTED_FIELDS.intersection(content):
+      content.update({ field: 'redacted' for field in self.REDACTED_FIELDS.intersection(content) })
+      return json.dumps(content)
+    return text
+
+  ##
+  # Index the cassette by key to byte offsets, so responses are only read from disk when replayed
+  def _build_index(self):
+    offset = 0
+    with open(self.path, 'rb') as file:
+      for line in file:
+        if line.strip():
+          key = json.loads(line.decode('utf-8'))['key']
+          self._index.setdefault(key, []).append(offset)
+        offset += len(line)
+    self._positions = { key: 0 for key in self._index }
+
+  def _replay(self, key):
+    with self._lock:
+      offsets = self._index.get(key)
+      if not offsets:
+        raise KeyError('No recording for {}'.format(key))
+      position = self._positions[key]
+      self._positions[key] = min(position + 1, len(offsets) - 1)
+
+    with open(self.path, 'rb') as file:
+      file.seek(offsets[position])
+      entry = json.loads(file.readline().decode('utf-8'))
+
+    if self.replay_latency:
+      time.sleep(entry['elapsed'])
+
+    response = requests.Response()
+    response.status_code = entry['status']
+    response.url = entry['url']
+    response.headers.update(entry['headers'])
+    response.encoding = 'utf-8'
+    response._content = entry['content'].encode('utf-8')
+    return ParsedResponse(response)
@@ -0,0 +1,306 @@
+# Standard library imports
+import concurrent.futures
+import csv
+import itertools
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+import algo
+
+##
+# Every parameter a sweep can vary, with its default
+# lookback, min_lookback: given to SharpeAlgo; SharpeAlgo's own defaults
+# secondary_max_in_one: the tier cap; the algo's weights are re-scaled to 1.0 and capped, as combiner.ALWAYS does;
+#   main's SECONDARY_MAX_IN_ONE
+# max_in_one: the largest weight of any one symbol once allocated, as helper.allocate_shares applies it; main's
+#   MAX_IN_ONE
+# equity_utilisation: the fraction of the backtest's wealth invested, the rest being held as cash. This is not main's
+#   EQUITY_UTILISATION, which scales equity into capital alongside margin; the backtest has no margin, so is fully
+#   invested by default
+# buy_limit: buys are limit orders at this multiple of the quote, and miss when the next close is above the limit;
+#   main's BUY_LIMIT
+DEFAULTS = {
+    'lookback': 21,
+    'min_lookback': 7,
+    'secondary_max_in_one': 5.0 / 6.0,
+    'max_in_one': 8.0 / 9.0,
+    'equity_utilisation': 1.0,
+    'buy_limit': 1.5
+}
+
+# Only these parameters need the optimiser re-run; every other parameter is applied to its weights
+OPTIMISER_PARAMETERS = ('lookback', 'min_lookback')
+
+METRICS = ['sharpe', 'annual_return', 'volatility', 'max_drawdown', 'turnover']
+
+
+##
+# Every combination of the given values
+# @space A dict of parameter name to a list of values
+# @return A generator of parameter dicts
+def grid(space):
+    names = list(space)
+    for values in itertools.product(*[space[name] for name in names]):
+        yield dict(zip(names, values))
+
+
+##
+# Random combinations of the given values
+# @space A dict of parameter name to either a list of values to choose from, or a (low, high) tuple to draw uniformly
+#   from; a tuple of two ints draws ints, inclusive
+# @return A generator of parameter dicts
+def random_search(space, count, random_state=None):
+    random = np.random.RandomState(random_state)
+    for _ in range(count):
+        combination = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    combination[name] = int(random.randint(low, high + 1))
+                else:
+                    combination[name] = float(random.uniform(low, high))
+            else:
+                combination[name] = values[random.randint(len(values))]
+        yield combination
+
+
+##
+# A walk-forward backtest over a panel of daily prices.
+# Prices and returns are computed once and shared by every combination: the optimiser runs once per rebalance date for
+# each distinct (lookback, min_lookback), and every other parameter is evaluated on those weights for all combinations
+# at once.
+class Backtest(object):
+
+    ##
+    # @prices A pandas.DataFrame of prices; vertical axis are dates and horizontal axis are symbols
+    # @rebalance_every The number of days between rebalances
+    def __init__(self, prices, rebalance_every=5):
+        self.prices = prices.astype(float)
+        self.values = self.prices.values
+        self.rebalance_every = rebalance_every
+
+        # Growth of every symbol from each day to the next; missing prices are treated as no change
+        growth = self.values[1:] / self.values[:-1]
+        self.growth = np.where(np.isfinite(growth), growth, 1.0)
+
+    ##
+    # The rows on which to rebalance, once at least the given number of days of prices are available
+    def rebalance_rows(self, lookback):
+        return np.arange(lookback - 1, len(self.values) - 1, self.rebalance_every)
+
+    ##
+    # Optimise SharpeAlgo weights as of each given row, from the prices up to and including it
+    # @return A (rows x symbols) numpy array; a row is all zeros when no portfolio is found
+    def weights_path(self, lookback, min_lookback, rows):
+        sharpe = algo.SharpeAlgo(None, lookback, min_lookback)
+        path = np.zeros((len(rows), self.values.shape[1]))
+        for number, row in enumerate(rows):
+            window = self.prices.iloc[max(0, row - lookback + 1):row + 1].dropna(axis=1)
+            # Calculate directly, without the logging of every window; no window with a positive Sharpe means cash
+            try:
+                weights = sharpe._calculate_target_weights(window)
+            except ValueError as e:
+                logging.debug('No portfolio at %s: %s', self.prices.index[row], e)
+                continue
+            path[number] = weights.reindex(self.prices.columns).fillna(0.0).values
+        return path
+
+    ##
+    # Evaluate many combinations that share one weights path
+    # @path A (rows x symbols) numpy array of optimiser weights, as from weights_path
+    # @rows The rebalance rows of the path
+    # @combinations A list of parameter dicts
+    # @return A pandas.DataFrame of METRICS, one row per combination
+    def evaluate(self, path, rows, combinations):
+        parameters = pd.DataFrame(combinations)
+        tier_cap = parameters['secondary_max_in_one'].values[:, None, None]
+        max_in_one = parameters['max_in_one'].values[:, None, None]
+        utilisation = parameters['equity_utilisation'].values[:, None]
+        buy_limit = parameters['buy_limit'].values[:, None]
+
+        # Targets for every combination and rebalance: (combinations x rows x symbols)
+        totals = path.sum(axis=1, keepdims=True)
+        normalised = np.divide(path, totals, out=np.zeros_like(path), where=totals > 0.0)
+        targets = np.minimum(np.minimum(normalised[None, :, :], tier_cap), max_in_one)
+
+        count, symbols = len(parameters), path.shape[1]
+        held = np.zeros((count, symbols))
+        daily, turnover = [], np.zeros(count)
+        ends = np.append(rows[1:], len(self.values) - 1)
+
+        for number, (row, end) in enumerate(zip(rows, ends)):
+            target = targets[:, number, :] * utilisation
+
+            # Buys miss when the price moves past the limit before they fill
+            missed = (target > held) & (self.growth[row][None, :] > buy_limit)
+            target = np.where(missed, held, target)
+            turnover += np.abs(target - held).sum(axis=1) / 2.0
+
+            # Hold until the next rebalance, letting positions drift with prices
+            growth = np.cumprod(self.growth[row:end], axis=0)
+            values = (1.0 - target.sum(axis=1))[None, :] + growth.dot(target.T)
+            daily.append(values / np.vstack((np.ones((1, count)), values[:-1])) - 1.0)
+            held = target * growth[-1][None, :] / values[-1][:, None]
+
+        return self.metrics(np.vstack(daily), turnover / max(len(rows), 1))
+
+    ##
+    # Summarise daily portfolio returns
+    # @daily A (days x combinations) numpy array of daily returns
+    # @return A pandas.DataFrame of METRICS
+    def metrics(self, daily, turnover):
+        mean, volatility = daily.mean(axis=0), daily.std(axis=0, ddof=1)
+        wealth = np.cumprod(1.0 + daily, axis=0)
+        drawdown = wealth / np.maximum.accumulate(wealth, axis=0) - 1.0
+        return pd.DataFrame({
+            'sharpe': np.divide(mean, volatility, out=np.zeros_like(mean), where=volatility > 0.0) * np.sqrt(252),
+            'annual_return': wealth[-1] ** (252.0 / len(daily)) - 1.0,
+            'volatility': volatility * np.sqrt(252),
+            'max_drawdown': drawdown.min(axis=0),
+            'turnover': turnover
+        }, columns=METRICS)
+
+
+##
+# Find the combinations that another beats on Sharpe by at least the margin while doing no worse on annual return and
+# maximum drawdown, and strictly better on at least one; so no combination beats itself, or an exact tie
+# @return A numpy boolean array
+def dominated(metrics, margin=0.0):
+    sharpe, returns, drawdown = (metrics[name].values for name in ('sharpe', 'annual_return', 'max_drawdown'))
+    result = np.zeros(len(metrics), dtype=bool)
+    for start in range(0, len(metrics), 512):
+        block = slice(start, start + 512)
+        beats = ((sharpe[None, :] >= sharpe[block, None] + margin) &
+                 (returns[None, :] >= returns[block, None]) &
+                 (drawdown[None, :] >= drawdown[block, None]) &
+                 ((sharpe[None, :] > sharpe[block, None]) |
+                  (returns[None, :] > returns[block, None]) |
+                  (drawdown[None, :] > drawdown[block, None])))
+        result[block] = beats.any(axis=1)
+    return result
+
+
+##
+# Sweep parameter combinations across a historical price panel, streaming results to a CSV table.
+# History is evaluated in stages; after each stage, combinations dominated on the history so far are stopped, and an
+# optimiser configuration is no longer run once none of its combinations remain.
+# @prices A pandas.DataFrame of prices; vertical axis are dates and horizontal axis are symbols
+# @combinations An iterable of parameter dicts, such as from grid or random_search; missing parameters take DEFAULTS
+# @output A CSV file to write results to as they are decided; each row has the parameters, METRICS, and the stage it
+#   was stopped at, or the final stage for combinations that ran to the end
+# @workers Worker processes for the optimiser, defaulting to one per core; 0 runs everything in this process
+# @stages The number of stages to split history into
+# @margin The Sharpe margin by which a combination must be beaten, at an earlier stage, to be stopped
+# @return A pandas.DataFrame of every result
+def sweep(prices, combinations, output='sweep.csv', workers=None, rebalance_every=5, stages=4, margin=0.25):
+    combinations = [dict(DEFAULTS, **combination) for combination in combinations]
+    unknown = {name for combination in combinations for name in combination} - set(DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown parameters {}'.format(', '.join(sorted(unknown))))
+    backtest = Backtest(prices, rebalance_every)
+
+    # Every combination is scored on the same rebalance dates, so results are comparable
+    rows = backtest.rebalance_rows(max(combination['lookback'] for combination in combinations))
+    boundaries = [split[-1] for split in np.array_split(np.arange(len(rows)), stages) if len(split)]
+
+    keys = sorted({tuple(combination[name] for name in OPTIMISER_PARAMETERS) for combination in combinations})
+    members = {key: [number for number, combination in enumerate(combinations)
+                     if tuple(combination[name] for name in OPTIMISER_PARAMETERS) == key] for key in keys}
+    paths = {key: np.zeros((0, prices.shape[1])) for key in keys}
+    alive = np.ones(len(combinations), dtype=bool)
+    results, done = [], 0
+
+    names = list(DEFAULTS)
+    with open(output, 'w', newline='') as file, _pool(workers, backtest) as pool:
+        writer = csv.writer(file)
+        writer.writerow(names + METRICS + ['stage'])
+
+        for stage, boundary in enumerate(boundaries):
+            stage_rows = rows[done:boundary + 1]
+            running = [key for key in keys if alive[members[key]].any()]
+
+            # Extend each running configuration's weights path over this stage's rebalance dates
+            futures = {key: pool.submit(_weights_path, key, stage_rows) for key in running}
+            for key in running:
+                paths[key] = np.vstack((paths[key], futures[key].result()))
+            done = boundary + 1
+
+            # Score every surviving combination on the history so far
+            scored = []
+            for key in running:
+                numbers = [number for number in members[key] if alive[number]]
+                metrics = backtest.evaluate(paths[key], rows[:done], [combinations[number] for number in numbers])
+                scored.append(metrics.set_index(pd.Index(numbers)))
+            scored = pd.concat(scored).sort_index()
+
+            final = stage == len(boundaries) - 1
+            stopped = scored.index if final else scored.index[dominated(scored, margin)]
+            for number in stopped:
+                row = [combinations[number].get(name) for name in names] + list(scored.loc[number, METRICS])
+                writer.writerow(row + [stage])
+                results.append(row + [stage])
+            file.flush()
+
+            alive[stopped] = False
+            logging.info('Stage %i: %i of %i days, %i combinations stopped, %i running', stage, rows[done - 1] + 1,
+                         len(prices), len(stopped) if not final else 0, alive.sum())
+
+    return pd.DataFrame(results, columns=names + METRICS + ['stage'])
+
+
+##
+# Optimiser work, in a worker process; each worker holds its own copy of the backtest, sent to it once
+_backtest = None
+
+
+def _initialise_worker(backtest):
+    global _backtest
+    _backtest = backtest
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _weights_path(key, rows):
+    return _backtest.weights_path(*key, rows)
+
+
+##
+# A process pool with the backtest loaded in every worker, or an in-process stand-in
+def _pool(workers, backtest):
+    global _backtest
+    if workers == 0:
+        return _InProcess(backtest)
+    try:
+        try:
+            return concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count(), initializer=_initialise_worker,
+                                                          initargs=(backtest,))
+        except TypeError:
+            # Before Python 3.7 pools take no initializer; forked workers inherit the backtest from this process
+            if multiprocessing.get_start_method() != 'fork':
+                raise NotImplementedError('workers cannot be given the backtest')
+            _backtest = backtest
+            return concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count())
+    except (OSError, NotImplementedError) as e:
+        logging.warning('Process pool unavailable, sweeping in this process: %s', e)
+        return _InProcess(backtest)
+
+
+class _InProcess(object):
+
+    def __init__(self, backtest):
+        self.backtest = backtest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def submit(self, function, key, rows):
+        future = concurrent.futures.Future()
+        future.set_result(self.backtest.weights_path(*key, rows))
+        return future
@@ -0,0 +1,147 @@
+# Standard library imports
+import json
+import logging
+import sqlite3
+
+##
+# Table definitions; every table is keyed by id and indexed on updated_at, symbol and state
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS {table} (
+    id TEXT PRIMARY KEY,
+    updated_at TEXT,
+    symbol TEXT,
+    state TEXT,
+    side TEXT,
+    quantity REAL,
+    price REAL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS {table}_updated_at ON {table} (updated_at);
+CREATE INDEX IF NOT EXISTS {table}_symbol ON {table} (symbol);
+CREATE INDEX IF NOT EXISTS {table}_state ON {table} (state);
+'''
+
+WATERMARKS = '''
+CREATE TABLE IF NOT EXISTS watermarks (
+    collection TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL
+);
+'''
+
+
+##
+# A local, indexed copy of an account's orders and positions, kept up to date incrementally.
+# Orders are fetched only if updated since the last sync's watermark; positions have no server-side filter, so are
+# re-listed in full but only rows that changed are rewritten.
+class LocalStore(object):
+    TABLES = ('orders', 'positions')
+
+    # The query parameter used to ask for records updated since a given time
+    SINCE_PARAMS = {'orders': 'updated_at[gte]'}
+
+    def __init__(self, path='algo.db'):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            for table in self.TABLES:
+                self.connection.executescript(SCHEMA.format(table=table))
+            self.connection.executescript(WATERMARKS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    ##
+    # Bring the store up to date
+    # @client A robinhood.Client
+    # @return A dict of the number of records written per table
+    def sync(self, client):
+        return {
+            'orders': self._sync('orders', client, client.orders),
+            'positions': self._sync('positions', client, client.positions())
+        }
+
+    def _sync(self, table, client, collection):
+        watermark = self.watermark(table)
+        since = self.SINCE_PARAMS.get(table)
+        params = {since: watermark} if since and watermark else {}
+        logging.info('Syncing %s since %s', table, watermark or 'the beginning')
+
+        # Pages arrive newest first, so the watermark only moves once every page is stored, with the last of them;
+        # an interrupted sync then starts again from the previous watermark rather than skipping older records
+        written, latest = 0, watermark or ''
+        for items, next_uri in collection.pages(params=params):
+            items = [item for item in items if not watermark or (item.get('updated_at') or '') >= watermark]
+            latest = max([latest] + [item.get('updated_at') or '' for item in items])
+            written += self._upsert(table, client, items, latest if next_uri is None else None)
+        logging.info('Synced %i %s', written, table)
+        return written
+
+    ##
+    # Write changed records, resolving their symbols in bulk
+    # @watermark If given, move the table's watermark to it in the same transaction
+    def _upsert(self, table, client, items, watermark=None):
+        ids = [item.get('id') or item['url'] for item in items]
+        existing = dict(self.connection.execute(
+            'SELECT id, updated_at FROM {} WHERE id IN ({})'.format(table, ','.join('?' * len(ids))), ids).fetchall())
+        changed = [(key, item) for key, item in zip(ids, items)
+                   if key not in existing or existing[key] != item.get('updated_at')]
+
+        instruments = client.instruments(*[item['instrument'] for key, item in changed]) if changed else []
+        rows = [
+            (key, item.get('updated_at'), instrument['symbol'], item.get('state'), item.get('side'),
+             _float(item.get('cumulative_quantity') or item.get('quantity')),
+             _float(item.get('average_price') or item.get('price') or item.get('average_buy_price')),
+             json.dumps(item))
+            for (key, item), instrument in zip(changed, instruments)
+        ]
+
+        with self.connection:
+            if rows:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO {} (id, updated_at, symbol, state, side, quantity, price, payload) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'.format(table), rows)
+            if watermark and watermark > (self.watermark(table) or ''):
+                self.connection.execute('INSERT OR REPLACE INTO watermarks (collection, updated_at) VALUES (?, ?)',
+                                        (table, watermark))
+        return len(rows)
+
+    ##
+    # The latest updated_at seen for a table, or None if never synced
+    def watermark(self, table):
+        row = self.connection.execute('SELECT updated_at FROM watermarks WHERE collection = ?', (table,)).fetchone()
+        return row[0] if row else None
+
+    ##
+    # Query stored orders
+    # @return A list of order dicts, oldest update first
+    def orders(self, symbol=None, state=None, since=None):
+        return self._query('orders', symbol, state, since)
+
+    ##
+    # Query stored positions
+    # @return A list of position dicts, oldest update first
+    def positions(self, symbol=None, since=None):
+        return self._query('positions', symbol, None, since)
+
+    def _query(self, table, symbol, state, since):
+        clauses, values = [], []
+        for column, operator, value in (('symbol', '=', symbol), ('state', '=', state), ('updated_at', '>=', since)):
+            if value is not None:
+                clauses.append('{} {} ?'.format(column, operator))
+                values.append(value)
+        sql = 'SELECT symbol, payload FROM {}'.format(table)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY updated_at'
+        return [dict(json.loads(row['payload']), symbol=row['symbol']) for row in self.connection.execute(sql, values)]
+
+
+def _float(value):
+    return None if value is None else float(value)
@@ -0,0 +1,68 @@
+import importlib.util
+import os
+import types
+from unittest import TestCase
+
+import pandas as pd
+
+import rebalance
+import robinhood
+
+
+##
+# Load the action module by path, as importing __main__ by name finds the test runner
+def load_action():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__main__.py')
+    spec = importlib.util.spec_from_file_location('action', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestPlaceOrders(TestCase):
+
+    class OrderManager(object):
+        def __init__(self):
+            self.orders = []
+
+        def sell(self, symbol, quantity):
+            self.orders.append(('sell', symbol, quantity))
+
+        def buy(self, symbol, quantity, limit=None):
+            self.orders.append(('buy', symbol, quantity))
+
+        def execute(self):
+            self.orders.append(('execute',))
+
+    def test_sells_are_placed_before_buys(self):
+        action = load_action()
+        delta = pd.Series({'AAA': 2.0, 'BBB': -1.0, 'CCC': 3.0, 'DDD': -4.0})
+        plan = action.Plan(1000.0, pd.Series({'AAA': 1.0, 'BBB': 1.0, 'CCC': 1.0, 'DDD': 1.0}), None, None, delta)
+        manager = self.OrderManager()
+
+        self.assertEqual(action.place_orders(manager, plan, execute=False), 4)
+        sides = [order[0] for order in manager.orders]
+        self.assertEqual(sides, ['sell', 'sell', 'buy', 'buy'])
+
+
+class TestPlanOrders(TestCase):
+
+    ##
+    # A client that can only be planned against through a snapshot
+    class Client(object):
+        def snapshot(self):
+            raise AssertionError('A snapshot was given')
+
+    def test_plans_from_the_snapshot(self):
+        action = load_action()
+        action.EQUITY_UTILISATION = 1.0
+        positions = types.MappingProxyType({'AAA': 10.0, 'BBB': 5.0})
+        snapshot = robinhood.AccountSnapshot('A1', 1000.0, 0.0, positions, None)
+        quotes = pd.Series({'AAA': 10.0, 'BBB': 20.0})
+        weights = pd.Series({'AAA': 0.5})
+        policy = rebalance.RebalancePolicy()
+
+        plan = action.plan_orders(self.Client(), weights, policy, quotes=quotes, snapshot=snapshot)
+        self.assertEqual(plan.capital, 1000.0)
+        self.assertEqual(dict(plan.current), dict(positions))
+        self.assertEqual(dict(plan.delta), {'BBB': -5.0, 'AAA': 40.0})
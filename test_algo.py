@@ -0,0 +1,53 @@
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+import algo
+import memory
+
+
+class TestAlgoExecutor(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        returns = rng.normal([0.002, 0.001, 0.0015, -0.001], 0.01, (30, 4))
+        dates = pd.date_range('2018-01-01', periods=30).date
+        self.panel = pd.DataFrame(100.0 * np.cumprod(1.0 + returns, axis=0), index=dates, columns=list('ABCD'))
+
+    def weights(self, strategy):
+        algos = [algo.UniverseSharpeAlgo(None, list('ABCD'), panel=self.panel), algo.UniverseAlgo(['E'])]
+        with algo.AlgoExecutor(strategy, max_workers=2) as executor:
+            futures = [executor.submit(a) for a in algos]
+            return [future.result() for future in futures]
+
+    def test_threads_and_processes_give_the_same_weights(self):
+        threads = self.weights(algo.AlgoExecutor.THREADS)
+        processes = self.weights(algo.AlgoExecutor.PROCESSES)
+        for expected, actual in zip(threads, processes):
+            pd.testing.assert_series_equal(expected.sort_index(), actual.sort_index(), check_names=False)
+        self.assertAlmostEqual(threads[0].sum(), 1.0)
+
+    def test_sharpe_weights_matches_the_algo(self):
+        sharpe = algo.SharpeAlgo(None, panel=self.panel)
+        values, symbols = algo.sharpe_weights(self.panel.values, list(self.panel.index), list(self.panel.columns),
+                                              sharpe.lookback, sharpe.min_lookback)
+        expected = sharpe.weights(self.panel)
+        np.testing.assert_allclose(pd.Series(values, index=symbols)[expected.index].values, expected.values)
+
+    def test_prices_are_not_downcast_under_pressure(self):
+        # The optimiser works at double precision, so downcasting its short windows would only add copies
+        with memory.MemoryTracker() as tracker:
+            tracker.under_pressure = True
+            prices = algo.UniverseSharpeAlgo(None, list('ABCD'), panel=self.panel).prices(list('ABCD'))
+        self.assertTrue((prices.dtypes == np.float64).all())
+
+    def test_no_positive_sharpe_means_no_weights(self):
+        losing = lambda prices, start=None: (pd.Series({'A': 1.0}), -0.5, None)
+        with mock.patch.object(algo.SharpeAlgo, '_calculate_target_weights_inner', side_effect=losing):
+            weights = algo.SharpeAlgo(None, panel=self.panel).weights(self.panel)
+        self.assertTrue(weights.empty)
+
+    def test_unknown_strategy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            algo.AlgoExecutor('fibers')
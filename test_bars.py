@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+import bars
+
+
+class TestResampleChunks(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        index = pd.date_range('2018-08-01 22:00', periods=3 * 24 * 60, freq='1min', tz='UTC')
+        close = 100.0 * np.cumprod(1.0 + rng.normal(0.0, 0.001, len(index)))
+        self.bars = pd.DataFrame({
+            'open': close * 0.999, 'high': close * 1.001, 'low': close * 0.998, 'close': close,
+            'volume': rng.randint(1, 100, len(index)).astype(float)
+        }, index=index)
+
+        # Drop a few hours, so some intervals have no bars at all
+        self.bars = self.bars.drop(self.bars.index[600:800])
+
+    def chunks(self, size):
+        return [self.bars.iloc[start:start + size] for start in range(0, len(self.bars), size)]
+
+    def direct(self, interval):
+        return self.bars.resample(interval).agg(bars.AGGREGATIONS).dropna(subset=['close'])
+
+    def test_chunked_equals_direct_across_boundaries(self):
+        for interval in ('15min', '1h', '1D'):
+            for size in (97, 1440, 5000):
+                resampled = pd.concat(bars.resample_chunks(self.chunks(size), interval))
+                pd.testing.assert_frame_equal(resampled, self.direct(interval), check_freq=False,
+                                              check_index_type=False, obj='{} in chunks of {}'.format(interval, size))
+
+    def test_close_panel_and_returns(self):
+        panel = bars.close_panel({'AAA': self.chunks(500), 'BBB': self.chunks(700)}, '1D')
+        expected = self.direct('1D')['close']
+        np.testing.assert_allclose(panel['AAA'].values, expected.values)
+        np.testing.assert_allclose(panel['BBB'].values, expected.values)
+
+        returns = bars.returns_panel(panel)
+        self.assertEqual(len(returns), len(panel) - 1)
+        self.assertAlmostEqual(returns['AAA'].iloc[0], expected.iloc[1] / expected.iloc[0] - 1.0)
+
+    def test_empty_chunks_are_skipped(self):
+        chunks = [self.bars.iloc[:0]] + self.chunks(2000) + [self.bars.iloc[:0]]
+        self.assertEqual(len(pd.concat(bars.resample_chunks(chunks, '1D'))), len(self.direct('1D')))
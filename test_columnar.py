@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+import columnar
+
+
+##
+# Check whether an array is a view over a memory-mapped file
+def is_mapped(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+class TestReadCSV(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'CHK.csv')
+        self.frame = pd.DataFrame({
+            'Close': [1.5, 2.25, 3.0],
+            'Volume': [100, 200, 300],
+            'Note': ['a', 'b', 'c']
+        }, index=pd.Index(['2018-01-01', '2018-01-02', '2018-01-03'], name='Date'))
+        self.frame.to_csv(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_read_matches_the_csv(self):
+        first = columnar.read_csv(self.filename)
+        self.assertTrue(os.path.exists(os.path.join(columnar.cache_path_for(self.filename), 'meta.json')))
+
+        second = columnar.read_csv(self.filename)
+        expected = pd.read_csv(self.filename, index_col=0)
+        pd.testing.assert_frame_equal(first, expected, check_dtype=False)
+        pd.testing.assert_frame_equal(second, expected, check_dtype=False, check_index_type=False)
+        self.assertTrue(is_mapped(second['Close'].values))
+
+    def test_cache_is_rebuilt_when_the_csv_changes(self):
+        columnar.read_csv(self.filename)
+        self.frame.loc['2018-01-04'] = [4.5, 400, 'd']
+        self.frame.to_csv(self.filename)
+
+        frame = columnar.read_csv(self.filename)
+        self.assertEqual(len(frame), 4)
+        self.assertEqual(frame['Close'].iloc[-1], 4.5)
+        self.assertEqual(len(columnar.read_csv(self.filename)), 4)
+
+    def test_convert_directory_skips_fresh_caches(self):
+        self.assertEqual(columnar.convert_directory(self.directory), [self.filename])
+        self.assertEqual(columnar.convert_directory(self.directory), [])
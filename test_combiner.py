@@ -0,0 +1,32 @@
+from unittest import TestCase
+import pandas as pd
+
+import combiner
+
+
+class TestTierCombiner(TestCase):
+
+    def setUp(self):
+        self.combiner = combiner.TierCombiner([
+            combiner.Tier('primary', cap=0.8, normalise=combiner.SHRINK),
+            combiner.Tier('secondary', cap=0.5, normalise=combiner.ALWAYS)
+        ])
+
+    def test_secondary_fills_unused_portfolio(self):
+        primary = [pd.Series({'AAA': 0.3}), pd.Series({'BBB': 0.2})]
+        secondary = [pd.Series({'CCC': 2.0, 'DDD': 2.0})]
+        weights = self.combiner.combine(primary, secondary)
+
+        self.assertAlmostEqual(weights['AAA'], 0.3)
+        self.assertAlmostEqual(weights['BBB'], 0.2)
+        self.assertAlmostEqual(weights['CCC'], 0.25)
+        self.assertAlmostEqual(weights['DDD'], 0.25)
+
+    def test_caps_then_shrinks_primary(self):
+        weights = self.combiner.combine([pd.Series({'AAA': 2.0, 'BBB': 0.6})], [])
+
+        self.assertAlmostEqual(weights['AAA'], 0.8 / 1.4)
+        self.assertAlmostEqual(weights['BBB'], 0.6 / 1.4)
+
+    def test_empty(self):
+        self.assertTrue(self.combiner.combine([], []).empty)
@@ -0,0 +1,122 @@
+import collections
+import datetime
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+import daemon
+import markethours
+import memory
+
+Plan = collections.namedtuple('Plan', ['current', 'delta'])
+
+
+##
+# A stand-in for robinhood.Client, serving set quotes and a short price history
+class QuoteClient(object):
+
+    def __init__(self, quotes):
+        self.quotes_by_symbol = dict(quotes)
+        self.history_requests = []
+
+    def reset_cache(self):
+        pass
+
+    def quotes(self, *symbols):
+        return pd.Series([self.quotes_by_symbol[symbol] for symbol in symbols], index=list(symbols))
+
+    def historical_prices(self, *symbols):
+        self.history_requests.append(symbols)
+        dates = [datetime.date(2018, 8, 1), datetime.date(2018, 8, 2)]
+        return pd.DataFrame({symbol: [1.0, 2.0] for symbol in symbols}, index=dates)
+
+
+class TestDaemon(TestCase):
+
+    def setUp(self):
+        self.client = QuoteClient({'AAA': 10.0, 'BBB': 20.0})
+        self.optimised = []
+        self.daemon = daemon.Daemon(self.client, self.optimise, self.plan, lambda plan: 0, threshold=0.01)
+
+    def optimise(self, prices):
+        self.optimised.append(prices)
+        return pd.Series({'AAA': 0.5, 'BBB': 0.5}), ['AAA', 'BBB']
+
+    def plan(self, weights, quotes):
+        return Plan(pd.Series(dtype=float), pd.Series(dtype=float))
+
+    def test_rebalances_only_on_material_moves(self):
+        self.assertTrue(self.daemon.tick().material)
+        self.assertIsNone(self.optimised[-1])
+
+        self.client.quotes_by_symbol['AAA'] = 10.05
+        self.assertFalse(self.daemon.tick().material)
+
+        self.client.quotes_by_symbol['AAA'] = 10.5
+        self.assertTrue(self.daemon.tick().material)
+        self.assertEqual(self.optimised[-1].loc[datetime.date.today(), 'AAA'], 10.5)
+        self.assertEqual(len(self.optimised), 2)
+
+    def test_window_is_downcast_once_over_budget(self):
+        self.daemon.tick()
+        with memory.MemoryTracker(budget=1):
+            self.client.quotes_by_symbol['AAA'] = 11.0
+            self.daemon.tick()
+        self.assertEqual(self.optimised[-1]['AAA'].dtype, np.float32)
+
+    def test_price_window_fetches_history_once(self):
+        window = daemon.PriceWindow(self.client)
+        day = datetime.date(2018, 8, 3)
+        window.update(pd.Series({'AAA': 3.0}), day)
+        prices = window.update(pd.Series({'AAA': 3.5, 'BBB': 4.0}), day)
+
+        self.assertEqual(self.client.history_requests, [('AAA',), ('BBB',)])
+        self.assertEqual(list(prices['AAA']), [1.0, 2.0, 3.5])
+        self.assertEqual(list(prices['BBB']), [1.0, 2.0, 4.0])
+
+
+##
+# A stand-in for markethours.TradingCalendar, with one session for every day and a set next open
+class FixedCalendar(object):
+
+    def __init__(self, session, next_open):
+        self.fixed_session = session
+        self.fixed_next_open = next_open
+
+    def session(self, date=None):
+        return self.fixed_session
+
+    def next_open(self, after=None):
+        return self.fixed_next_open
+
+
+class TestWaitForMarket(TestCase):
+
+    def wait(self, is_open, opens_at, closes_at, next_open):
+        client = QuoteClient({})
+        client.calendar = FixedCalendar(markethours.Session(datetime.date.today(), is_open, opens_at, closes_at),
+                                        next_open)
+        with mock.patch('time.sleep') as sleep:
+            daemon.Daemon(client, None, None, None, interval=30.0)._wait_for_market()
+        return [call[0][0] for call in sleep.call_args_list]
+
+    def test_does_not_wait_during_a_session(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(self.wait(True, now - hour, now + hour, None), [])
+
+    def test_sleeps_until_the_next_open(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        hour = datetime.timedelta(hours=1)
+        slept = self.wait(True, now - 2 * hour, now - hour, now + hour)
+        self.assertEqual(len(slept), 1)
+        self.assertAlmostEqual(slept[0], 3600.0, delta=60.0)
+
+    def test_open_session_without_hours_falls_back_to_the_next_open(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        slept = self.wait(True, None, None, now + datetime.timedelta(hours=1))
+        self.assertAlmostEqual(slept[0], 3600.0, delta=60.0)
+
+    def test_sleeps_an_interval_without_a_known_open(self):
+        self.assertEqual(self.wait(False, None, None, None), [30.0])
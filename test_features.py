@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+import features
+
+
+##
+# The column-by-column rolling features for one lookback, as parse_yahoo used to build them with pandas
+def rolling_features(changes, lookback):
+    shifted = changes.shift(lookback - 1)
+    columns = {'%s%i' % (measure, lookback): shifted[column]
+               for measure, column in zip(features.MEASURES, features.SOURCE_COLUMNS)}
+    for period in features.PERIODS:
+        for column in list(columns)[:len(features.MEASURES)]:
+            rolling = columns[column].rolling(window=period)
+            columns['SMA%i_%s' % (period, column)] = rolling.mean()
+            columns['MAX%i_%s' % (period, column)] = rolling.max()
+            columns['MIN%i_%s' % (period, column)] = rolling.min()
+            columns['STD%i_%s' % (period, column)] = rolling.std()
+    return pd.DataFrame(columns)
+
+
+class TestFeatures(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        prices = pd.DataFrame(np.cumprod(1.0 + rng.normal(0.0, 0.02, (80, 6)), axis=0) * 50.0,
+                              columns=features.SOURCE_COLUMNS)
+        self.changes = prices.pct_change()
+
+    def test_features_match_pandas_rolling(self):
+        block = features.feature_block(self.changes.values)
+        rows = np.arange(features.LOOKBACK + max(features.PERIODS) - 1, len(self.changes))
+        gathered = pd.DataFrame(features.gather(block, rows), columns=features.feature_names())
+
+        for lookback in (1, 2, 7, features.LOOKBACK):
+            expected = rolling_features(self.changes, lookback).iloc[rows]
+            np.testing.assert_allclose(gathered[list(expected.columns)].values, expected.values, rtol=1e-9,
+                                       err_msg='lookback {}'.format(lookback))
+
+    def test_early_rows_are_missing(self):
+        block = features.feature_block(self.changes.values)
+        self.assertTrue(np.isnan(block[max(features.PERIODS) - 1]).any())
+        self.assertFalse(np.isnan(block[max(features.PERIODS)]).any())
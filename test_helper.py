@@ -1,4 +1,7 @@
 from unittest import TestCase
+import numpy as np
+import pandas as pd
+
 import helper
 
 class TestHelper(TestCase):
@@ -12,3 +15,90 @@ class TestHelper(TestCase):
         # Test false statements
         for value in { 'no', 'n', 'N', 'NO', 'false', False, 'FALSE', 'off', 'Off', 'OFF', '0', 0 }:
             self.assertFalse(helper.truthy(value))
+
+    def test_allocate_shares_stays_within_capital(self):
+        weights = pd.Series({'AAA': 0.5, 'BBB': 0.3, 'CCC': 0.2})
+        quotes = pd.Series({'AAA': 33.0, 'BBB': 17.0, 'CCC': 9.5})
+        allocation = helper.allocate_shares(weights, quotes, 1000.0)
+
+        spent = (allocation.shares * quotes).sum()
+        self.assertLessEqual(spent, 1000.0)
+        self.assertAlmostEqual(allocation.cash, 1000.0 - spent)
+        self.assertTrue((allocation.shares == allocation.shares.round()).all())
+
+        # Nothing left over should be enough to buy another share of any symbol
+        self.assertLess(allocation.cash, quotes.min())
+
+    def test_allocate_shares_respects_max_weight(self):
+        weights = pd.Series({'AAA': 0.9, 'BBB': 0.1})
+        quotes = pd.Series({'AAA': 10.0, 'BBB': 10.0})
+        allocation = helper.allocate_shares(weights, quotes, 1000.0, max_weight=0.5)
+
+        self.assertEqual(allocation.shares['AAA'], 50.0)
+        self.assertEqual(allocation.shares['BBB'], 10.0)
+
+    def test_allocate_shares_keeps_unquoted_symbols(self):
+        weights = pd.Series({'AAA': 0.5, 'BBB': 0.5})
+        quotes = pd.Series({'AAA': 10.0})
+        allocation = helper.allocate_shares(weights, quotes, 1000.0)
+
+        self.assertEqual(list(allocation.shares.index), ['AAA', 'BBB'])
+        self.assertEqual(allocation.shares['BBB'], 0.0)
+        self.assertEqual(allocation.shares['AAA'], 50.0)
+        self.assertGreater(allocation.tracking_error, 0.0)
+
+    def test_allocate_shares_scales_weights_over_one(self):
+        weights = pd.Series({'AAA': 0.8, 'BBB': 0.8})
+        quotes = pd.Series({'AAA': 10.0, 'BBB': 7.0})
+        allocation = helper.allocate_shares(weights, quotes, 1000.0)
+
+        self.assertLessEqual((allocation.shares * quotes).sum(), 1000.0)
+        self.assertGreaterEqual(allocation.cash, 0.0)
+        self.assertEqual(allocation.shares['AAA'], 50.0)
+
+    def test_allocate_shares_without_capital(self):
+        weights = pd.Series({'AAA': 1.0})
+        quotes = pd.Series({'AAA': 10.0})
+        allocation = helper.allocate_shares(weights, quotes, 0.0)
+
+        self.assertEqual(allocation.shares['AAA'], 0.0)
+        self.assertEqual(allocation.cash, 0.0)
+
+    def test_factor_tangency_portfolio_matches_dense(self):
+        rng = np.random.RandomState(0)
+        returns = pd.DataFrame(rng.normal(0.001, 0.01, (21, 30)) + rng.normal(0.0, 0.01, (21, 1)))
+        expected_returns = returns.mean() + 0.002
+        covariance = helper.factor_covariance(returns, 3)
+
+        for allow_short in (False, True):
+            weights = helper.factor_tangency_portfolio(covariance, expected_returns, allow_short)
+            dense = helper.tangency_portfolio(covariance.to_frame(), expected_returns, allow_short)
+            self.assertAlmostEqual(weights.sum(), 1.0)
+            self.assertLess((weights - dense).abs().max(), 1e-6)
+
+    def test_solve_tangency_warm_start_matches_cold(self):
+        rng = np.random.RandomState(1)
+        prices = pd.DataFrame(np.cumprod(1.0 + rng.normal(0.002, 0.02, (30, 6)), axis=0), columns=list('ABCDEF'))
+
+        solutions = []
+        for window in (prices, prices.iloc[1:]):
+            expected_returns = window.iloc[-1] / window.iloc[0] - 1
+            covariance = window.pct_change().cov()
+            cold = helper.solve_tangency(covariance, expected_returns)
+            warm = helper.solve_tangency(covariance, expected_returns, start=solutions[-1] if solutions else cold)
+            solutions.append(warm)
+
+            self.assertEqual(warm.method, helper.ACTIVE_SET)
+            self.assertAlmostEqual(warm.weights.sum(), 1.0)
+            self.assertLess((warm.weights - cold.weights).abs().max(), 1e-3)
+            self.assertLess(warm.iterations, cold.iterations)
+
+    def test_solve_tangency_without_variance_holds_cash(self):
+        covariance = pd.DataFrame(np.zeros((2, 2)), index=list('AB'), columns=list('AB'))
+        expected_returns = pd.Series({'A': 0.01, 'B': 0.0})
+        start = helper.solve_tangency(pd.DataFrame(np.identity(2), index=list('AB'), columns=list('AB')),
+                                      expected_returns + 0.01)
+
+        for solve_start in (None, start):
+            with self.assertRaises(ValueError):
+                helper.solve_tangency(covariance, expected_returns, start=solve_start)
@@ -0,0 +1,126 @@
+import datetime
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+import markethours
+
+
+##
+# A stand-in for robinhood.Market, open on weekdays from 13:30 to 20:00 UTC
+class WeekdayMarket(object):
+
+    class Hours(object):
+        def __init__(self, results):
+            self.results = results
+
+    def __init__(self):
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def hours(self, date):
+        with self.lock:
+            self.requests += 1
+        is_open = date.weekday() < 5
+        return self.Hours({
+            'date': date.isoformat(),
+            'is_open': is_open,
+            'opens_at': '{}T13:30:00Z'.format(date.isoformat()) if is_open else None,
+            'closes_at': '{}T20:00:00Z'.format(date.isoformat()) if is_open else None
+        })
+
+
+class TestTradingCalendar(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'hours.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_answers_from_a_loaded_year(self):
+        market = WeekdayMarket()
+        calendar = markethours.TradingCalendar(market, path=self.path)
+        calendar.refresh(2018, background=False)
+        self.assertEqual(market.requests, 365)
+
+        self.assertTrue(calendar.is_open(datetime.date(2018, 8, 3)))
+        self.assertFalse(calendar.is_open(datetime.date(2018, 8, 4)))
+
+        friday_evening = datetime.datetime(2018, 8, 3, 21, 0, tzinfo=datetime.timezone.utc)
+        self.assertEqual(calendar.next_open(friday_evening),
+                         datetime.datetime(2018, 8, 6, 13, 30, tzinfo=datetime.timezone.utc))
+        self.assertEqual(calendar.next_close(friday_evening),
+                         datetime.datetime(2018, 8, 6, 20, 0, tzinfo=datetime.timezone.utc))
+        self.assertEqual(market.requests, 365)
+
+    def test_reloads_from_file(self):
+        markethours.TradingCalendar(WeekdayMarket(), path=self.path).refresh(2018, background=False)
+
+        market = WeekdayMarket()
+        calendar = markethours.TradingCalendar(market, path=self.path)
+        self.assertTrue(calendar.is_open(datetime.date(2018, 12, 31)))
+        self.assertEqual(market.requests, 0)
+
+    def test_only_needed_days_are_fetched(self):
+        market = WeekdayMarket()
+        calendar = markethours.TradingCalendar(market, path=self.path)
+
+        self.assertTrue(calendar.is_open(datetime.date(2018, 8, 3)))
+        self.assertEqual(market.requests, 1)
+
+        friday_evening = datetime.datetime(2018, 8, 3, 21, 0, tzinfo=datetime.timezone.utc)
+        self.assertEqual(calendar.next_open(friday_evening),
+                         datetime.datetime(2018, 8, 6, 13, 30, tzinfo=datetime.timezone.utc))
+        self.assertEqual(market.requests, 4)
+        self.assertIsNone(calendar._refreshing)
+
+        # Days are kept between runs
+        market = WeekdayMarket()
+        calendar = markethours.TradingCalendar(market, path=self.path)
+        self.assertEqual(calendar.next_close(friday_evening),
+                         datetime.datetime(2018, 8, 6, 20, 0, tzinfo=datetime.timezone.utc))
+        self.assertEqual(market.requests, 0)
+
+    def test_a_walk_is_saved_once(self):
+        calendar = markethours.TradingCalendar(WeekdayMarket(), path=self.path)
+        with mock.patch.object(calendar, '_save', wraps=calendar._save) as save:
+            calendar.next_open(datetime.datetime(2018, 8, 3, 21, 0, tzinfo=datetime.timezone.utc))
+            calendar.next_open(datetime.datetime(2018, 8, 3, 21, 0, tzinfo=datetime.timezone.utc))
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(len(calendar.sessions), 4)
+
+    def test_kept_only_in_memory_by_default(self):
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory.name)
+        calendar = markethours.TradingCalendar(WeekdayMarket())
+        calendar.is_open(datetime.date(2018, 8, 3))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_days_are_the_markets_own(self):
+        market = WeekdayMarket()
+        calendar = markethours.TradingCalendar(market)
+
+        # Early on Saturday in UTC is still Friday evening in New York
+        self.assertTrue(calendar.is_open(datetime.datetime(2018, 8, 4, 1, 0, tzinfo=datetime.timezone.utc)))
+        self.assertEqual(list(calendar.sessions), [datetime.date(2018, 8, 3)])
+        self.assertEqual(markethours._day(datetime.datetime(2018, 8, 4, 1, 0), calendar.timezone),
+                         datetime.date(2018, 8, 4))
+
+    def test_next_open_gives_up_beyond_the_lookahead(self):
+        market = WeekdayMarket()
+        market.hours = lambda date: WeekdayMarket.Hours({'is_open': False, 'opens_at': None, 'closes_at': None})
+        calendar = markethours.TradingCalendar(market, path=None)
+        self.assertIsNone(calendar.next_open(datetime.datetime(2018, 8, 3, tzinfo=datetime.timezone.utc)))
+        self.assertEqual(len(calendar.sessions), calendar.LOOKAHEAD_DAYS + 1)
+
+    def test_unknown_day_is_fetched_then_year_filled_in_background(self):
+        market = WeekdayMarket()
+        calendar = markethours.TradingCalendar(market, path=None, prefetch=True)
+
+        self.assertTrue(calendar.is_open(datetime.date(2019, 3, 1)))
+        calendar._refreshing.join()
+        self.assertEqual(len(calendar.sessions), 365)
+        self.assertIn(2019, calendar.fetched)
@@ -0,0 +1,49 @@
+import tracemalloc
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+import memory
+
+
+class TestMemoryTracker(TestCase):
+
+    def test_traces_stage_allocations(self):
+        with memory.MemoryTracker(trace=True) as tracker:
+            with tracker.stage('allocate'):
+                block = np.ones(1000000)
+            with tracker.stage('idle'):
+                pass
+
+        allocate, idle = tracker.stages
+        self.assertGreaterEqual(allocate.allocated, block.nbytes)
+        self.assertGreaterEqual(allocate.peak, allocate.allocated)
+        self.assertLess(idle.peak, block.nbytes)
+        self.assertEqual([stage['name'] for stage in tracker.report()], ['allocate', 'idle'])
+
+    def test_traces_stages_without_reset_peak(self):
+        reset_peak = getattr(tracemalloc, 'reset_peak', None)
+        if reset_peak:
+            del tracemalloc.reset_peak
+        try:
+            self.test_traces_stage_allocations()
+        finally:
+            if reset_peak:
+                tracemalloc.reset_peak = reset_peak
+
+    def test_sheds_and_downcasts_over_budget(self):
+        prices = pd.DataFrame({'AAA': [1.0, 2.0]})
+        shed = []
+
+        with memory.MemoryTracker(budget=1) as tracker:
+            tracker.on_pressure(lambda: shed.append(True) or 0)
+            self.assertEqual(memory.downcast(prices)['AAA'].dtype, np.float64)
+
+            with tracker.stage('over'):
+                pass
+            self.assertEqual(shed, [True])
+            self.assertEqual(memory.downcast(prices)['AAA'].dtype, np.float32)
+
+        self.assertIsNone(memory.active())
+        self.assertEqual(memory.downcast(prices)['AAA'].dtype, np.float64)
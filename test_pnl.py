@@ -0,0 +1,44 @@
+from unittest import TestCase
+import pandas as pd
+
+import pnl
+
+
+class TestFifoPnl(TestCase):
+
+    def fills(self, *rows):
+        return pd.DataFrame(list(rows), columns=['timestamp', 'symbol', 'side', 'quantity', 'price']).assign(
+            timestamp=lambda df: pd.to_datetime(df['timestamp'], utc=True))
+
+    def test_sells_match_oldest_lots_first(self):
+        result = pnl.fifo_pnl(self.fills(
+            ('2020-01-01T10:00', 'AAA', 'buy', 10.0, 1.0),
+            ('2020-01-01T11:00', 'AAA', 'buy', 5.0, 2.0),
+            ('2020-01-02T10:00', 'AAA', 'sell', 12.0, 3.0)
+        ))
+
+        self.assertAlmostEqual(result.fills['cost'].iloc[2], 14.0)
+        self.assertAlmostEqual(result.by_symbol.loc['AAA', 'realised'], 22.0)
+        self.assertAlmostEqual(result.by_symbol.loc['AAA', 'open_quantity'], 3.0)
+        self.assertAlmostEqual(result.by_symbol.loc['AAA', 'open_cost'], 6.0)
+
+    def test_sells_do_not_borrow_from_later_buys(self):
+        result = pnl.fifo_pnl(self.fills(
+            ('2020-01-01T10:00', 'AAA', 'sell', 3.0, 10.0),
+            ('2020-01-02T10:00', 'AAA', 'buy', 2.0, 10.0)
+        ), marks=pd.Series({'AAA': 12.0}))
+
+        self.assertEqual(result.fills['matched'].iloc[0], 0.0)
+        self.assertAlmostEqual(result.by_symbol.loc['AAA', 'open_quantity'], 2.0)
+        self.assertAlmostEqual(result.by_symbol.loc['AAA', 'unrealised'], 4.0)
+
+    def test_daily_unrealised(self):
+        marks = pd.DataFrame({'AAA': [1.5, 2.5]}, index=pd.to_datetime(['2020-01-01', '2020-01-02']))
+        result = pnl.fifo_pnl(self.fills(
+            ('2020-01-01T10:00', 'AAA', 'buy', 10.0, 1.0),
+            ('2020-01-02T10:00', 'AAA', 'sell', 4.0, 3.0)
+        ), marks=marks)
+
+        self.assertAlmostEqual(result.by_day.loc[(pd.Timestamp('2020-01-01'), 'AAA'), 'unrealised'], 5.0)
+        self.assertAlmostEqual(result.by_day.loc[(pd.Timestamp('2020-01-02'), 'AAA'), 'unrealised'], 9.0)
+        self.assertAlmostEqual(result.by_day.loc[(pd.Timestamp('2020-01-02'), 'AAA'), 'realised'], 8.0)
@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+import pandas as pd
+
+import rebalance
+
+
+class TestRebalancePolicy(TestCase):
+
+    def setUp(self):
+        self.quotes = pd.Series({'AAA': 10.0, 'BBB': 100.0, 'CCC': 5.0})
+        self.current = pd.Series({'AAA': 10.0, 'CCC': 3.0})
+
+    def test_orders_below_the_fraction_of_capital_are_dropped(self):
+        policy = rebalance.RebalancePolicy(min_fraction=0.005)
+        delta = pd.Series({'AAA': 4.0, 'BBB': 1.0})
+
+        # 0.5% of 10,000 is 50: 4 AAA is worth 40, 1 BBB is worth 100
+        result = policy.apply(delta, self.current, self.quotes, 10000.0)
+        self.assertEqual(list(result.index), ['BBB'])
+
+    def test_orders_below_the_value_are_dropped(self):
+        policy = rebalance.RebalancePolicy(min_value=50.0)
+        result = policy.apply(pd.Series({'AAA': 6.0, 'BBB': -0.0}), self.current, self.quotes, 10000.0)
+        self.assertEqual(dict(result), {'AAA': 6.0})
+
+    def test_exits_are_kept_whatever_their_size(self):
+        policy = rebalance.RebalancePolicy(min_fraction=0.005)
+        result = policy.apply(pd.Series({'CCC': -3.0}), self.current, self.quotes, 10000.0)
+        self.assertEqual(dict(result), {'CCC': -3.0})
+
+        policy = rebalance.RebalancePolicy(min_fraction=0.005, keep_exits=False)
+        self.assertTrue(policy.apply(pd.Series({'CCC': -3.0}), self.current, self.quotes, 10000.0).empty)
+
+    def test_unpriced_orders_are_dropped(self):
+        policy = rebalance.RebalancePolicy()
+        result = policy.apply(pd.Series({'DDD': 5.0}), self.current, self.quotes, 10000.0)
+        self.assertTrue(result.empty)
+
+    def test_turnover_penalty_shrinks_towards_the_current_holding(self):
+        # 1% of 10,000 is 100: 10 shares of AAA, 1 share of BBB
+        policy = rebalance.RebalancePolicy(turnover_penalty=0.01)
+        result = policy.apply(pd.Series({'AAA': 25.0, 'BBB': 1.5}), self.current, self.quotes, 10000.0)
+        self.assertEqual(dict(result), {'AAA': 15.0})
+
+        # Exits are kept whole
+        result = policy.apply(pd.Series({'CCC': -3.0}), self.current, self.quotes, 10000.0)
+        self.assertEqual(dict(result), {'CCC': -3.0})
+
+    def test_buys_spend_no_more_than_the_remaining_sells(self):
+        quotes = pd.Series({'AAA': 10.0, 'DDD': 10.0, 'EEE': 1.0})
+        current = pd.Series({'AAA': 20.0, 'DDD': 20.0})
+
+        # Two sells of 150 pay for a buy of 300; the penalty of 100 each leaves 100 of sells for 200 of buys
+        policy = rebalance.RebalancePolicy(turnover_penalty=0.1)
+        result = policy.apply(pd.Series({'AAA': -15.0, 'DDD': -15.0, 'EEE': 300.0}), current, quotes, 1000.0)
+        self.assertEqual(dict(result), {'AAA': -5.0, 'DDD': -5.0, 'EEE': 100.0})
+
+        buys = (result[result > 0] * quotes).sum()
+        sells = -(result[result < 0] * quotes).sum()
+        self.assertLessEqual(buys, sells)
+
+    def test_planned_net_spend_is_still_allowed(self):
+        policy = rebalance.RebalancePolicy(min_value=50.0)
+        result = policy.apply(pd.Series({'AAA': 30.0, 'CCC': -3.0}), self.current, self.quotes, 10000.0)
+        self.assertEqual(dict(result), {'AAA': 30.0, 'CCC': -3.0})
+
+        # A small sell below the threshold is held back, so the buy shrinks by its proceeds
+        policy = rebalance.RebalancePolicy(min_value=50.0, keep_exits=False)
+        result = policy.apply(pd.Series({'AAA': 30.0, 'CCC': -3.0}), self.current, self.quotes, 10000.0)
+        self.assertEqual(dict(result), {'AAA': 28.0})
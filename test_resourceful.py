@@ -0,0 +1,122 @@
+import json
+import urllib.parse
+from unittest import TestCase
+
+import resourceful
+import simpleapi
+
+
+##
+# A stand-in API serving instruments by symbol, counting requests
+class InstrumentAPI(object):
+
+    class Response(object):
+        def __init__(self, payload):
+            self.status_code = 200
+            self.content = json.dumps(payload).encode('utf-8')
+
+        def json(self):
+            return json.loads(self.content)
+
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        self.requests = []
+
+    def build_full_uri(self, uri, params=None):
+        return uri + '?' + urllib.parse.urlencode(sorted((params or {}).items()))
+
+    def get(self, uri, params=None):
+        self.requests.append((uri, params))
+        items = [{'id': s.lower(), 'symbol': s, 'name': s.title(), 'tradeable': 1} for s in self.symbols]
+        if uri != '/instruments/':
+            return self.Response([item for item in items if uri == '/instruments/{}/'.format(item['id'])][0])
+        symbol = (params or {}).get('symbol')
+        return self.Response({'results': [i for i in items if symbol in (None, i['symbol'])], 'next': None})
+
+    def post(self, uri, data=None):
+        self.symbols.append(data['symbol'])
+        return self.Response({})
+
+
+class Instrument(resourceful.Instance):
+    ID_FIELD = 'id'
+
+
+class TradeableInstrument(resourceful.Instance):
+    ID_FIELD = 'id'
+    FIELDS = (('id', str), ('symbol', str), ('tradeable', bool))
+
+
+class Instruments(resourceful.Collection):
+    ENDPOINT = 'instruments/'
+    INSTANCE_CLASS = Instrument
+
+
+class TestCollection(TestCase):
+
+    def setUp(self):
+        self.api = InstrumentAPI(['AAPL', 'MSFT'])
+        self.instruments = Instruments(simpleapi.MemoryCacheAPI(self.api), root=True)
+
+    def test_lists_are_cached_by_query(self):
+        self.assertEqual(self.instruments.find_by(symbol='AAPL')['symbol'], 'AAPL')
+        self.assertEqual(self.instruments.find_by(symbol='MSFT')['symbol'], 'MSFT')
+        self.instruments.find_by(symbol='AAPL')
+        self.assertEqual(len(self.api.requests), 2)
+
+    def test_empty_results_expire(self):
+        self.assertIsNone(self.instruments.find_by(symbol='TSLA'))
+        self.assertIsNone(self.instruments.find_by(symbol='TSLA'))
+        self.assertEqual(len(self.api.requests), 1)
+
+        # The expired result is dropped from the response cache below as well, so it is fetched again
+        self.instruments.EMPTY_TTL = 0.0
+        self.instruments.find_by(symbol='TSLA')
+        self.assertEqual(len(self.api.requests), 2)
+
+    def test_results_do_not_expire(self):
+        self.instruments.EMPTY_TTL = 0.0
+        self.instruments.find_by(symbol='AAPL')
+        self.instruments.find_by(symbol='AAPL')
+        self.assertEqual(len(self.api.requests), 1)
+
+    def test_writes_invalidate(self):
+        self.assertIsNone(self.instruments.find_by(symbol='TSLA'))
+        self.instruments.post(None, data={'symbol': 'TSLA'})
+        self.assertEqual(self.instruments.find_by(symbol='TSLA')['symbol'], 'TSLA')
+
+
+class TestRecord(TestCase):
+
+    def setUp(self):
+        self.api = InstrumentAPI(['AAPL', 'MSFT'])
+        self.instruments = Instruments(self.api, root=True)
+        self.instruments.INSTANCE_CLASS = TradeableInstrument
+
+    def test_record_classes_are_built_once_per_instance_class(self):
+        record_class = resourceful.Record.for_class(TradeableInstrument)
+        self.assertIs(resourceful.Record.for_class(TradeableInstrument), record_class)
+        self.assertEqual(record_class.__slots__, ('id', 'symbol', 'tradeable'))
+        self.assertIs(record_class.INSTANCE_CLASS, TradeableInstrument)
+
+        with self.assertRaises(ValueError):
+            resourceful.Record.for_class(Instrument)
+
+    def test_records_hold_only_declared_fields(self):
+        record = self.instruments.records()[0]
+        self.assertEqual(record.to_dict(), {'id': 'aapl', 'symbol': 'AAPL', 'tradeable': True})
+        self.assertEqual(record.id, 'aapl')
+        self.assertFalse(hasattr(record, '__dict__'))
+        with self.assertRaises(AttributeError):
+            record.name = 'Apple'
+
+    def test_other_keys_expand_to_the_full_instance(self):
+        record = self.instruments.records()[1]
+        self.assertEqual(record['symbol'], 'MSFT')
+        self.assertEqual(len(self.api.requests), 1)
+
+        self.assertEqual(record['name'], 'Msft')
+        self.assertEqual(self.api.requests[-1], ('/instruments/msft/', None))
+        self.assertIsInstance(record.expand(), TradeableInstrument)
+        record['name']
+        self.assertEqual(len(self.api.requests), 2)
@@ -0,0 +1,109 @@
+import json
+import threading
+from unittest import TestCase
+
+import robinhood
+
+INSTRUMENT_ID = 'aaaaaaaa-1111-2222-3333-444444444444'
+
+
+##
+# A stand-in for the Robinhood API serving one account, its portfolio and its positions
+class AccountAPI(object):
+
+    class Response(object):
+        def __init__(self, payload):
+            self.status_code = 200
+            self.content = json.dumps(payload).encode('utf-8')
+
+        def json(self):
+            return json.loads(self.content)
+
+    ACCOUNT = {'account_number': 'A1', 'margin_balances': {'margin_limit': '100.0'}}
+
+    # The account, portfolio and positions requests; with a barrier, each waits until all have been made
+    SNAPSHOT_URIS = {'accounts/A1/', 'accounts/A1/portfolio/', 'accounts/A1/positions/'}
+
+    def __init__(self, barrier=None):
+        self.requests = []
+        self.threads = set()
+        self.lock = threading.Lock()
+        self.barrier = barrier
+
+    def get(self, uri, params=None):
+        with self.lock:
+            self.requests.append((uri, params))
+            self.threads.add(threading.get_ident())
+        if self.barrier and uri in self.SNAPSHOT_URIS:
+            self.barrier.wait()
+
+        if uri == 'accounts/':
+            return self.Response({'results': [self.ACCOUNT], 'next': None})
+        if uri == 'accounts/A1/':
+            return self.Response(self.ACCOUNT)
+        if uri == 'accounts/A1/portfolio/':
+            return self.Response({'equity': '1234.5'})
+        if uri == 'accounts/A1/positions/':
+            return self.Response({'results': [
+                {'id': '1', 'instrument': 'https://api.robinhood.com/instruments/{}/'.format(INSTRUMENT_ID),
+                 'quantity': '3.0'},
+                {'id': '2', 'instrument': 'https://api.robinhood.com/instruments/closed/', 'quantity': '0.0'}
+            ], 'next': None})
+        if uri == '/instruments/':
+            return self.Response({'results': [{'id': INSTRUMENT_ID, 'symbol': 'AAA'}]})
+        raise KeyError(uri)
+
+
+class TestSnapshot(TestCase):
+
+    def client(self, account_id=None, barrier=None):
+        client = robinhood.Client(account_id=account_id, calendar=None)
+        client.api = AccountAPI(barrier)
+        return client
+
+    def test_snapshot_of_the_default_account(self):
+        client = self.client()
+        snapshot = client.snapshot()
+
+        self.assertEqual(snapshot.account_id, 'A1')
+        self.assertEqual(snapshot.equity, 1234.5)
+        self.assertEqual(snapshot.margin, 100.0)
+        self.assertEqual(dict(snapshot.positions), {'AAA': 3.0})
+        self.assertIsNotNone(snapshot.taken_at.tzinfo)
+
+        # One request each, with the portfolio and positions fetched off the calling thread
+        uris = sorted(uri for uri, params in client.api.requests)
+        self.assertEqual(uris, ['/instruments/', 'accounts/', 'accounts/A1/portfolio/', 'accounts/A1/positions/'])
+        self.assertGreater(len(client.api.threads), 1)
+
+    def test_snapshot_of_a_given_account(self):
+        # The account, portfolio and positions are all in flight at once, or the barrier times out
+        client = self.client('A1', threading.Barrier(3, timeout=5.0))
+        snapshot = client.snapshot()
+
+        self.assertEqual((snapshot.account_id, snapshot.equity, snapshot.margin), ('A1', 1234.5, 100.0))
+        self.assertIn(('accounts/A1/', None), client.api.requests)
+        self.assertNotIn(('accounts/', None), client.api.requests)
+
+    def test_snapshot_is_immutable(self):
+        snapshot = self.client().snapshot()
+        with self.assertRaises(AttributeError):
+            snapshot.equity = 0.0
+        with self.assertRaises(TypeError):
+            snapshot.positions['AAA'] = 0.0
+
+
+class TestCollections(TestCase):
+
+    def test_collections_are_kept_for_the_life_of_the_client(self):
+        client = robinhood.Client(calendar=None)
+        self.assertIs(client.orders, client.orders)
+        self.assertIs(client.watchlists, client.watchlists)
+        self.assertIs(client.instrument_collection, client.instrument_collection)
+        self.assertIs(client.watchlist().instrument_collection, client.instrument_collection)
+
+    def test_reset_cache_clears_cached_lists(self):
+        client = robinhood.Client(calendar=None)
+        client.orders._lists['key'] = ([1], 0.0)
+        client.reset_cache()
+        self.assertEqual(client.orders._lists, {})
@@ -0,0 +1,317 @@
+from unittest import TestCase
+import concurrent.futures
+import http.server
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from urllib3.util.retry import RequestHistory
+
+import simpleapi
+
+
+class TestSingleFlight(TestCase):
+
+    def test_concurrent_calls_share_one_execution(self):
+        flights = simpleapi.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            leader = executor.submit(flights.do, 'key', slow)
+            started.wait(5)
+            followers = [executor.submit(flights.do, 'key', slow) for _ in range(3)]
+            time.sleep(0.1)
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights._calls, {})
+
+    def test_errors_are_raised_and_not_remembered(self):
+        flights = simpleapi.SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flights.do('key', fail)
+        self.assertEqual(flights.do('key', lambda: 'ok'), 'ok')
+
+
+class TestTokenBucket(TestCase):
+
+    def test_callers_beyond_capacity_wait_their_turn(self):
+        bucket = simpleapi.TokenBucket(rate=10.0, capacity=2)
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.1, places=2)
+        self.assertAlmostEqual(waits[3], 0.2, places=2)
+
+    def test_throttling_halves_rate_and_honours_retry_after(self):
+        bucket = simpleapi.TokenBucket(rate=10.0, capacity=5)
+        bucket.throttled(retry_after=2.0)
+        self.assertEqual(bucket.rate, 5.0)
+        self.assertGreaterEqual(bucket.reserve(), 2.0)
+
+        for _ in range(100):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 10.0)
+
+
+class TestRateLimitAPI(TestCase):
+
+    class Response(object):
+        def __init__(self, status_code, headers={}):
+            self.status_code = status_code
+            self.headers = headers
+
+    class StubAPI(object):
+        def __init__(self, responses):
+            self.responses = list(responses)
+            self.calls = []
+
+        def relative_uri(self, uri):
+            return 'https://example.com/' + uri
+
+        def get(self, uri, *args, **kwargs):
+            self.calls.append(uri)
+            return self.responses.pop(0)
+
+        post = get
+
+    def test_throttled_requests_are_retried_after_slowing(self):
+        stub = self.StubAPI([self.Response(429, {'Retry-After': '0'}), self.Response(200)])
+        bucket = simpleapi.TokenBucket(rate=100.0, capacity=10)
+        api = simpleapi.RateLimitAPI(stub, {'default': bucket})
+
+        self.assertEqual(api.get('quotes/').status_code, 200)
+        self.assertEqual(stub.calls, ['quotes/', 'quotes/'])
+        self.assertLess(bucket.rate, 100.0)
+
+    def test_throttled_posts_are_not_retried(self):
+        stub = self.StubAPI([self.Response(429, {'Retry-After': '0'}), self.Response(200)])
+        bucket = simpleapi.TokenBucket(rate=100.0, capacity=10)
+        api = simpleapi.RateLimitAPI(stub, {'default': bucket})
+
+        self.assertEqual(api.post('orders/').status_code, 429)
+        self.assertEqual(stub.calls, ['orders/'])
+        self.assertLess(bucket.rate, 100.0)
+
+    def test_requests_use_their_endpoint_class(self):
+        buckets = {'orders': simpleapi.TokenBucket(1.0), 'default': simpleapi.TokenBucket(1.0)}
+        api = simpleapi.RateLimitAPI(self.StubAPI([]), buckets,
+                                     classify=lambda method, uri: 'orders' if '/orders/' in uri else 'other')
+        self.assertIs(api.bucket_for('post', 'orders/'), buckets['orders'])
+        self.assertIs(api.bucket_for('get', 'quotes/'), buckets['default'])
+
+
+class TestParsedResponse(TestCase):
+
+    class Response(object):
+        def __init__(self, content):
+            self.content = content
+            self.status_code = 200
+            self.reads = 0
+
+        @property
+        def text(self):
+            self.reads += 1
+            return self.content.decode('utf-8')
+
+    def test_body_is_decoded_once(self):
+        response = simpleapi.ParsedResponse(self.Response(b'{"results": [1, 2, 3]}'))
+        self.assertEqual(response.json(), {'results': [1, 2, 3]})
+        self.assertIs(response.json(), response.json())
+        self.assertEqual(response.status_code, 200)
+
+    def test_text_is_decoded_once(self):
+        raw = self.Response(b'{}')
+        response = simpleapi.ParsedResponse(raw)
+        self.assertEqual(response.text, response.text)
+        self.assertEqual(raw.reads, 1)
+
+    def test_invalid_body_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            simpleapi.ParsedResponse(self.Response(b'<html>')).json()
+
+
+class TestMemoryCacheAPI(TestCase):
+
+    class StubAPI(object):
+        def __init__(self):
+            self.gets = 0
+            self.during_get = None
+
+        def build_full_uri(self, uri, params=None):
+            return uri + ('?' + urllib.parse.urlencode(params) if params else '')
+
+        def get(self, uri, *args, **kwargs):
+            self.gets += 1
+            if self.during_get:
+                self.during_get()
+            return 'response {} {}'.format(uri, self.gets)
+
+        def post(self, uri, *args, **kwargs):
+            return 'posted'
+
+        def delete(self, uri, *args, **kwargs):
+            return 'deleted'
+
+    def test_writes_clear_only_related_responses(self):
+        stub = self.StubAPI()
+        api = simpleapi.MemoryCacheAPI(stub)
+        quotes = api.get('quotes/', params={'symbols': 'AAA'})
+        orders = api.get('orders/', params={'page': 2})
+        watchlist = api.get('watchlists/Default/')
+
+        api.post('orders/')
+        self.assertIs(api.get('quotes/', params={'symbols': 'AAA'}), quotes)
+        self.assertNotEqual(api.get('orders/', params={'page': 2}), orders)
+
+        # Writes below a collection clear the collection too
+        api.post('watchlists/Default/bulk_add/')
+        self.assertNotEqual(api.get('watchlists/Default/'), watchlist)
+        self.assertIs(api.get('quotes/', params={'symbols': 'AAA'}), quotes)
+        self.assertEqual(stub.gets, 5)
+
+    def test_responses_begun_before_a_write_are_not_kept(self):
+        stub = self.StubAPI()
+        api = simpleapi.MemoryCacheAPI(stub)
+        stub.during_get = lambda: api.delete('positions/1/')
+        first = api.get('positions/')
+        stub.during_get = None
+        self.assertNotEqual(api.get('positions/'), first)
+        self.assertEqual(api.get('positions/'), api.get('positions/'))
+
+    def test_forget_drops_one_response(self):
+        stub = self.StubAPI()
+        api = simpleapi.MemoryCacheAPI(stub)
+        api.get('orders/')
+        positions = api.get('positions/')
+        api.forget('orders/')
+        api.get('orders/')
+        self.assertIs(api.get('positions/'), positions)
+        self.assertEqual(stub.gets, 3)
+
+
+##
+# A local HTTP/1.1 server answering every GET with a small JSON body, so connections are kept alive
+class JSONHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"results": []}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTransport(TestCase):
+
+    def setUp(self):
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), JSONHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_transport_stats_count_reused_connections(self):
+        api = simpleapi.API(self.endpoint, pool_size=2)
+        self.assertEqual(api.transport_stats(), {'requests': 0, 'connections': 0, 'reused': 0})
+        for _ in range(3):
+            self.assertEqual(api.get('quotes/').json(), {'results': []})
+        self.assertEqual(api.transport_stats(), {'requests': 3, 'connections': 1, 'reused': 2})
+
+    def test_jittered_backoff_stays_within_the_exponential_bound(self):
+        retry = simpleapi.pooled_adapter(retries=5, backoff=0.5).max_retries
+        self.assertIsInstance(retry, simpleapi.JitteredRetry)
+        self.assertEqual(retry.get_backoff_time(), 0)
+
+        failure = RequestHistory('GET', '/', None, 503, None)
+        retry = retry.new(history=(failure,) * 3)
+        backoffs = [retry.get_backoff_time() for _ in range(200)]
+        self.assertTrue(all(0.0 <= backoff <= 2.0 for backoff in backoffs))
+        self.assertGreater(len(set(backoffs)), 1)
+
+    def test_throttling_is_left_to_the_rate_limiter(self):
+        retry = simpleapi.pooled_adapter().max_retries
+        self.assertFalse(retry.is_retry('GET', 429))
+        self.assertTrue(retry.is_retry('GET', 503))
+        self.assertFalse(retry.is_retry('POST', 503))
+
+
+class TestCassetteAPI(TestCase):
+
+    class Response(object):
+        def __init__(self, content):
+            self.url = 'https://example.com/'
+            self.status_code = 200
+            self.headers = {'Content-Type': 'application/json', 'Set-Cookie': 'secret'}
+            self.text = content
+
+    class StubAPI(object):
+        def __init__(self):
+            self.requests = 0
+
+        def build_full_uri(self, uri, params=None):
+            query = urllib.parse.urlencode(sorted(params.items())) if params else ''
+            return 'https://example.com/' + uri + ('?' + query if query else '')
+
+        def get(self, uri, *args, **kwargs):
+            self.requests += 1
+            return TestCassetteAPI.Response('{{"request": {}}}'.format(self.requests))
+
+        def post(self, uri, *args, **kwargs):
+            return TestCassetteAPI.Response('{"access_token": "abc", "expires_in": 86400}')
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_recordings_replay_in_order(self):
+        recorder = simpleapi.CassetteAPI(self.StubAPI(), self.path, mode=simpleapi.CassetteAPI.RECORD)
+        recorder.get('quotes/', params={'symbols': 'AAA'})
+        recorder.get('quotes/', params={'symbols': 'AAA'})
+        recorder.post('oauth2/token/', data={'username': 'me', 'password': 'hunter2'})
+
+        player = simpleapi.CassetteAPI(self.StubAPI(), self.path)
+        self.assertEqual(player.get('quotes/', params={'symbols': 'AAA'}).json(), {'request': 1})
+        self.assertEqual(player.get('quotes/', params={'symbols': 'AAA'}).json(), {'request': 2})
+        self.assertEqual(player.get('quotes/', params={'symbols': 'AAA'}).json(), {'request': 2})
+        self.assertEqual(player.post('oauth2/token/', data={'username': 'me', 'password': 'other'}).json(),
+                         {'access_token': 'redacted', 'expires_in': 86400})
+        with self.assertRaises(KeyError):
+            player.get('quotes/', params={'symbols': 'BBB'})
+
+    def test_credentials_do_not_reach_the_cassette(self):
+        recorder = simpleapi.CassetteAPI(self.StubAPI(), self.path, mode=simpleapi.CassetteAPI.RECORD)
+        with_password = recorder.key_for('POST', 'oauth2/token/', data={'username': 'me', 'password': 'hunter2'})
+        without_password = recorder.key_for('POST', 'oauth2/token/', data={'username': 'me'})
+        self.assertEqual(with_password, without_password)
+
+        recorder.post('oauth2/token/', data={'username': 'me', 'password': 'hunter2'})
+        with open(self.path) as file:
+            recorded = file.read()
+        self.assertNotIn('hunter2', recorded)
+        self.assertNotIn('abc', recorded)
+        self.assertNotIn('Set-Cookie', recorded)
@@ -0,0 +1,94 @@
+import concurrent.futures
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+import algo
+import sweep
+
+
+class TestSweep(TestCase):
+
+    def test_grid_covers_every_combination(self):
+        combinations = list(sweep.grid({'lookback': [15, 21], 'max_in_one': [0.5, 0.75, 1.0]}))
+        self.assertEqual(len(combinations), 6)
+        self.assertIn({'lookback': 21, 'max_in_one': 0.75}, combinations)
+
+    def test_random_search_draws_within_ranges(self):
+        combinations = list(sweep.random_search({'lookback': (10, 30), 'buy_limit': (1.0, 1.1), 'min_lookback': [5, 7]},
+                                                50, random_state=0))
+        self.assertEqual(len(combinations), 50)
+        for combination in combinations:
+            self.assertIsInstance(combination['lookback'], int)
+            self.assertTrue(10 <= combination['lookback'] <= 30)
+            self.assertTrue(1.0 <= combination['buy_limit'] <= 1.1)
+            self.assertIn(combination['min_lookback'], [5, 7])
+
+    def test_utilisation_scales_returns_but_not_sharpe(self):
+        rng = np.random.RandomState(0)
+        prices = pd.DataFrame(np.cumprod(1.0 + rng.normal(0.001, 0.01, (60, 3)), axis=0), columns=list('ABC'))
+        backtest = sweep.Backtest(prices, rebalance_every=10)
+        rows = backtest.rebalance_rows(10)
+        path = np.tile([0.5, 0.3, 0.2], (len(rows), 1))
+
+        combinations = [dict(sweep.DEFAULTS, equity_utilisation=utilisation) for utilisation in (0.5, 1.0)]
+        metrics = backtest.evaluate(path, rows, combinations)
+        self.assertLess(metrics['volatility'][0], metrics['volatility'][1])
+        self.assertAlmostEqual(metrics['sharpe'][0], metrics['sharpe'][1], places=1)
+
+    def test_sweep_streams_every_combination(self):
+        rng = np.random.RandomState(1)
+        prices = pd.DataFrame(np.cumprod(1.0 + rng.normal(0.001, 0.01, (80, 3)), axis=0), columns=list('ABC'))
+        combinations = list(sweep.grid({'lookback': [10, 15], 'min_lookback': [5], 'max_in_one': [0.5, 1.0]}))
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'sweep.csv')
+            results = sweep.sweep(prices, combinations, output=output, workers=0, rebalance_every=10, stages=2)
+            written = pd.read_csv(output)
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(written), 4)
+        self.assertEqual(list(written.columns), list(sweep.DEFAULTS) + sweep.METRICS + ['stage'])
+
+    def test_dominated_needs_a_strictly_better_combination(self):
+        metrics = pd.DataFrame({
+            'sharpe': [1.0, 1.0, 2.0, 0.5],
+            'annual_return': [0.1, 0.1, 0.2, 0.3],
+            'max_drawdown': [-0.1, -0.1, -0.05, -0.2]
+        })
+        self.assertEqual(list(sweep.dominated(metrics)), [True, True, False, False])
+        self.assertEqual(list(sweep.dominated(metrics.iloc[:2])), [False, False])
+        self.assertEqual(list(sweep.dominated(metrics, margin=1.5)), [False, False, False, False])
+
+    def test_weights_path_holds_cash_without_a_positive_sharpe(self):
+        prices = pd.DataFrame({'A': np.linspace(10.0, 12.0, 12), 'B': np.linspace(20.0, 18.0, 12)})
+        backtest = sweep.Backtest(prices)
+        losing = lambda prices, start=None: (pd.Series({'A': 1.0}), -0.5, None)
+        with mock.patch.object(algo.SharpeAlgo, '_calculate_target_weights_inner', side_effect=losing):
+            path = backtest.weights_path(5, 3, backtest.rebalance_rows(5))
+        self.assertFalse(path.any())
+
+    def test_pool_without_initializer_support_still_runs_workers(self):
+        backtest = sweep.Backtest(pd.DataFrame({'A': [1.0, 1.1, 1.2]}))
+        executor = concurrent.futures.ProcessPoolExecutor
+
+        def without_initializer(workers, **kwargs):
+            if kwargs:
+                raise TypeError('unexpected keyword argument')
+            return executor(workers)
+
+        with mock.patch('concurrent.futures.ProcessPoolExecutor', without_initializer), \
+                mock.patch('multiprocessing.get_start_method', return_value='fork'), \
+                mock.patch('sweep._backtest', None):
+            pool = sweep._pool(1, backtest)
+            self.assertIs(sweep._backtest, backtest)
+        self.assertIsInstance(pool, executor)
+        self.assertIsNone(sweep._backtest)
+        pool.shutdown()
+
+        with mock.patch('concurrent.futures.ProcessPoolExecutor', without_initializer), \
+                mock.patch('multiprocessing.get_start_method', return_value='spawn'):
+            self.assertIsInstance(sweep._pool(1, backtest), sweep._InProcess)
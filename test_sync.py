@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import sync
+
+
+##
+# A stand-in for a paginated collection, serving items newest first and honouring updated_at[gte]
+class StubCollection(object):
+    PAGE_SIZE = 2
+
+    def __init__(self, items, fail_on_page=None):
+        self.items = items
+        self.fail_on_page = fail_on_page
+        self.params = []
+
+    def pages(self, params=None):
+        self.params.append(params)
+        since = (params or {}).get('updated_at[gte]', '')
+        items = sorted([item for item in self.items if item['updated_at'] >= since],
+                       key=lambda item: item['updated_at'], reverse=True)
+        for page, start in enumerate(range(0, len(items), self.PAGE_SIZE)):
+            if page == self.fail_on_page:
+                raise IOError('Connection reset')
+            more = start + self.PAGE_SIZE < len(items)
+            yield items[start:start + self.PAGE_SIZE], 'page {}'.format(page + 1) if more else None
+
+
+class StubClient(object):
+
+    def __init__(self, orders, fail_on_page=None):
+        self.orders = StubCollection(orders, fail_on_page)
+
+    def positions(self):
+        return StubCollection([])
+
+    def instruments(self, *urls):
+        return [{'symbol': url.split('/')[-2].upper()} for url in urls]
+
+
+def order(number, day, state='filled'):
+    return {'id': str(number), 'updated_at': '2018-01-{:02d}T00:00:00Z'.format(day), 'state': state, 'side': 'buy',
+            'instrument': 'https://api.robinhood.com/instruments/s{}/'.format(number % 2), 'quantity': '1.0',
+            'price': '10.0'}
+
+
+class TestLocalStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = sync.LocalStore(os.path.join(self.directory, 'algo.db'))
+        self.orders = [order(number, number + 1) for number in range(5)]
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_interrupted_sync_resumes_without_losing_older_orders(self):
+        with self.assertRaises(IOError):
+            self.store.sync(StubClient(self.orders, fail_on_page=1))
+        self.assertEqual(len(self.store.orders()), 2)
+        self.assertIsNone(self.store.watermark('orders'))
+
+        self.assertEqual(self.store.sync(StubClient(self.orders))['orders'], 3)
+        self.assertEqual([o['id'] for o in self.store.orders()], ['0', '1', '2', '3', '4'])
+        self.assertEqual(self.store.watermark('orders'), '2018-01-05T00:00:00Z')
+
+    def test_incremental_sync_only_writes_changes(self):
+        self.store.sync(StubClient(self.orders))
+
+        self.orders[4] = order(4, 7, state='cancelled')
+        self.orders.append(order(5, 6))
+        client = StubClient(self.orders)
+        self.assertEqual(self.store.sync(client)['orders'], 2)
+
+        self.assertEqual(client.orders.params, [{'updated_at[gte]': '2018-01-05T00:00:00Z'}])
+        self.assertEqual(self.store.watermark('orders'), '2018-01-07T00:00:00Z')
+        self.assertEqual([o['id'] for o in self.store.orders(state='cancelled')], ['4'])
+        self.assertEqual(len(self.store.orders(symbol='S1')), 3)
+        self.assertEqual(self.store.sync(StubClient(self.orders))['orders'], 0)
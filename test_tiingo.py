@@ -0,0 +1,72 @@
+from unittest import TestCase
+import datetime
+import http.server
+import json
+import shutil
+import tempfile
+import threading
+import urllib.parse
+
+import tiingo
+
+
+##
+# A local stand-in for the Tiingo prices endpoint, serving one bar per hour of each requested day
+class PricesHandler(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        PricesHandler.requests.append(query)
+        start = datetime.datetime.strptime(query['startDate'][0], '%Y-%m-%d')
+        end = datetime.datetime.strptime(query['endDate'][0], '%Y-%m-%d') + datetime.timedelta(days=1)
+        bars, moment = [], start
+        while moment < end:
+            bars.append({'date': moment.isoformat() + 'Z', 'open': 1.0, 'high': 2.0, 'low': 0.5, 'close': 1.5,
+                         'volume': 10.0})
+            moment += datetime.timedelta(hours=1)
+
+        body = json.dumps([{'ticker': query['tickers'][0], 'priceData': bars}]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestIngest(TestCase):
+
+    def setUp(self):
+        PricesHandler.requests = []
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), PricesHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.source = tiingo.TiingoSource(token='test', endpoint='http://127.0.0.1:{}/'.format(self.server.server_port))
+        self.root = tempfile.mkdtemp()
+        self.store = tiingo.BarStore(self.root)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def test_ingest_partitions_by_day(self):
+        added = tiingo.ingest(self.source, self.store, ['dogeusd'], datetime.date(2018, 8, 1),
+                              datetime.date(2018, 8, 3), window=2)
+
+        self.assertEqual(added, {'dogeusd': 72})
+        self.assertEqual(len(PricesHandler.requests), 2)
+        self.assertEqual(len(self.store.partitions('dogeusd')), 3)
+        self.assertEqual(sum(len(chunk) for chunk in self.store.chunks('dogeusd')), 72)
+
+    def test_ingest_resumes_without_duplicates(self):
+        tiingo.ingest(self.source, self.store, ['dogeusd'], datetime.date(2018, 8, 1), datetime.date(2018, 8, 2))
+        added = tiingo.ingest(self.source, self.store, ['dogeusd'], datetime.date(2018, 8, 1),
+                              datetime.date(2018, 8, 3))
+
+        # Only the last stored day and the new day are requested again
+        self.assertEqual([r['startDate'][0] for r in PricesHandler.requests[2:]], ['2018-08-02', '2018-08-03'])
+        self.assertEqual(added, {'dogeusd': 24})
+        self.assertEqual(sum(len(chunk) for chunk in self.store.chunks('dogeusd')), 72)
@@ -0,0 +1,114 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import robinhood
+import tools
+
+
+def instrument_id(number):
+    return '{:08x}-0000-0000-0000-000000000000'.format(number)
+
+
+##
+# A stand-in for the Robinhood API serving pages of orders and batches of instruments, failing on request
+class StubAPI(object):
+    PAGE_SIZE = 10
+
+    class Response(object):
+        def __init__(self, payload):
+            self.payload = payload
+            self.status_code = 200
+            self.content = b'{}'
+
+        def json(self):
+            return self.payload
+
+    def __init__(self, orders, fail_on_page=None):
+        self.orders = orders
+        self.fail_on_page = fail_on_page
+        self.requests = []
+
+    def get(self, uri, params=None):
+        self.requests.append((uri, params))
+        if uri.endswith('/instruments/'):
+            ids = params['ids'].split(',')
+            return self.Response({'results': [{'id': id, 'symbol': 'S' + id[:8].lstrip('0')} for id in ids]})
+
+        page = int(uri.split('cursor=')[1]) if 'cursor=' in uri else 0
+        if page == self.fail_on_page:
+            raise IOError('Connection reset')
+        start = page * self.PAGE_SIZE
+        more = start + self.PAGE_SIZE < len(self.orders)
+        return self.Response({
+            'results': self.orders[start:start + self.PAGE_SIZE],
+            'next': 'https://api.robinhood.com/orders/?cursor={}'.format(page + 1) if more else None
+        })
+
+
+def make_orders(count):
+    return [{
+        'id': str(number), 'state': 'filled' if number % 5 else 'cancelled', 'side': 'buy',
+        'instrument': 'https://api.robinhood.com/instruments/{}/'.format(instrument_id(number % 7 + 1)),
+        'last_transaction_at': '2018-01-01T00:00:00Z', 'quantity': '1.0', 'cumulative_quantity': '1.0',
+        'price': '10.0', 'average_price': '10.0'
+    } for number in range(count)]
+
+
+class TestExportOrders(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'orders.csv')
+        self.orders = make_orders(35)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def client(self, api):
+        client = robinhood.Client(calendar=None)
+        client.api = api
+        return client
+
+    def read_ids(self):
+        with open(self.filename, newline='') as file:
+            return [json.loads(row['Payload'])['id'] for row in csv.DictReader(file)]
+
+    def test_interrupted_export_resumes_without_duplicates(self):
+        with self.assertRaises(IOError):
+            tools.export_orders(self.client(StubAPI(self.orders, fail_on_page=2)), self.filename)
+        self.assertEqual(len(self.read_ids()), 16)
+
+        api = StubAPI(self.orders)
+        self.assertEqual(tools.export_orders(self.client(api), self.filename), 28)
+
+        expected = [order['id'] for order in self.orders if order['state'] == 'filled']
+        self.assertEqual(self.read_ids(), expected)
+        self.assertIn('cursor=2', [uri for uri, params in api.requests if 'orders' in uri][0])
+        self.assertFalse(os.path.exists(self.filename + '.checkpoint'))
+
+    def test_orders_are_not_changed_in_place(self):
+        tools.export_orders(self.client(StubAPI(self.orders)), self.filename, format='jsonl', states=None)
+        self.assertTrue(all('symbol' not in order for order in self.orders))
+        with open(self.filename) as file:
+            self.assertEqual(json.loads(file.readline())['symbol'], 'S1')
+
+
+class TestInstruments(TestCase):
+
+    def test_instruments_are_fetched_in_batches_once(self):
+        client = robinhood.Client(calendar=None)
+        client.api = StubAPI([])
+        ids = [instrument_id(number) for number in range(1, 61)]
+        urls = ['https://api.robinhood.com/instruments/{}/'.format(id) for id in ids]
+
+        instruments = client.instruments(*(urls + ids[:5]))
+        self.assertEqual([instrument['id'] for instrument in instruments], ids + ids[:5])
+        self.assertEqual(len(client.api.requests), 2)
+        self.assertEqual(len(client.api.requests[0][1]['ids'].split(',')), robinhood.INSTRUMENT_BATCH_SIZE)
+
+        self.assertEqual(client.instruments(ids[0], 'S1')[1]['id'], ids[0])
+        self.assertEqual(len(client.api.requests), 2)
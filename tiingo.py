@@ -1,14 +1,159 @@
+# Standard library imports
+import argparse
+import datetime
+import glob
+import logging
+import os
+
 import pandas as pd
+import requests
+
+ENDPOINT = 'https://api.tiingo.com/tiingo/crypto/prices'
+
+
+##
+# Intraday bars from Tiingo's crypto price API
+class TiingoSource(object):
+
+    ##
+    # @token A Tiingo API token, defaulting to TIINGO_TOKEN in the environment
+    # @endpoint The prices endpoint; point this elsewhere to use a stand-in
+    # @frequency The bar size, such as '1min'
+    def __init__(self, token=None, endpoint=ENDPOINT, frequency='1min', session=None):
+        self.token = token or os.environ.get('TIINGO_TOKEN')
+        self.endpoint = endpoint
+        self.frequency = frequency
+        self.session = session or requests.Session()
+
+    ##
+    # Fetch bars for one symbol between two dates, inclusive
+    # @return A pandas.DataFrame indexed by UTC timestamp, oldest first
+    def bars(self, symbol, start, end):
+        params = {
+            'tickers': symbol,
+            'resampleFreq': self.frequency,
+            'startDate': start.isoformat(),
+            'endDate': end.isoformat(),
+            'token': self.token
+        }
+        response = self.session.get(self.endpoint, params=params)
+        response.raise_for_status()
+        payload = response.json()
+
+        bars = pd.DataFrame(payload[0]['priceData'] if payload else [])
+        if bars.empty:
+            return bars
+        bars['date'] = pd.to_datetime(bars['date'], utc=True)
+        return bars.set_index('date').sort_index()
+
+
+##
+# An on-disk store of bars, partitioned by symbol and day: <root>/<symbol>/<YYYY-MM-DD>.csv
+# Each partition is indexed by timestamp and holds every bar at most once.
+class BarStore(object):
+
+    def __init__(self, root='./data/bars'):
+        self.root = root
+
+    def partition_for(self, symbol, day):
+        return os.path.join(self.root, symbol, '{}.csv'.format(day.strftime('%Y-%m-%d')))
+
+    ##
+    # List a symbol's partitions, oldest first
+    # @return A list of (date, filename) pairs
+    def partitions(self, symbol, start=None, end=None):
+        partitions = []
+        for filename in sorted(glob.glob(os.path.join(self.root, symbol, '*.csv'))):
+            day = datetime.datetime.strptime(os.path.basename(filename)[:-4], '%Y-%m-%d').date()
+            if (start is None or day >= start) and (end is None or day <= end):
+                partitions.append((day, filename))
+        return partitions
+
+    def read_partition(self, filename):
+        bars = pd.read_csv(filename, index_col='date')
+        bars.index = pd.to_datetime(bars.index, utc=True)
+        return bars
+
+    ##
+    # Add bars, replacing any already stored with the same timestamp
+    # @return The number of bars not previously stored
+    def append(self, symbol, bars):
+        added = 0
+        for day, group in bars.groupby(bars.index.normalize()):
+            filename = self.partition_for(symbol, day)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+            existing = self.read_partition(filename) if os.path.exists(filename) else None
+            if existing is not None:
+                added += int((~group.index.isin(existing.index)).sum())
+                group = pd.concat([existing, group])
+                group = group[~group.index.duplicated(keep='last')].sort_index()
+            else:
+                added += len(group)
+
+            # Write beside the partition and swap in, so an interrupted write never corrupts stored bars
+            group.to_csv(filename + '.tmp', index_label='date')
+            os.replace(filename + '.tmp', filename)
+        return added
+
+    ##
+    # The timestamp of the latest stored bar, or None if nothing is stored
+    def last_timestamp(self, symbol):
+        partitions = self.partitions(symbol)
+        if not partitions:
+            return None
+        return self.read_partition(partitions[-1][1]).index.max()
+
+    ##
+    # Read stored bars one partition at a time
+    # @return A generator of pandas.DataFrames, oldest first
+    def chunks(self, symbol, start=None, end=None):
+        for day, filename in self.partitions(symbol, start, end):
+            yield self.read_partition(filename)
+
+
+##
+# Download bars for each symbol into the store, in windows of days.
+# Each symbol resumes from the day of its latest stored bar; bars already stored are de-duplicated by timestamp.
+# @return A dict of the number of new bars per symbol
+def ingest(source, store, symbols, start, end=None, window=1):
+    end = end or datetime.datetime.utcnow().date()
+    added = {}
+
+    for symbol in symbols:
+        last = store.last_timestamp(symbol)
+        day = max(start, last.date()) if last is not None else start
+        added[symbol] = 0
+        logging.info('Ingesting %s from %s to %s', symbol, day, end)
+
+        while day <= end:
+            window_end = min(day + datetime.timedelta(days=window - 1), end)
+            bars = source.bars(symbol, day, window_end)
+            if not bars.empty:
+                added[symbol] += store.append(symbol, bars)
+            logging.info('  %s %s - %s: %i bars', symbol, day, window_end, len(bars))
+            day = window_end + datetime.timedelta(days=1)
+
+    return added
+
+
+def _date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
 
-token = "19742bb454fb9924b28de6ed1870846898de8d07"
 
-raw_data = pd.read_json("https://api.tiingo.com/tiingo/crypto/prices?tickers=dogeusd&resampleFreq=1min&startDate=2018-08-01&token=" + token)
-data1 = pd.DataFrame(raw_data['priceData'][0]).set_index('date')
-data1.to_csv("./dogeusd_1m_a.csv")
+##
+# Run from the command line, e.g. python tiingo.py dogeusd --start 2018-08-01
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
 
-raw_data = pd.read_json("https://api.tiingo.com/tiingo/crypto/prices?tickers=dogeusd&resampleFreq=1min&startDate=2018-08-03&token=" + token)
-data2 = pd.DataFrame(raw_data['priceData'][0]).set_index('date')
-data2.to_csv("./dogeusd_1m_b.csv")
+    parser = argparse.ArgumentParser(description='Download intraday bars from Tiingo into a local store')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--start', type=_date, required=True)
+    parser.add_argument('--end', type=_date)
+    parser.add_argument('--frequency', default='1min')
+    parser.add_argument('--window', type=int, default=1, help='days per request')
+    parser.add_argument('--root', default='./data/bars')
+    args = parser.parse_args()
 
-data = pd.concat([data1, data2]).drop_duplicates()
-data.to_csv("./dogeusd_1m.csv")
+    print(ingest(TiingoSource(frequency=args.frequency), BarStore(args.root), args.symbols, args.start, args.end,
+                 window=args.window))
@@ -1,71 +1,118 @@
 import sys
+import os
 import csv
 import json
 
 import robinhood
 
+# Columns written for each exported order
+ORDER_HEADERS = (
+    'Type', 'Trade Date', 'Settle Date', 'Symbol', 'Description', 'Trade Action', 'Qty', 'Price', 'Net Amount',
+    'Instrument', 'Payload')
+
 
 ##
 # An order downloader
-def download_orders_to_csv():
+def download_orders_to_csv(filename='orders.csv', states=('filled',)):
     # Create a new robinhood client
     client = robinhood.Client()
 
-    # Download all orders
-    print('Fetching orders')
-    orders = client.orders.list()
-
-    with open('orders.json', 'w', newline='') as file:
-        data = [order.data for order in orders]
-        file.writelines(data)
+    try:
+        return export_orders(client, filename, format='csv', states=states)
 
-    return orders
+    # Sign out
+    finally:
+        client.logout()
 
-    # Filter to only those orders with 'filled' state
-    print('Keeping filled orders')
-    orders = [order for order in orders if order['state'] == 'filled']
 
-    # Sort
-    print('Sorting orders')
-    orders.sort(key=lambda order: order['last_transaction_at'])
+##
+# Stream every order to disk, one page at a time.
+# Progress is checkpointed alongside the output after every page, so an interrupted export resumes where it stopped.
+# Orders are written in the order the API returns them (newest first).
+# @client A robinhood.Client
+# @filename The file to write
+# @format Either 'csv' or 'jsonl'
+# @states Only export orders in these states; None for all
+# @return The number of orders written in total
+def export_orders(client, filename, format='csv', states=('filled',)):
+    if format not in {'csv', 'jsonl'}:
+        raise ValueError('Unknown export format {}'.format(format))
 
-    # Add symbol to each order
-    print('Fetching symbols')
-    for order in orders:
-        order['symbol'] = client.instrument(order['instrument'])['symbol']
-        print(order['symbol'])
+    # Resume from the checkpoint, if there is one, discarding anything written after it
+    checkpoint_filename = filename + '.checkpoint'
+    checkpoint = _read_checkpoint(checkpoint_filename) if os.path.exists(filename) else None
+    if checkpoint and not checkpoint['next']:
+        os.remove(checkpoint_filename)
+        return checkpoint['rows']
+    elif checkpoint:
+        print('Resuming after {} orders'.format(checkpoint['rows']))
+        with open(filename, 'a') as file:
+            file.truncate(checkpoint['offset'])
+    else:
+        checkpoint = {'next': None, 'rows': 0, 'offset': 0}
 
-    # Open the CSV and prepare a writer
-    print('Writing to disk')
-    with open('orders.csv', 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
+    with open(filename, 'a' if checkpoint['offset'] else 'w', newline='') as file:
+        writer = csv.writer(file) if format == 'csv' else None
 
         # Write headers to CSV
-        headers = (
-            'Type', 'Trade Date', 'Settle Date', 'Symbol', 'Description', 'Trade Action', 'Qty', 'Price', 'Net Amount',
-            'Instrument', 'Payload')
-        writer.writerow(headers)
-
-        # Write contents to CSV
-        for order in orders:
-            row = (
-                'order',
-                order['last_transaction_at'],
-                None,
-                order['symbol'],
-                None,
-                order['side'],
-                order['cumulative_quantity'] or order['quantity'],
-                order['average_price'] or order['price'],
-                None,
-                order['instrument'],
-                order.data
-            )
-            print(row)
-            writer.writerow(row)
+        if writer and not checkpoint['offset']:
+            writer.writerow(ORDER_HEADERS)
 
-    # Sign out
-    client.logout()
+        # Fetch and write one page at a time
+        print('Fetching orders')
+        for orders, next_uri in client.orders.pages(start=checkpoint['next']):
+            if states:
+                orders = [order for order in orders if order['state'] in states]
+
+            # Resolve all of this page's symbols in bulk; orders belong to the parsed response, so rows are copies
+            instruments = client.instruments(*[order['instrument'] for order in orders])
+            for order, instrument in zip(orders, instruments):
+                row = dict(order, symbol=instrument['symbol'])
+                if writer:
+                    writer.writerow(_order_row(row))
+                else:
+                    file.write(json.dumps(row) + '\n')
+
+            # Written pages are not needed again, so are not left in the response cache
+            client.reset_cache()
+            file.flush()
+            checkpoint = {'next': next_uri, 'rows': checkpoint['rows'] + len(orders), 'offset': file.tell()}
+            _write_checkpoint(checkpoint_filename, checkpoint)
+            print('Written {} orders'.format(checkpoint['rows']))
+
+    # Finished, so there is nothing to resume
+    os.remove(checkpoint_filename)
+    return checkpoint['rows']
+
+
+def _order_row(order):
+    return (
+        'order',
+        order['last_transaction_at'],
+        None,
+        order['symbol'],
+        None,
+        order['side'],
+        order['cumulative_quantity'] or order['quantity'],
+        order['average_price'] or order['price'],
+        None,
+        order['instrument'],
+        json.dumps(order)
+    )
+
+
+def _read_checkpoint(filename):
+    try:
+        with open(filename) as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_checkpoint(filename, checkpoint):
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(filename + '.tmp', filename)
 
 ##
 # Run downloader?